@@ -0,0 +1,330 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import pandas as pd
+from docx import Document
+from PyPDF2 import PdfWriter
+
+try:
+    from moto.server import ThreadedMotoServer
+except ImportError:
+    # Without moto the upload stage needs --s3-endpoint (e.g. a local MinIO)
+    ThreadedMotoServer = None
+
+
+# One template per language group, named the way load_state_templates looks them up, with a line of text in its script
+template_texts = {
+    'hindi': "प्रिय ग्राहक, आपके ऋण खाते की बकाया राशि",
+    'bengali': "প্রিয় গ্রাহক, আপনার ঋণ অ্যাকাউন্টের বকেয়া পরিমাণ",
+    'assamese': "প্ৰিয় গ্ৰাহক, আপোনাৰ ঋণ একাউণ্টৰ বাকী ধন",
+    'gujarati': "પ્રિય ગ્રાહક, તમારા લોન ખાતાની બાકી રકમ",
+    'marathi': "प्रिय ग्राहक, आपल्या कर्ज खात्याची थकबाकी रक्कम",
+    'punjabi': "ਪਿਆਰੇ ਗਾਹਕ, ਤੁਹਾਡੇ ਕਰਜ਼ਾ ਖਾਤੇ ਦੀ ਬਕਾਇਆ ਰਕਮ",
+    'tamil': "அன்புள்ள வாடிக்கையாளர், உங்கள் கடன் கணக்கின் நிலுவைத் தொகை",
+    'malayalam': "പ്രിയ ഉപഭോക്താവേ, നിങ്ങളുടെ വായ്പ അക്കൗണ്ടിലെ കുടിശ്ശിക തുക",
+    'kannada': "ಪ್ರಿಯ ಗ್ರಾಹಕರೇ, ನಿಮ್ಮ ಸಾಲ ಖಾತೆಯ ಬಾಕಿ ಮೊತ್ತ",
+    'odiya': "ପ୍ରିୟ ଗ୍ରାହକ, ଆପଣଙ୍କ ଋଣ ଖାତାର ବକେୟା ରାଶି",
+    'telugu': "ప్రియమైన కస్టమర్, మీ రుణ ఖాతా బకాయి మొత్తం",
+    'default': "Dear customer, the outstanding amount on your loan account",
+}
+
+potential_column_names = ['Filename', 'Prospect_no', 'LAN_Details', 'CUID_NO']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Time each stage of final.py on synthetic data, without network access.")
+    parser.add_argument('--records', type=int, default=1000, help="Rows in the synthetic lang_data.xlsx")
+    parser.add_argument('--states', default=None, help="State mix as STATE=weight pairs, e.g. 'BIHAR=3,TAMIL NADU=1'. Default is every state equally")
+    parser.add_argument('--templates', choices=['docx', 'html'], default='docx', help="Render DOCX templates (then convert) or direct-to-PDF HTML templates")
+    parser.add_argument('--render-processes', type=int, default=0, help="Render worker processes, 0 renders in this process")
+    parser.add_argument('--converter', default='libreoffice', help="PDF converter for DOCX templates")
+    parser.add_argument('--merge-mode', default='streaming', choices=['pypdf', 'streaming', 'dedup'])
+    parser.add_argument('--merge-batch-size', type=int, default=2000)
+    parser.add_argument('--s3-endpoint', default=None, help="Local S3 stand-in to upload to. Default starts a moto server")
+    parser.add_argument('--seed', type=int, default=1, help="Seed for the synthetic data")
+    parser.add_argument('--work-dir', default=None, help="Folder for the generated files. Default is a temporary folder, deleted afterwards")
+    parser.add_argument('--results', default='benchmark_results.jsonl', help="File the result is appended to, one JSON object per run")
+    parser.add_argument('--label', default='', help="Free text stored with the result, e.g. the change being measured")
+    return parser.parse_args()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_state_mix(states, all_states):
+    if not states:
+        return {state: 1.0 for state in all_states}
+    mix = {}
+    for pair in states.split(','):
+        state, _, weight = pair.partition('=')
+        mix[state.strip().upper()] = float(weight or 1)
+    return mix
+
+
+def make_templates(lang_dir, kind):
+    os.makedirs(lang_dir, exist_ok=True)
+    for language, text in template_texts.items():
+        if kind == 'html':
+            with open(os.path.join(lang_dir, f"{language}_template.html"), 'w', encoding='utf-8') as f:
+                f.write(f"<h2>{text}</h2>\n<p>{{{{ Name }}}}, {{{{ Address }}}}</p>\n"
+                        f"<p>LAN {{{{ LAN_Details }}}}: {{{{ Amount }}}}</p>\n<p>{text}. {{{{ State }}}}</p>\n")
+            continue
+
+        document = Document()
+        document.add_heading(text, level=1)
+        document.add_paragraph("{{ Name }}, {{ Address }}")
+        table = document.add_table(rows=2, cols=3)
+        for cell, value in zip(table.rows[0].cells, ("LAN", "Amount", "State")):
+            cell.text = value
+        for cell, value in zip(table.rows[1].cells, ("{{ LAN_Details }}", "{{ Amount }}", "{{ State }}")):
+            cell.text = value
+        for _ in range(5):
+            document.add_paragraph(f"{text}. " * 4)
+        document.save(os.path.join(lang_dir, f"{language}_template.docx"))
+
+
+def make_lang_data(data_path, records, state_mix, seed):
+    rng = random.Random(seed)
+    states = rng.choices(list(state_mix), weights=list(state_mix.values()), k=records)
+    df = pd.DataFrame({
+        'SrNo': range(1, records + 1),
+        'LAN_Details': [f"LAN{seed:03d}{index:08d}" for index in range(records)],
+        'Name': [f"Customer {rng.randint(1, 10 ** 6)}" for _ in range(records)],
+        'Address': [f"{rng.randint(1, 999)} Main Road, Sector {rng.randint(1, 80)}" for _ in range(records)],
+        'Amount': [round(rng.uniform(1000, 500000), 2) for _ in range(records)],
+        'State': states,
+    })
+    df.to_excel(data_path, sheet_name="Sheet1", index=False)
+
+
+def make_stand_in_pdfs(final, df, output_dir):
+    # Used when no converter is installed, so compression, merge and upload still have input
+    for file_name in df['LAN_Details']:
+        if final.FPDF is not None:
+            pdf = final.FPDF()
+            pdf.add_page()
+            pdf.set_font('helvetica', size=11)
+            pdf.multi_cell(0, 6, text=f"Stand-in PDF for {file_name}. " * 40)
+            pdf_path = final.make_output_path(output_dir, file_name)
+            pdf.output(pdf_path)
+        else:
+            writer = PdfWriter()
+            writer.add_blank_page(595, 842)
+            pdf_path = final.make_output_path(output_dir, file_name)
+            with open(pdf_path, 'wb') as f:
+                writer.write(f)
+        final.place_output_file(output_dir, pdf_path)
+
+
+def time_stage(final, results, name, func, documents=None):
+    # Unless given, documents and failures are what the stage recorded in final.metrics, so a stage
+    # that produced nothing doesn't show up as fast
+    before = final.metrics.report()['stages'].get(name, {})
+    start_time = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - start_time
+    after = final.metrics.report()['stages'].get(name, {})
+    if documents is None:
+        documents = after.get('documents', 0) - before.get('documents', 0)
+    failures = after.get('failures', 0) - before.get('failures', 0)
+    results[name] = {'seconds': round(seconds, 3), 'documents': documents, 'failures': failures,
+                     'per_second': round(documents / seconds, 2) if seconds and documents else None}
+    print(f"{name:>9}: {seconds:8.2f}s  {documents} documents" + (f", {failures} failed" if failures else ""))
+
+
+def find_missing_fonts(final, template_dict, state_mix):
+    # Font files the direct-to-PDF templates of the states in the mix need but FONTS_DIR doesn't have
+    font_files = set()
+    for state in state_mix:
+        template_path = template_dict.get(state) or template_dict.get('DEFAULT')
+        if template_path:
+            language = os.path.basename(template_path).split('_template')[0].lower()
+            font_files.add(final.language_font_dict.get(language, final.language_font_dict['default']))
+    return sorted(font_file for font_file in font_files if not os.path.exists(os.path.join(final.FONTS_DIR, font_file)))
+
+
+def skip_stage(results, name, reason):
+    results[name] = {'skipped': reason}
+    print(f"{name:>9}: skipped ({reason})")
+
+
+def print_comparison(result, results_path):
+    # Compare with the last earlier run with the same parameters
+    previous = None
+    if os.path.exists(results_path):
+        with open(results_path, encoding='utf-8') as f:
+            for line in f:
+                run = json.loads(line)
+                if run['params'] == result['params']:
+                    previous = run
+    if previous is None:
+        return
+
+    print(f"\nCompared with {previous['timestamp']} ({previous.get('git_commit')}, {previous.get('label') or 'no label'}):")
+    for name, stage in result['stages'].items():
+        old_stage = previous['stages'].get(name, {})
+        if stage.get('seconds') and old_stage.get('seconds'):
+            change = 100 * (stage['seconds'] - old_stage['seconds']) / old_stage['seconds']
+            print(f"{name:>9}: {old_stage['seconds']:8.2f}s -> {stage['seconds']:8.2f}s ({change:+.0f}%)")
+
+
+def main():
+    args = parse_args()
+    work_dir = os.path.abspath(args.work_dir or tempfile.mkdtemp(prefix="pdf_benchmark_"))
+    results_path = os.path.abspath(args.results)
+    lang_dir = os.path.join(work_dir, "lang")
+    output_dir = os.path.join(work_dir, "OUTPUT")
+    compress_dir = os.path.join(work_dir, "COMPRESS")
+    merge_dir = os.path.join(work_dir, "MERGED")
+    for directory in (output_dir, compress_dir, merge_dir, os.path.join(work_dir, "UPLOAD_FAIL_FILES")):
+        os.makedirs(directory, exist_ok=True)
+
+    moto_server = None
+    s3_endpoint = args.s3_endpoint
+    if s3_endpoint is None and ThreadedMotoServer is not None:
+        port = free_port()
+        moto_server = ThreadedMotoServer(ip_address='127.0.0.1', port=port)
+        moto_server.start()
+        s3_endpoint = f"http://127.0.0.1:{port}"
+
+    # final.py reads its settings when it is imported
+    os.environ.update({
+        'PDF_CONVERTER': args.converter,
+        'DIRECT_PDF_TEMPLATES': 'yes' if args.templates == 'html' else 'no',
+        'MERGE_MODE': args.merge_mode,
+        'DATA_CACHE_DIR': os.path.join(work_dir, ".cache"),
+        'METRICS_DIR': work_dir,
+        'S3_BUCKET_NAME': 'benchmark',
+        'AWS_ACCESS_KEY_ID': os.environ.get('AWS_ACCESS_KEY_ID', 'benchmark'),
+        'AWS_SECRET_ACCESS_KEY': os.environ.get('AWS_SECRET_ACCESS_KEY', 'benchmark'),
+        'AWS_REGION': os.environ.get('AWS_REGION', 'us-east-1'),
+    })
+    if s3_endpoint:
+        os.environ['S3_ENDPOINT_URL'] = s3_endpoint
+
+    # Keep final.py's log files with the generated data
+    os.chdir(work_dir)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import final
+
+    # Keep the console for the timings, the log files still get everything
+    final.configure_logging(final.info_log_file, final.error_log_file)
+    final.log_handlers['console'].setLevel(logging.WARNING)
+    for name in ('botocore', 'boto3', 's3transfer', 'urllib3', 'werkzeug'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    state_mix = parse_state_mix(args.states, list(final.state_template_dict))
+    make_templates(lang_dir, args.templates)
+    data_path = os.path.join(lang_dir, "lang_data.xlsx")
+    make_lang_data(data_path, args.records, state_mix, args.seed)
+
+    template_dict = dict.fromkeys(final.state_template_dict)
+    final.load_state_templates(template_dict, lang_dir)
+
+    stages = {}
+    try:
+        if args.templates == 'html':
+            missing_fonts = find_missing_fonts(final, template_dict, state_mix)
+            if missing_fonts:
+                sys.exit(f"--templates html needs these fonts in FONTS_DIR ({final.FONTS_DIR}): {', '.join(missing_fonts)}")
+
+        df = None
+
+        def ingest():
+            nonlocal df
+            df = final.load_lang_data(data_path)
+        time_stage(final, stages, 'ingest', ingest, documents=args.records)
+
+        def render():
+            records = df.to_dict('records')
+            if args.render_processes > 0:
+                with final.ProcessPoolExecutor(max_workers=args.render_processes, initializer=final.reset_template_cache_stats) as executor:
+                    final.render_records_in_processes(executor, records, output_dir, template_dict, potential_column_names)
+            else:
+                for record in records:
+                    final.process_record(record, output_dir, template_dict, potential_column_names)
+        time_stage(final, stages, 'render', render)
+
+        if args.templates == 'html':
+            skip_stage(stages, 'convert', "direct-to-PDF templates")
+        elif args.converter == 'libreoffice' and not shutil.which(final.SOFFICE_PATH):
+            skip_stage(stages, 'convert', f"{final.SOFFICE_PATH} not found, using stand-in PDFs")
+            for file_name in os.listdir(output_dir):
+                if file_name.endswith('.docx'):
+                    os.remove(os.path.join(output_dir, file_name))
+            make_stand_in_pdfs(final, df, output_dir)
+        else:
+            file_names = [final.get_record_file_name(record, potential_column_names) for record in df.to_dict('records')]
+            time_stage(final, stages, 'convert', lambda: final.generate_pdf_from_docx(output_dir, file_names))
+            final.close_pdf_converter()
+
+        if shutil.which(final.GHOSTSCRIPT_PATH) and shutil.which(final.QPDF_PATH):
+            time_stage(final, stages, 'compress', lambda: final.compressing_pdf(output_dir, compress_dir))
+        else:
+            skip_stage(stages, 'compress', "Ghostscript or qpdf not found, PDFs copied as they are")
+            for file_name, (pdf_path, _) in final.list_output_files(output_dir).items():
+                final.place_output_file(compress_dir, shutil.copy(pdf_path, final.make_output_path(compress_dir, file_name)))
+
+        time_stage(final, stages, 'merge',
+                   lambda: final.merge_pdfs_by_srno(compress_dir, merge_dir, data_path, potential_column_names, batch_size=args.merge_batch_size, mode=args.merge_mode))
+
+        if s3_endpoint:
+            final.get_s3_client(final.AWS_ACCESS_KEY_ID, final.AWS_SECRET_ACCESS_KEY, final.AWS_REGION).create_bucket(Bucket=final.S3_BUCKET_NAME)
+            time_stage(final, stages, 'upload',
+                       lambda: final.uploading_to_s3(compress_dir, "benchmark", final.S3_BUCKET_NAME, final.AWS_ACCESS_KEY_ID, final.AWS_SECRET_ACCESS_KEY,
+                                                     final.AWS_REGION, os.path.join(work_dir, "UPLOAD_FAIL_FILES")))
+        else:
+            skip_stage(stages, 'upload', "no local S3 stand-in (install moto or pass --s3-endpoint)")
+
+        result = {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'label': args.label,
+            'git_commit': git_commit(),
+            'host': {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count()},
+            'params': {'records': args.records, 'states': args.states, 'templates': args.templates, 'render_processes': args.render_processes,
+                       'converter': args.converter, 'merge_mode': args.merge_mode, 'merge_batch_size': args.merge_batch_size, 'seed': args.seed},
+            'stages': stages,
+            'metrics': final.metrics.report(),
+        }
+        # A run where a stage lost documents would become a misleading baseline for later runs
+        incomplete = [name for name, stage in stages.items() if 'documents' in stage and stage['documents'] < args.records]
+        if incomplete:
+            logs = f"see the logs in {work_dir}" if args.work_dir else "rerun with --work-dir to keep the logs"
+            sys.exit(f"\nNot saved to {results_path}: {', '.join(incomplete)} produced fewer than {args.records} documents, {logs}")
+        print_comparison(result, results_path)
+        with open(results_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(result) + "\n")
+        print(f"\nResult appended to {results_path}")
+    finally:
+        if moto_server is not None:
+            moto_server.stop()
+        os.chdir(os.path.dirname(results_path))
+        if args.work_dir is None:
+            final.close_output_indexes()
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,20 +2,79 @@ import os
 from concurrent.futures import as_completed
 import pandas as pd
 from docxtpl import DocxTemplate
-import comtypes.client
+try:
+    import comtypes.client
+except ImportError:
+    # Word COM automation is only available on Windows
+    comtypes = None
 from concurrent.futures import ThreadPoolExecutor
 import psutil
 from docx2pdf import convert
-from PyPDF2 import PdfMerger
+from PyPDF2 import PdfMerger, PdfReader, PdfWriter
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, NullObject, NumberObject, StreamObject
 import boto3
-from botocore.exceptions import NoCredentialsError, ClientError
+from boto3.s3.transfer import TransferConfig
+from boto3.exceptions import S3UploadFailedError
+from botocore.config import Config
+from botocore.exceptions import NoCredentialsError, ClientError, HTTPClientError
+from botocore.exceptions import ConnectionError as BotoConnectionError
 import subprocess
 import shutil
 from dotenv import load_dotenv
 import logging
+import logging.handlers
 import traceback
 import asyncio
+import time
+import random
+import hashlib
+import json
+import argparse
+import sqlite3
+import socket
+import sys
 from datetime import datetime
+import copy
+import threading
+from jinja2 import Environment
+import queue
+import atexit
+import tempfile
+import io
+import re
+import zipfile
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import util as multiprocessing_util
+
+try:
+    from fpdf import FPDF
+    # fpdf2 and fontTools log every font table they read and subset at DEBUG, which is the root logger's level
+    logging.getLogger('fpdf').setLevel(logging.WARNING)
+    logging.getLogger('fontTools').setLevel(logging.WARNING)
+except ImportError:
+    # Only needed for direct-to-PDF (.html) templates
+    FPDF = None
+
+try:
+    import pyarrow
+except ImportError:
+    # Without pyarrow the ingest cache is stored as a pickle instead of Parquet
+    pyarrow = None
+try:
+    import uno
+except ImportError:
+    # LibreOffice's python bridge; without it soffice is driven from the command line
+    uno = None
+try:
+    import pythoncom
+    import win32com.client
+    import win32gui
+    import win32process
+except ImportError:
+    # pywin32's COM support, Windows only
+    pythoncom = None
 
 
 load_dotenv()
@@ -26,6 +85,54 @@ AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 AWS_REGION = os.getenv("AWS_REGION")
 S3_URI = os.getenv("S3_URI")
 URI = os.getenv("URI")
+PDF_CONVERTER = os.getenv("PDF_CONVERTER", "word")
+CONVERTER_WORKERS = int(os.getenv("CONVERTER_WORKERS") or os.cpu_count() or 1)
+SOFFICE_PATH = os.getenv("SOFFICE_PATH", "soffice")
+CONVERT_TIMEOUT = float(os.getenv("CONVERT_TIMEOUT") or 120)
+CONVERT_ATTEMPTS = int(os.getenv("CONVERT_ATTEMPTS") or 2)
+CONVERTER_RECYCLE_DOCUMENTS = int(os.getenv("CONVERTER_RECYCLE_DOCUMENTS") or 500)
+CONVERTER_RECYCLE_MB = int(os.getenv("CONVERTER_RECYCLE_MB") or 1024)
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "batch")
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE") or 100)
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS") or 2)
+CONVERT_WORKERS = int(os.getenv("CONVERT_WORKERS") or CONVERTER_WORKERS)
+COMPRESS_WORKERS = int(os.getenv("COMPRESS_WORKERS") or os.cpu_count() or 1)
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS") or 8)
+RENDER_PROCESSES = int(os.getenv("RENDER_PROCESSES") or 0)
+RENDER_GROUP_SIZE = int(os.getenv("RENDER_GROUP_SIZE") or 50)
+RENDER_IN_MEMORY = os.getenv("RENDER_IN_MEMORY", "no").strip().lower() in ("yes", "true", "1")
+# RAM-backed by default on Linux, for converters that can only read DOCX files
+SCRATCH_DIR = os.getenv("SCRATCH_DIR") or ("/dev/shm" if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) else tempfile.gettempdir())
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+S3_UPLOAD_ATTEMPTS = int(os.getenv("S3_UPLOAD_ATTEMPTS") or 5)
+S3_RETRY_BASE_DELAY = float(os.getenv("S3_RETRY_BASE_DELAY") or 1)
+S3_MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD_MB") or 16) * 1024 * 1024
+S3_MULTIPART_CONCURRENCY = int(os.getenv("S3_MULTIPART_CONCURRENCY") or 8)
+S3_RECONCILE = os.getenv("S3_RECONCILE", "no").strip().lower() in ("yes", "true", "1")
+S3_KEY_LAYOUT = os.getenv("S3_KEY_LAYOUT", "flat").strip().lower()
+COMPRESSION_PROFILE = os.getenv("COMPRESSION_PROFILE", "default")
+GHOSTSCRIPT_PATH = os.getenv("GHOSTSCRIPT_PATH") or shutil.which("gs") or shutil.which("gswin64c") or shutil.which("gswin32c") or "gs"
+QPDF_PATH = os.getenv("QPDF_PATH") or shutil.which("qpdf") or "qpdf"
+MERGE_MODE = os.getenv("MERGE_MODE", "pypdf")
+MERGE_PROCESSES = int(os.getenv("MERGE_PROCESSES") or 1)
+MISSING_RETRY_ATTEMPTS = int(os.getenv("MISSING_RETRY_ATTEMPTS") or 3)
+LANG_DATA_FILE = os.getenv("LANG_DATA_FILE") or None
+DATA_CACHE_DIR = os.getenv("DATA_CACHE_DIR") or None
+JOURNAL_PATH = os.getenv("JOURNAL_PATH") or None
+DEDUP_POLICY = os.getenv("DEDUP_POLICY", "keep-last").strip().lower()
+SHARD_LEASE_SECONDS = int(os.getenv("SHARD_LEASE_SECONDS") or 600)
+SHARD_ATTEMPTS = int(os.getenv("SHARD_ATTEMPTS") or 3)
+METRICS_DIR = os.getenv("METRICS_DIR") or None
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").strip().upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS") or ""
+LOG_SAMPLE_RATE = int(os.getenv("LOG_SAMPLE_RATE") or 100)
+EVENTS_LOG_FILE = os.getenv("EVENTS_LOG_FILE") or "events.jsonl"
+INCREMENTAL = os.getenv("INCREMENTAL", "no").strip().lower() in ("yes", "true", "1")
+MANIFEST_PATH = os.getenv("MANIFEST_PATH") or None
+OUTPUT_LAYOUT = os.getenv("OUTPUT_LAYOUT", "flat").strip().lower()
+DIRECT_PDF_TEMPLATES = os.getenv("DIRECT_PDF_TEMPLATES", "no").strip().lower() in ("yes", "true", "1")
+OVERLAY_TEMPLATES = os.getenv("OVERLAY_TEMPLATES", "no").strip().lower() in ("yes", "true", "1")
+FONTS_DIR = os.getenv("FONTS_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "fonts")
 
 
 
@@ -79,114 +186,1596 @@ state_template_dict = {
 }
 
 
+# Fonts embedded by the direct-to-PDF engine, looked up in FONTS_DIR by the template's language
+language_font_dict = {
+    # Devanagari
+    'hindi': 'NotoSansDevanagari-Regular.ttf',
+    'marathi': 'NotoSansDevanagari-Regular.ttf',
 
+    # Bengali-Assamese
+    'bengali': 'NotoSansBengali-Regular.ttf',
+    'assamese': 'NotoSansBengali-Regular.ttf',
 
-def configure_logging(info_log_file, error_log_file):
-    # Basic configuration for logging
-    logging.basicConfig(level=logging.DEBUG,
-                        format='%(message)s')
+    'gujarati': 'NotoSansGujarati-Regular.ttf',
+    'punjabi': 'NotoSansGurmukhi-Regular.ttf',
+    'tamil': 'NotoSansTamil-Regular.ttf',
+    'malayalam': 'NotoSansMalayalam-Regular.ttf',
 
-    # Create separate handlers for INFO and ERROR messages
-    info_handler = logging.FileHandler(info_log_file)
-    error_handler = logging.FileHandler(error_log_file)
+    'kanada': 'NotoSansKannada-Regular.ttf',
+    'kannada': 'NotoSansKannada-Regular.ttf',
+    'kannda': 'NotoSansKannada-Regular.ttf',
 
-    # Set the logging level for each handler
-    info_handler.setLevel(logging.INFO)
-    error_handler.setLevel(logging.ERROR)
+    'odiya': 'NotoSansOriya-Regular.ttf',
+    'orissa': 'NotoSansOriya-Regular.ttf',
+    'orisa': 'NotoSansOriya-Regular.ttf',
+    'oriya': 'NotoSansOriya-Regular.ttf',
 
-    # Create formatters for each handler
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    # formatter = logging.Formatter('%(message)s')
-    info_handler.setFormatter(formatter)
-    error_handler.setFormatter(formatter)
+    'telugu': 'NotoSansTelugu-Regular.ttf',
+    'telgue': 'NotoSansTelugu-Regular.ttf',
+    'telegu': 'NotoSansTelugu-Regular.ttf',
+
+    # Latin, also used as the fallback for English text in the other languages
+    'default': 'NotoSans-Regular.ttf',
+}
+
+
+# Ghostscript settings per compression quality profile. 'default' gives the same output as plain ps2pdf.
+compression_profiles = {
+    'screen': ['-dPDFSETTINGS=/screen'],      # 72 dpi images, smallest files
+    'ebook': ['-dPDFSETTINGS=/ebook'],        # 150 dpi images
+    'printer': ['-dPDFSETTINGS=/printer'],    # 300 dpi images
+    'prepress': ['-dPDFSETTINGS=/prepress'],  # 300 dpi images, colour preserving
+    'default': [],
+}
+
+
+# Parsed templates are cached per worker process, keyed on path and mtime
+template_cache = {}
+template_cache_stats = {'hits': 0, 'misses': 0}
+template_cache_lock = threading.Lock()
+# Overlay templates by template path: (mtime, overlay dict or None when the template is not eligible)
+overlay_template_cache = {}
+
+
+class CachingJinjaEnvironment(Environment):
+    # docxtpl compiles the same template XML for every record it renders.
+    # Keep the compiled templates so each record only pays for the render itself.
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.compiled_templates = {}
+
+    def from_string(self, source, globals=None, template_class=None):
+        if globals is not None or template_class is not None:
+            return super().from_string(source, globals, template_class)
 
-    # Add the handlers to the root logger
-    logging.getLogger().addHandler(info_handler)
-    logging.getLogger().addHandler(error_handler)
+        template = self.compiled_templates.get(source)
+        if template is None:
+            template = super().from_string(source)
+            self.compiled_templates[source] = template
+        return template
 
 
+
+
+class RunMetrics:
+    """
+    Per-stage counters for a run: per-document latency histograms, documents and failures per stage,
+    state and template, bytes in and out, and queue depths. Written out by write_report() at the end of a run.
+    """
+    # Upper bounds of the latency histogram buckets, in seconds
+    buckets = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float('inf'))
+    # Stages every document goes through, the candidates for the bottleneck; dedup runs once for the whole input
+    pipeline_stages = ('render', 'convert', 'compress', 'merge', 'upload')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.started_at = time.time()
+        self.stages = {}
+        self.labels = {}
+        self.queues = {}
+
+    def _stage(self, stage):
+        entry = self.stages.get(stage)
+        if entry is None:
+            entry = {'documents': 0, 'failures': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'bytes_in': 0, 'bytes_out': 0,
+                     'buckets': [0] * len(self.buckets), 'first_start': None, 'last_end': None}
+            self.stages[stage] = entry
+        return entry
+
+    def observe(self, stage, seconds, count=1, ok=True, state=None, template=None, bytes_in=0, bytes_out=0):
+        # seconds covers all count documents; batch conversions and merges report their batch time
+        end = time.time()
+        per_document = seconds / count if count else seconds
+        with self.lock:
+            entry = self._stage(stage)
+            if not ok:
+                entry['failures'] += count
+                return
+            entry['documents'] += count
+            entry['seconds'] += seconds
+            entry['max_seconds'] = max(entry['max_seconds'], per_document)
+            entry['bytes_in'] += bytes_in
+            entry['bytes_out'] += bytes_out
+            bucket = next(index for index, bound in enumerate(self.buckets) if per_document <= bound)
+            entry['buckets'][bucket] += count
+            start = end - seconds
+            entry['first_start'] = start if entry['first_start'] is None else min(entry['first_start'], start)
+            entry['last_end'] = end if entry['last_end'] is None else max(entry['last_end'], end)
+
+            for label, value in (('state', state), ('template', template)):
+                if value:
+                    key = (stage, label, value)
+                    documents, total_seconds = self.labels.get(key, (0, 0.0))
+                    self.labels[key] = (documents + count, total_seconds + seconds)
+
+    def observe_queue(self, stage, depth):
+        with self.lock:
+            samples, total, maximum = self.queues.get(stage, (0, 0, 0))
+            self.queues[stage] = (samples + 1, total + depth, max(maximum, depth))
+
+    def drain(self):
+        # Used by render worker processes to hand their counters to the parent
+        with self.lock:
+            snapshot = {'stages': self.stages, 'labels': self.labels, 'queues': self.queues}
+            self.reset()
+        return snapshot
+
+    def merge(self, snapshot):
+        with self.lock:
+            for stage, other in snapshot['stages'].items():
+                entry = self._stage(stage)
+                for key in ('documents', 'failures', 'seconds', 'bytes_in', 'bytes_out'):
+                    entry[key] += other[key]
+                entry['max_seconds'] = max(entry['max_seconds'], other['max_seconds'])
+                entry['buckets'] = [a + b for a, b in zip(entry['buckets'], other['buckets'])]
+                for key, pick in (('first_start', min), ('last_end', max)):
+                    values = [value for value in (entry[key], other[key]) if value is not None]
+                    entry[key] = pick(values) if values else None
+            for key, (documents, seconds) in snapshot['labels'].items():
+                old_documents, old_seconds = self.labels.get(key, (0, 0.0))
+                self.labels[key] = (old_documents + documents, old_seconds + seconds)
+            for stage, (samples, total, maximum) in snapshot['queues'].items():
+                old_samples, old_total, old_maximum = self.queues.get(stage, (0, 0, 0))
+                self.queues[stage] = (old_samples + samples, old_total + total, max(old_maximum, maximum))
+
+    def report(self):
+        with self.lock:
+            finished_at = time.time()
+            stages = {}
+            for stage, entry in self.stages.items():
+                wall_seconds = (entry['last_end'] - entry['first_start']) if entry['documents'] else 0
+                stages[stage] = {
+                    'documents': entry['documents'],
+                    'failures': entry['failures'],
+                    'busy_seconds': round(entry['seconds'], 3),
+                    'wall_seconds': round(wall_seconds, 3),
+                    'throughput_per_second': round(entry['documents'] / wall_seconds, 3) if wall_seconds else None,
+                    'mean_seconds': round(entry['seconds'] / entry['documents'], 4) if entry['documents'] else None,
+                    'max_seconds': round(entry['max_seconds'], 4),
+                    'bytes_in': entry['bytes_in'],
+                    'bytes_out': entry['bytes_out'],
+                    'latency_buckets': {str(bound): count for bound, count in zip(self.buckets, entry['buckets'])},
+                    'by_state': {},
+                    'by_template': {},
+                }
+            for (stage, label, value), (documents, seconds) in sorted(self.labels.items()):
+                stages[stage][f'by_{label}'][value] = {'documents': documents, 'busy_seconds': round(seconds, 3)}
+            queues = {stage: {'max_depth': maximum, 'mean_depth': round(total / samples, 2)} for stage, (samples, total, maximum) in self.queues.items()}
+
+        # The pipeline stage with the most busy time per document is the first place to look
+        ranked = sorted((stage for stage in stages if stage in self.pipeline_stages and stages[stage]['mean_seconds']),
+                        key=lambda stage: stages[stage]['mean_seconds'], reverse=True)
+        return {
+            'started_at': datetime.fromtimestamp(self.started_at).isoformat(timespec='seconds'),
+            'finished_at': datetime.fromtimestamp(finished_at).isoformat(timespec='seconds'),
+            'wall_seconds': round(finished_at - self.started_at, 3),
+            'bottleneck': ranked[0] if ranked else None,
+            'stages': stages,
+            'queues': queues,
+        }
+
+    @staticmethod
+    def label_value(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def prometheus_text(self, report):
+        lines = [
+            "# HELP pdfgen_document_seconds Per-document latency by stage.",
+            "# TYPE pdfgen_document_seconds histogram",
+        ]
+        for stage, entry in report['stages'].items():
+            cumulative = 0
+            for bound, count in entry['latency_buckets'].items():
+                cumulative += count
+                le = "+Inf" if bound == 'inf' else bound
+                lines.append(f'pdfgen_document_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+            lines.append(f'pdfgen_document_seconds_sum{{stage="{stage}"}} {entry["busy_seconds"]}')
+            lines.append(f'pdfgen_document_seconds_count{{stage="{stage}"}} {entry["documents"]}')
+
+        counters = [
+            ('pdfgen_documents_total', 'Documents processed by stage.', 'counter', 'documents'),
+            ('pdfgen_failures_total', 'Documents that failed by stage.', 'counter', 'failures'),
+            ('pdfgen_bytes_in_total', 'Bytes read by stage.', 'counter', 'bytes_in'),
+            ('pdfgen_bytes_out_total', 'Bytes written by stage.', 'counter', 'bytes_out'),
+            ('pdfgen_throughput_per_second', 'Documents per second of stage wall time.', 'gauge', 'throughput_per_second'),
+        ]
+        for name, help_text, metric_type, key in counters:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+            lines += [f'{name}{{stage="{stage}"}} {entry[key] or 0}' for stage, entry in report['stages'].items()]
+
+        for label in ('state', 'template'):
+            name = f"pdfgen_documents_by_{label}_total"
+            lines += [f"# HELP {name} Documents processed by stage and {label}.", f"# TYPE {name} counter"]
+            for stage, entry in report['stages'].items():
+                lines += [f'{name}{{stage="{stage}",{label}="{self.label_value(value)}"}} {counts["documents"]}' for value, counts in entry[f'by_{label}'].items()]
+
+        lines += ["# HELP pdfgen_queue_depth_max Deepest queue seen in front of a pipeline stage.", "# TYPE pdfgen_queue_depth_max gauge"]
+        lines += [f'pdfgen_queue_depth_max{{stage="{stage}"}} {entry["max_depth"]}' for stage, entry in report['queues'].items()]
+        lines += ["# HELP pdfgen_run_seconds Wall time of the run.", "# TYPE pdfgen_run_seconds gauge", f"pdfgen_run_seconds {report['wall_seconds']}"]
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, report_dir):
+        # run_report.json for people and scripts, run_report.prom for the node_exporter textfile collector
+        report = self.report()
+        os.makedirs(report_dir, exist_ok=True)
+        json_path = os.path.join(report_dir, "run_report.json")
+        prom_path = os.path.join(report_dir, "run_report.prom")
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        # Written under a temp name first, the textfile collector must never read a partial file
+        with open(prom_path + ".tmp", 'w', encoding='utf-8') as f:
+            f.write(self.prometheus_text(report))
+        os.replace(prom_path + ".tmp", prom_path)
+
+        for stage, entry in report['stages'].items():
+            if not entry['documents']:
+                logging.info(f"Stage {stage}: 0 documents, {entry['failures']} failed")
+                continue
+            logging.info(f"Stage {stage}: {entry['documents']} documents, {entry['failures']} failed, {entry['throughput_per_second']} per second, "
+                         f"{entry['mean_seconds']}s mean, {entry['bytes_in']} bytes in, {entry['bytes_out']} bytes out")
+        logging.info(f"Bottleneck stage: {report['bottleneck']}. Run report saved to {json_path} and {prom_path}")
+        return report
+
+
+metrics = RunMetrics()
+
+
+
+class JsonLineFormatter(logging.Formatter):
+    # One JSON object per line: time, level, stage, event and the fields passed to log_event()
+    def format(self, record):
+        entry = {'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'), 'level': record.levelname,
+                 'stage': record.name.rsplit('.', 1)[-1], 'event': record.getMessage()}
+        entry.update(getattr(record, 'fields', {}))
+        return json.dumps(entry, default=str)
+
+
+# Stages with a per-record event logger, pdfgen.<stage>
+event_stages = ('render', 'convert', 'compress', 'upload')
+
+log_handlers = {}
+log_queue = None
+log_queue_handler = None
+log_listener = None
+event_counts = {}
+event_counts_lock = threading.Lock()
+
+
+def is_event_record(record):
+    return record.name.startswith('pdfgen.')
+
+
+def start_log_listener():
+    # The handlers run on the listener's thread; the threads that log only put records on the queue
+    global log_queue, log_listener
+    log_queue = queue.SimpleQueue()
+    if log_queue_handler is not None:
+        log_queue_handler.queue = log_queue
+    log_listener = logging.handlers.QueueListener(log_queue, *log_handlers.values(), respect_handler_level=True)
+    log_listener.start()
+
+
+def stop_log_listener():
+    # Writes out whatever is still queued
+    global log_listener
+    if log_listener is not None:
+        log_listener.stop()
+        log_listener = None
+
+
+def restart_log_listener_in_child():
+    # A forked render process gets a copy of the queue but not the listener thread
+    if log_listener is not None:
+        start_log_listener()
+        # Worker processes leave through os._exit, which skips atexit
+        multiprocessing_util.Finalize(None, stop_log_listener, exitpriority=10)
+
+
+def configure_logging(info_log_file, error_log_file, events_log_file=EVENTS_LOG_FILE, level=LOG_LEVEL, levels=LOG_LEVELS):
+    # Text messages go to the console, info_log_file and error_log_file, per-record events (log_event) to
+    # events_log_file as JSON lines. All of them are written by a listener thread, never by the thread that logs.
+    global log_queue_handler
+
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    log_handlers['console'] = logging.StreamHandler()
+    log_handlers['console'].setFormatter(logging.Formatter('%(message)s'))
+    log_handlers['info'] = logging.FileHandler(info_log_file)
+    log_handlers['info'].setLevel(logging.INFO)
+    log_handlers['error'] = logging.FileHandler(error_log_file)
+    log_handlers['error'].setLevel(logging.ERROR)
+    for name in ('info', 'error'):
+        log_handlers[name].setFormatter(formatter)
+    for handler in log_handlers.values():
+        handler.addFilter(lambda record: not is_event_record(record))
+
+    log_handlers['events'] = logging.FileHandler(events_log_file)
+    log_handlers['events'].setFormatter(JsonLineFormatter())
+    log_handlers['events'].addFilter(is_event_record)
+
+    log_queue_handler = logging.handlers.QueueHandler(None)
+    start_log_listener()
+    root_logger = logging.getLogger()
+    root_logger.setLevel(level)
+    root_logger.addHandler(log_queue_handler)
+    set_log_levels(levels)
+
+    atexit.register(stop_log_listener)
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=restart_log_listener_in_child)
+
+
+def set_log_levels(spec):
+    # "render=DEBUG,upload=WARNING": the level of a stage's events, of all events ("events"),
+    # of the text logs ("root") or of any other logger by name ("botocore"). Can be changed while running.
+    for item in spec.split(','):
+        name, _, level = item.partition('=')
+        name = name.strip()
+        if not name:
+            continue
+        if name == 'root':
+            logger = logging.getLogger()
+        elif name == 'events':
+            logger = logging.getLogger('pdfgen')
+        else:
+            logger = logging.getLogger(f"pdfgen.{name}" if name in event_stages else name)
+        logger.setLevel(level.strip().upper())
+
+
+def log_event(stage, event, level=logging.INFO, **fields):
+    """
+    Write a per-record event, e.g. log_event('upload', 'uploaded', key=...), to the events log.
+    Below WARNING only the first of every LOG_SAMPLE_RATE events of a kind is written, with
+    'sampled' set to the number of events it stands for; at DEBUG every event is written.
+    """
+    logger = logging.getLogger(f"pdfgen.{stage}")
+    if not logger.isEnabledFor(level):
+        return
+    if level < logging.WARNING and LOG_SAMPLE_RATE > 1 and not logger.isEnabledFor(logging.DEBUG):
+        key = (stage, event)
+        with event_counts_lock:
+            count = event_counts.get(key, 0)
+            event_counts[key] = (count + 1) % LOG_SAMPLE_RATE
+        if count:
+            return
+        fields['sampled'] = LOG_SAMPLE_RATE
+    logger.log(level, event, extra={'fields': fields})
+
+
+# Written to the working directory once configure_logging() is called; final.py does that when run as a script
 info_log_file = "info_log.txt"
 error_log_file = "error_log.txt"
-configure_logging(info_log_file, error_log_file)
 
 
-def terminate_word_instances():
-    # Check for running Microsoft Word instances
-    word_processes = [proc for proc in psutil.process_iter() if "WINWORD.EXE" in proc.name()]
+def get_cached_template(template_path):
+    mtime = os.path.getmtime(template_path)
+
+    with template_cache_lock:
+        entry = template_cache.get(template_path)
+        if entry and entry[0] == mtime:
+            template_cache_stats['hits'] += 1
+        else:
+            # First use of this template (or it was edited): parse it once
+            template_cache_stats['misses'] += 1
+            base_doc = DocxTemplate(template_path)
+            base_doc.init_docx()
+            entry = (mtime, base_doc.docx, CachingJinjaEnvironment())
+            template_cache[template_path] = entry
+
+    _, base_docx, jinja_env = entry
+
+    # Render from a copy so the cached document stays pristine
+    doc = DocxTemplate(template_path)
+    doc.docx = copy.deepcopy(base_docx)
+    return doc, jinja_env
+
+
+
+def reset_template_cache_stats():
+    # Also used as the render process initializer, so forked workers don't report the parent's counts
+    template_cache_stats['hits'] = 0
+    template_cache_stats['misses'] = 0
+    metrics.reset()
+
+
+
+def log_template_cache_stats(worker_cache_stats=None):
+    if worker_cache_stats:
+        # Render worker processes each keep their own cache
+        hits = sum(stats['hits'] for stats in worker_cache_stats.values())
+        misses = sum(stats['misses'] for stats in worker_cache_stats.values())
+        logging.info(f"Template cache: {hits} hits, {misses} misses across {len(worker_cache_stats)} render processes")
+    else:
+        logging.info(f"Template cache: {template_cache_stats['hits']} hits, {template_cache_stats['misses']} misses, {len(template_cache)} templates loaded")
+
+
+
+class PdfConverter(ABC):
+    # Base class for DOCX -> PDF conversion backends.
+    # convert() returns a dict of {docx_path: error message} for the files that failed.
+    name = None
+
+    def start(self):
+        pass
+
+    @abstractmethod
+    def convert(self, docx_paths, output_dir):
+        pass
+
+    def convert_documents(self, documents, output_dir):
+        # Convert in-memory DOCX files, {file name: bytes}, to output_dir/<file name>.pdf.
+        # Returns {file name: error message} for the ones that failed. Backends that can only
+        # read files get them staged in a scratch folder under SCRATCH_DIR, which is then removed.
+        scratch_dir = tempfile.mkdtemp(prefix="docx_", dir=SCRATCH_DIR)
+        try:
+            docx_paths = {}
+            for file_name, data in documents.items():
+                docx_path = os.path.join(scratch_dir, f"{file_name}.docx")
+                with open(docx_path, 'wb') as f:
+                    f.write(data)
+                docx_paths[docx_path] = file_name
+            failures = self.convert(list(docx_paths), output_dir)
+            return {docx_paths[docx_path]: error for docx_path, error in failures.items()}
+        finally:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    def reset(self):
+        # Called between batches to release resources held by the backend
+        pass
+
+    def close(self):
+        pass
+
+
+def stop_process_tree(pid, kill=False, timeout=10):
+    # soffice starts soffice.bin as a child, so stopping only the parent would leave it running
+    try:
+        parent = psutil.Process(pid)
+        processes = parent.children(recursive=True) + [parent]
+    except psutil.NoSuchProcess:
+        return
+    for process in processes:
+        try:
+            process.kill() if kill else process.terminate()
+        except psutil.NoSuchProcess:
+            pass
+    _, alive = psutil.wait_procs(processes, timeout=timeout)
+    for process in alive:
+        try:
+            process.kill()
+        except psutil.NoSuchProcess:
+            pass
+
+
+
+def get_process_tree_memory(pids):
+    # Resident memory of the processes and their children, in bytes
+    total = 0
+    for pid in pids:
+        try:
+            parent = psutil.Process(pid)
+            for process in [parent] + parent.children(recursive=True):
+                total += process.memory_info().rss
+        except psutil.NoSuchProcess:
+            pass
+    return total
+
+
+
+class SupervisedConverter(PdfConverter):
+    """
+    Converter whose worker threads each drive one office process, under a watchdog. A worker stuck on a
+    document for longer than timeout seconds has its process killed and starts a fresh one, leaving the other
+    workers alone. Workers are also recycled after recycle_documents documents or once their process uses
+    more than recycle_mb of memory. Failed documents go to a retry queue and are tried again on their own,
+    up to max_attempts times in all.
+    """
+
+    def __init__(self, num_workers=1, timeout=CONVERT_TIMEOUT, recycle_documents=CONVERTER_RECYCLE_DOCUMENTS, recycle_mb=CONVERTER_RECYCLE_MB,
+                 max_attempts=CONVERT_ATTEMPTS):
+        self.num_workers = max(1, num_workers)
+        self.timeout = timeout
+        self.recycle_documents = recycle_documents
+        self.recycle_mb = recycle_mb
+        self.max_attempts = max(1, max_attempts)
+        self.jobs = queue.Queue()
+        self.retries = queue.Queue()
+        self.workers = []
+        # worker_id -> time by which its current document must be done
+        self.deadlines = {}
+        self.timed_out = set()
+        self.supervisor_lock = threading.Lock()
+        self.watchdog = None
+        self.stopping = threading.Event()
+
+    def start(self):
+        if self.workers:
+            return
+
+        self._prepare()
+        for worker_id in range(self.num_workers):
+            worker = threading.Thread(target=self._worker_loop, args=(worker_id,), daemon=True)
+            worker.start()
+            self.workers.append(worker)
+        self.watchdog = threading.Thread(target=self._watchdog_loop, daemon=True)
+        self.watchdog.start()
+
+    def convert(self, docx_paths, output_dir):
+        return self._submit(dict(zip(docx_paths, docx_paths)), output_dir)
+
+    def close(self):
+        for _ in self.workers:
+            self.jobs.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+
+        if self.watchdog:
+            self.stopping.set()
+            self.watchdog.join()
+            self.watchdog = None
+            self.stopping.clear()
+
+    def _prepare(self):
+        # Called by start() before the workers are started
+        pass
+
+    @abstractmethod
+    def _worker_loop(self, worker_id):
+        pass
+
+    @abstractmethod
+    def _kill_worker(self, worker_id):
+        # Kill the office process of a worker; its current document then fails
+        pass
+
+    def _worker_memory(self, worker_id):
+        return 0
+
+    def _submit(self, sources, output_dir):
+        # sources: {key: docx path, or (file name, DOCX bytes)}. Returns {key: error message} for the failures.
+        self.start()
+
+        futures = {}
+        for key, source in sources.items():
+            future = Future()
+            self.jobs.put((source, output_dir, future, 1))
+            futures[key] = future
+
+        failures = {}
+        for key, future in futures.items():
+            error = future.result()
+            if error:
+                failures[key] = error
+        return failures
+
+    def _next_job(self):
+        # Retries come first, and a worker takes them one at a time
+        try:
+            return self.retries.get_nowait()
+        except queue.Empty:
+            return self.jobs.get()
+
+    def _begin(self, worker_id, documents=1):
+        with self.supervisor_lock:
+            self.deadlines[worker_id] = time.monotonic() + self.timeout * documents
+
+    def _end(self, worker_id):
+        # True when the watchdog killed the worker's process in the meantime
+        with self.supervisor_lock:
+            self.deadlines.pop(worker_id, None)
+            if worker_id in self.timed_out:
+                self.timed_out.discard(worker_id)
+                return True
+        return False
+
+    def _finish(self, job, error):
+        source, output_dir, future, attempt = job
+        if error and attempt < self.max_attempts:
+            log_event('convert', 'retry', level=logging.WARNING, file=source_name(source), attempt=attempt, error=error)
+            self.retries.put((source, output_dir, future, attempt + 1))
+        else:
+            future.set_result(error)
+
+    def _needs_recycling(self, worker_id, documents):
+        # Why the worker should be restarted before its next document, or None
+        if self.recycle_documents and documents >= self.recycle_documents:
+            return f"after {documents} documents"
+        memory = self._worker_memory(worker_id) if self.recycle_mb else 0
+        if memory > self.recycle_mb * 1024 * 1024:
+            return f"at {memory // (1024 * 1024)} MB"
+        return None
+
+    def _watchdog_loop(self):
+        while not self.stopping.wait(min(5, max(0.5, self.timeout / 4))):
+            now = time.monotonic()
+            with self.supervisor_lock:
+                stuck = [worker_id for worker_id, deadline in self.deadlines.items() if now > deadline and worker_id not in self.timed_out]
+                self.timed_out.update(stuck)
+            for worker_id in stuck:
+                logging.warning(f"{self.name} worker {worker_id} is stuck, killing its process")
+                log_event('convert', 'timeout', level=logging.WARNING, worker=worker_id, timeout=self.timeout)
+                self._kill_worker(worker_id)
+
+
+def source_name(source):
+    # A converter job's source is a DOCX path, or (file name, bytes) for an in-memory DOCX
+    return f"{source[0]}.docx" if isinstance(source, tuple) else os.path.basename(source)
+
+
+class WordConverter(SupervisedConverter):
+    # Microsoft Word (Windows/macOS only), driven by one worker thread. On Windows the worker starts its own
+    # Word over COM and only that process is killed or recycled, any other Word is left alone.
+    # On macOS it converts through docx2pdf, and a Word that hangs there can't be killed.
+    name = "word"
+
+    def __init__(self, **kwargs):
+        super().__init__(1, **kwargs)
+        # Process of the Word the worker drives, and how often it was killed; guarded by supervisor_lock
+        self.word_pid = None
+        self.word_kills = 0
+
+    def reset(self):
+        # Between batches, start the next one with a fresh Word
+        self._kill_worker(0)
+
+    def close(self):
+        super().close()
+        self._kill_worker(0)
+
+    def _start_word(self):
+        # DispatchEx starts a new Word instead of attaching to one the user has open
+        word = win32com.client.DispatchEx("Word.Application")
+        word.Visible = False
+        word.DisplayAlerts = 0
+        # Word's COM object doesn't expose its process, so find its main window by a caption of our own
+        caption = f"pdfgen-{os.getpid()}-{threading.get_ident()}"
+        word.Caption = caption
+        hwnd = win32gui.FindWindow("OpusApp", caption)
+        pid = win32process.GetWindowThreadProcessId(hwnd)[1] if hwnd else None
+        if not pid:
+            # A Word we can't kill could hang the run, so don't convert with it
+            try:
+                word.Quit()
+            except Exception:
+                pass
+            raise RuntimeError("Could not find the process of the started Word")
+        with self.supervisor_lock:
+            self.word_pid = pid
+        return word
+
+    def _kill_worker(self, worker_id):
+        with self.supervisor_lock:
+            pid, self.word_pid = self.word_pid, None
+            self.word_kills += 1
+        if pid:
+            stop_process_tree(pid, kill=True)
+
+    def _worker_memory(self, worker_id):
+        with self.supervisor_lock:
+            pid = self.word_pid
+        return get_process_tree_memory([pid]) if pid else 0
+
+    def _convert(self, word, docx_path, pdf_path):
+        if word is None:
+            convert(docx_path, pdf_path, keep_active=True)
+            return
+        doc = word.Documents.Open(os.path.abspath(docx_path), ReadOnly=True, AddToRecentFiles=False, Visible=False)
+        try:
+            # 17 is wdFormatPDF
+            doc.SaveAs(os.path.abspath(pdf_path), FileFormat=17)
+        finally:
+            doc.Close(0)
+
+    def _worker_loop(self, worker_id):
+        if pythoncom:
+            # Word is driven over COM from this thread
+            pythoncom.CoInitialize()
+
+        word = None
+        word_kills = 0
+        documents = 0
+        while True:
+            job = self._next_job()
+            if job is None:
+                break
+            docx_path, output_dir, _, _ = job
+            pdf_path = os.path.join(output_dir, os.path.splitext(os.path.basename(docx_path))[0] + ".pdf")
+
+            self._begin(worker_id)
+            try:
+                with self.supervisor_lock:
+                    # Killed by the watchdog, a recycle or reset() since the last document
+                    killed = self.word_kills != word_kills
+                    word_kills = self.word_kills
+                if pythoncom and (word is None or killed):
+                    word = self._start_word()
+                # Keep Word open between files, it is recycled by the supervisor
+                self._convert(word, docx_path, pdf_path)
+                error = None
+            except Exception as e:
+                error = str(e)
+            if self._end(worker_id):
+                error = f"timed out after {self.timeout:.0f}s"
+                documents = 0
+            else:
+                documents += 1
+            self._finish(job, error)
+
+            reason = self._needs_recycling(worker_id, documents)
+            if reason:
+                logging.info(f"Recycling Word {reason}")
+                log_event('convert', 'recycled', worker=worker_id, reason=reason)
+                self._kill_worker(worker_id)
+                documents = 0
+
+        if word is not None:
+            with self.supervisor_lock:
+                self.word_pid = None
+            try:
+                word.Quit()
+            except Exception:
+                pass
+
+
+class LibreOfficeConverter(SupervisedConverter):
+    # Pool of long-lived headless LibreOffice processes. Each worker thread owns one
+    # soffice process (with its own user profile) and takes documents from a shared queue.
+    name = "libreoffice"
+
+    def __init__(self, num_workers=CONVERTER_WORKERS, soffice_path=SOFFICE_PATH, base_port=2002, batch_size=50, **kwargs):
+        super().__init__(num_workers, **kwargs)
+        self.soffice_path = soffice_path
+        self.base_port = base_port
+        # Documents converted per soffice call when the UNO bridge is not available
+        self.batch_size = batch_size
+        self.processes = {}
+        self.profile_root = None
+
+    def _prepare(self):
+        self.profile_root = tempfile.mkdtemp(prefix="soffice_profiles_")
+        mode = "UNO" if uno else "command line"
+        logging.info(f"Started {self.num_workers} LibreOffice converter workers ({mode})")
+
+    def convert_documents(self, documents, output_dir):
+        if not uno:
+            # soffice on the command line only reads files
+            return super().convert_documents(documents, output_dir)
+        # Over UNO the DOCX bytes are streamed straight into soffice
+        return self._submit({file_name: (file_name, data) for file_name, data in documents.items()}, output_dir)
+
+    def close(self):
+        super().close()
+        if self.profile_root:
+            shutil.rmtree(self.profile_root, ignore_errors=True)
+            self.profile_root = None
+
+    def _kill_worker(self, worker_id):
+        process = self.processes.get(worker_id)
+        if process:
+            stop_process_tree(process.pid, kill=True)
+
+    def _worker_memory(self, worker_id):
+        process = self.processes.get(worker_id)
+        return get_process_tree_memory([process.pid]) if process else 0
+
+    def _profile_url(self, worker_id):
+        profile_dir = os.path.join(self.profile_root, f"worker_{worker_id}")
+        return "file://" + os.path.abspath(profile_dir).replace(os.sep, "/")
+
+    def _worker_loop(self, worker_id):
+        if uno:
+            self._uno_worker_loop(worker_id)
+        else:
+            self._cli_worker_loop(worker_id)
+
+    def _start_soffice(self, worker_id):
+        # A killed soffice leaves its profile lock behind
+        lock_path = os.path.join(self.profile_root, f"worker_{worker_id}", ".lock")
+        if os.path.exists(lock_path):
+            os.remove(lock_path)
+
+        port = self.base_port + worker_id
+        process = subprocess.Popen([
+            self.soffice_path,
+            f"-env:UserInstallation={self._profile_url(worker_id)}",
+            "--headless", "--invisible", "--nologo", "--norestore", "--nodefault", "--nolockcheck",
+            f"--accept=socket,host=127.0.0.1,port={port};urp;StarOffice.ComponentContext",
+        ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.processes[worker_id] = process
+        return port
+
+    def _stop_soffice(self, worker_id):
+        process = self.processes.pop(worker_id, None)
+        if process:
+            stop_process_tree(process.pid)
+            process.wait()
+
+    def _connect(self, port, timeout=60):
+        # Returns the soffice component context
+        local_context = uno.getComponentContext()
+        resolver = local_context.ServiceManager.createInstanceWithContext("com.sun.star.bridge.UnoUrlResolver", local_context)
+
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return resolver.resolve(f"uno:socket,host=127.0.0.1,port={port};urp;StarOffice.ComponentContext")
+            except Exception:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.5)
+
+    def _start_uno_worker(self, worker_id):
+        # (Re)start the worker's soffice and connect to it. Returns (context, desktop), or (None, None).
+        port = self._start_soffice(worker_id)
+        try:
+            context = self._connect(port)
+            return context, context.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", context)
+        except Exception as e:
+            logging.error(f"LibreOffice worker {worker_id} could not connect to soffice: {e}")
+            self._stop_soffice(worker_id)
+            return None, None
+
+    def _uno_worker_loop(self, worker_id):
+        context, desktop = self._start_uno_worker(worker_id)
+        documents = 0
+
+        hidden = uno.createUnoStruct("com.sun.star.beans.PropertyValue")
+        hidden.Name, hidden.Value = "Hidden", True
+        pdf_filter = uno.createUnoStruct("com.sun.star.beans.PropertyValue")
+        pdf_filter.Name, pdf_filter.Value = "FilterName", "writer_pdf_Export"
+
+        while True:
+            job = self._next_job()
+            if job is None:
+                break
+            source, output_dir, _, _ = job
+
+            if desktop is None:
+                # Started again after it was killed or recycled
+                context, desktop = self._start_uno_worker(worker_id)
+                documents = 0
+            if desktop is None:
+                self._finish(job, "LibreOffice worker is not connected")
+                continue
+
+            self._begin(worker_id)
+            try:
+                if isinstance(source, tuple):
+                    # (file name, DOCX bytes) from convert_documents()
+                    file_name, data = source
+                    stream = context.ServiceManager.createInstanceWithArgumentsAndContext("com.sun.star.io.SequenceInputStream", (uno.ByteSequence(data),), context)
+                    input_stream = uno.createUnoStruct("com.sun.star.beans.PropertyValue")
+                    input_stream.Name, input_stream.Value = "InputStream", stream
+                    url, load_properties = "private:stream", (hidden, input_stream)
+                else:
+                    file_name = os.path.splitext(os.path.basename(source))[0]
+                    url, load_properties = uno.systemPathToFileUrl(os.path.abspath(source)), (hidden,)
+
+                pdf_path = os.path.join(output_dir, f"{file_name}.pdf")
+                document = desktop.loadComponentFromURL(url, "_blank", 0, load_properties)
+                try:
+                    document.storeToURL(uno.systemPathToFileUrl(os.path.abspath(pdf_path)), (pdf_filter,))
+                finally:
+                    document.close(True)
+                error = None
+            except Exception as e:
+                error = str(e)
+
+            documents += 1
+            if self._end(worker_id):
+                error = f"timed out after {self.timeout:.0f}s"
+                reason = "after a timeout"
+            elif self.processes[worker_id].poll() is not None:
+                reason = "after soffice exited"
+            else:
+                reason = self._needs_recycling(worker_id, documents)
+            self._finish(job, error)
+
+            if reason:
+                logging.info(f"Restarting LibreOffice worker {worker_id} {reason}")
+                log_event('convert', 'recycled', worker=worker_id, reason=reason)
+                self._stop_soffice(worker_id)
+                context, desktop = None, None
+
+        self._stop_soffice(worker_id)
+
+    def _cli_worker_loop(self, worker_id):
+        # Every batch is a new soffice process, so there is nothing to recycle
+        stopping = False
+        while not stopping:
+            job = self._next_job()
+            if job is None:
+                break
+
+            # Take whatever else is already queued so one soffice start-up covers several documents.
+            # A retry is converted on its own, so one bad document can't fail a whole batch again.
+            batch = [job]
+            while job[3] == 1 and len(batch) < self.batch_size:
+                try:
+                    job = self.jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    stopping = True
+                    break
+                batch.append(job)
+
+            by_output_dir = {}
+            for job in batch:
+                by_output_dir.setdefault(job[1], []).append(job)
+
+            for output_dir, jobs in by_output_dir.items():
+                # soffice doesn't report per-file results, so clear stale PDFs and only count the ones it writes now
+                pdf_paths = [os.path.join(output_dir, os.path.splitext(os.path.basename(source))[0] + ".pdf") for source, _, _, _ in jobs]
+                for pdf_path in pdf_paths:
+                    if os.path.exists(pdf_path):
+                        os.remove(pdf_path)
+
+                command = [
+                    self.soffice_path,
+                    f"-env:UserInstallation={self._profile_url(worker_id)}",
+                    "--headless", "--norestore", "--nolockcheck",
+                    "--convert-to", "pdf", "--outdir", output_dir,
+                ] + [source for source, _, _, _ in jobs]
+
+                self._begin(worker_id, len(jobs))
+                try:
+                    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+                    self.processes[worker_id] = process
+                    _, stderr = process.communicate()
+                    error = stderr.decode(errors="replace").strip() or f"no PDF produced (soffice exited with {process.returncode})"
+                except Exception as e:
+                    error = str(e)
+                finally:
+                    self.processes.pop(worker_id, None)
+                if self._end(worker_id):
+                    error = f"timed out after {self.timeout * len(jobs):.0f}s"
+
+                for job, pdf_path in zip(jobs, pdf_paths):
+                    self._finish(job, None if os.path.exists(pdf_path) else error)
+
+
+pdf_converter = None
+pdf_converter_lock = threading.Lock()
+
+
+def get_pdf_converter(name=None, num_workers=None):
+    # Shared converter backend, created on first use from PDF_CONVERTER / CONVERTER_WORKERS
+    global pdf_converter
+
+    with pdf_converter_lock:
+        if pdf_converter is None:
+            name = (name or PDF_CONVERTER).lower()
+            if name == "libreoffice":
+                pdf_converter = LibreOfficeConverter(num_workers or CONVERTER_WORKERS)
+            elif name in ("word", "docx2pdf"):
+                # docx2pdf is the backend's earlier name
+                pdf_converter = WordConverter()
+            else:
+                raise ValueError(f"Unknown PDF converter: {name}")
+            pdf_converter.start()
+            logging.info(f"Using PDF converter: {pdf_converter.name}")
+        return pdf_converter
+
+
+
+def close_pdf_converter():
+    global pdf_converter
+
+    with pdf_converter_lock:
+        if pdf_converter is not None:
+            pdf_converter.close()
+            pdf_converter = None
 
-    if word_processes:
-        logging.info("Microsoft Word instances running:")
-        for proc in word_processes:
-            logging.info(f"PID: {proc.pid}")
 
-        # Terminate all Microsoft Word instances
-        for proc in word_processes:
-            proc.terminate()
-            print(f"Terminated PID: {proc.pid}")
-            logging.info(f"Terminated PID: {proc.pid}")
 
-        logging.info("------------------------------ All Microsoft Word instances terminated. ------------------------ \n")
+def get_cached_pdf_template(template_path):
+    # Direct-to-PDF templates are HTML files with the same Jinja fields as the DOCX templates
+    mtime = os.path.getmtime(template_path)
+
+    with template_cache_lock:
+        entry = template_cache.get(template_path)
+        if entry and entry[0] == mtime:
+            template_cache_stats['hits'] += 1
+        else:
+            template_cache_stats['misses'] += 1
+            with open(template_path, encoding='utf-8') as template_file:
+                template = Environment(autoescape=True).from_string(template_file.read())
+
+            language = os.path.basename(template_path).split('_template')[0].lower()
+            font_file = os.path.join(FONTS_DIR, language_font_dict.get(language, language_font_dict['default']))
+            entry = (mtime, template, font_file)
+            template_cache[template_path] = entry
+
+    _, template, font_file = entry
+    return template, font_file
+
+
+
+def render_pdf_record(record, template_path, output_path):
+    if FPDF is None:
+        raise RuntimeError("fpdf2 is required for direct-to-PDF templates (pip install fpdf2 uharfbuzz)")
+
+    template, font_file = get_cached_pdf_template(template_path)
+    html = template.render(record)
+
+    pdf = FPDF()
+    # Use the Bold/Italic files next to the regular font when they exist
+    for style, suffix in (('', 'Regular'), ('B', 'Bold'), ('I', 'Italic'), ('BI', 'BoldItalic')):
+        styled_font_file = font_file.replace('-Regular', f'-{suffix}')
+        pdf.add_font('body', style=style, fname=styled_font_file if os.path.exists(styled_font_file) else font_file)
+
+    latin_font_file = os.path.join(FONTS_DIR, language_font_dict['default'])
+    if latin_font_file != font_file and os.path.exists(latin_font_file):
+        pdf.add_font('latin', fname=latin_font_file)
+        pdf.set_fallback_fonts(['latin'])
+
+    # Shaping is needed for the conjuncts and vowel signs of the Indic scripts
+    pdf.set_text_shaping(True)
+    pdf.add_page()
+    pdf.set_font('body', size=11)
+    pdf.write_html(html, font_family='body')
+    pdf.output(output_path)
+
+
+
+overlay_marker_pattern = re.compile(r'QXF(\d{3})XQ')
+# Fields with less room than this many times their font size to their right are not stamped
+overlay_min_field_room = 5
+
+
+
+def get_overlay_fields(template_path):
+    # Field names of a DOCX template whose fields are all plain {{ name }} tags, or None when it uses
+    # anything else ({% %} blocks, filters, rich text), since then the text around the fields can change
+    texts = []
+    with zipfile.ZipFile(template_path) as docx:
+        for part_name in docx.namelist():
+            if part_name.startswith('word/') and part_name.endswith('.xml'):
+                texts.append(re.sub(r'<[^>]+>', '', docx.read(part_name).decode('utf-8')))
+    text = ''.join(texts)
+    if '{%' in text or '{#' in text:
+        return None
+    names = [expression.strip() for expression in re.findall(r'\{\{(.*?)\}\}', text)]
+    if not names or not all(name.isidentifier() for name in names):
+        return None
+    return sorted(set(names))
+
+
+
+def get_overlay_field_layout(template_path):
+    """
+    Alignment of each {{ name }} tag's paragraph in a DOCX template ('left', 'center' or 'right';
+    a name that is in several paragraphs gets the first one that is not left-aligned), and the
+    right page margin in points. Alignment set through a paragraph style is followed through styles.xml.
+    """
+    with zipfile.ZipFile(template_path) as docx:
+        parts = {name: docx.read(name).decode('utf-8') for name in docx.namelist() if name.startswith('word/') and name.endswith('.xml')}
+
+    style_alignments, based_on, default_style = {}, {}, None
+    for attributes, body in re.findall(r'<w:style\b([^>]*)>(.*?)</w:style>', parts.get('word/styles.xml', ''), re.S):
+        style_id = re.search(r'w:styleId="([^"]*)"', attributes)
+        if style_id is None or 'w:type="paragraph"' not in attributes:
+            continue
+        style_id = style_id.group(1)
+        if 'w:default="1"' in attributes:
+            default_style = style_id
+        alignment = re.search(r'<w:pPr>.*?<w:jc w:val="(\w+)"', body, re.S)
+        if alignment:
+            style_alignments[style_id] = alignment.group(1)
+        parent = re.search(r'<w:basedOn w:val="([^"]*)"', body)
+        if parent:
+            based_on[style_id] = parent.group(1)
+
+    def style_alignment(style_id):
+        seen = set()
+        while style_id and style_id not in seen:
+            if style_id in style_alignments:
+                return style_alignments[style_id]
+            seen.add(style_id)
+            style_id = based_on.get(style_id)
+        return None
+
+    alignments = {}
+    for name, xml in parts.items():
+        for paragraph in re.findall(r'<w:p\b.*?</w:p>', xml, re.S):
+            properties = re.search(r'<w:pPr>(.*?)</w:pPr>', paragraph, re.S)
+            properties = properties.group(1) if properties else ''
+            alignment = re.search(r'<w:jc w:val="(\w+)"', properties)
+            if alignment:
+                alignment = alignment.group(1)
+            else:
+                style_id = re.search(r'<w:pStyle w:val="([^"]*)"', properties)
+                alignment = style_alignment(style_id.group(1) if style_id else default_style)
+            alignment = {'center': 'center', 'right': 'right', 'end': 'right'}.get(alignment, 'left')
+            text = re.sub(r'<[^>]+>', '', paragraph)
+            for expression in re.findall(r'\{\{(.*?)\}\}', text):
+                if alignments.get(expression.strip(), 'left') == 'left':
+                    alignments[expression.strip()] = alignment
+
+    # The last section's margins, in twentieths of a point
+    margins = re.findall(r'<w:pgMar\b[^>]*w:right="(\d+)"', parts.get('word/document.xml', ''))
+    right_margin = int(margins[-1]) / 20 if margins else 72.0
+    return alignments, right_margin
+
+
+
+def extract_text_runs(pdf_path):
+    # (page index, text, x, y, font size, font name) of every piece of text drawn, in PDF points
+    runs = []
+    for page_index, page in enumerate(PdfReader(pdf_path).pages):
+        def visit(text, cm, tm, font_dict, font_size):
+            text = text.strip()
+            if text:
+                x = tm[4] * cm[0] + tm[5] * cm[2] + cm[4]
+                y = tm[4] * cm[1] + tm[5] * cm[3] + cm[5]
+                size = font_size * (tm[2] ** 2 + tm[3] ** 2) ** 0.5 * (cm[2] ** 2 + cm[3] ** 2) ** 0.5
+                font_name = str(font_dict.get('/BaseFont', '')) if font_dict else ''
+                runs.append((page_index, text, round(x, 1), round(y, 1), round(size, 2), font_name))
+        page.extract_text(visitor_text=visit)
+    return runs
+
+
+
+def prepare_overlay_template(template_path, converter=None):
+    """
+    Convert a DOCX template to PDF once for overlay stamping, and find where each field goes.
+
+    The template is rendered twice, with empty fields (the base PDF) and with a marker in each field.
+    It is eligible when every field is in a left-aligned paragraph, every marker is a piece of text of
+    its own with room to its right, and all other text is in the same place in both PDFs, i.e. no
+    field's value moves the text around it. The base PDF and the field positions are cached in a .cache
+    folder next to the template, keyed on the template's contents, so each template version is converted once.
+
+    Returns the path of the overlay description (.json), which records why when the template is not eligible.
+    """
+    cache_prefix = get_overlay_cache_prefix(template_path)
+    cache_dir = os.path.dirname(cache_prefix)
+    if os.path.exists(f"{cache_prefix}.json"):
+        return f"{cache_prefix}.json"
+
+    overlay = {'template': template_path, 'eligible': False}
+    names = get_overlay_fields(template_path)
+    alignments, right_margin = get_overlay_field_layout(template_path) if names else ({}, None)
+    aligned = [name for name in names or [] if alignments.get(name, 'left') != 'left']
+    if names is None:
+        overlay['reason'] = "template uses more than plain {{ field }} tags"
+    elif aligned:
+        overlay['reason'] = f"field {aligned[0]} is {'centred' if alignments[aligned[0]] == 'center' else 'right-aligned'}"
     else:
-        logging.info("No Microsoft Word instances are running.")
+        converter = converter or get_pdf_converter()
+        with tempfile.TemporaryDirectory() as work_dir:
+            base_docx = os.path.join(work_dir, "base.docx")
+            markers_docx = os.path.join(work_dir, "markers.docx")
+            for docx_path, context in ((base_docx, dict.fromkeys(names, '')),
+                                       (markers_docx, {name: f"QXF{index:03d}XQ" for index, name in enumerate(names)})):
+                doc = DocxTemplate(template_path)
+                doc.render(context)
+                doc.save(docx_path)
+            failures = convert_docx_files(converter, [base_docx, markers_docx], work_dir)
+
+            if failures:
+                overlay['reason'] = f"conversion failed: {'; '.join(failures.values())}"
+            else:
+                base_pdf = os.path.join(work_dir, "base.pdf")
+                overlay.update(find_overlay_fields(base_pdf, os.path.join(work_dir, "markers.pdf"), names, right_margin))
+                if overlay['eligible']:
+                    os.makedirs(cache_dir, exist_ok=True)
+                    shutil.copyfile(base_pdf, f"{cache_prefix}.pdf.tmp")
+                    os.replace(f"{cache_prefix}.pdf.tmp", f"{cache_prefix}.pdf")
+                    overlay['base_pdf'] = f"{cache_prefix}.pdf"
+
+    if overlay['eligible']:
+        logging.info(f"Overlay template ready for {template_path}: {len(overlay['fields'])} fields")
+    else:
+        logging.info(f"{template_path} is rendered through DOCX: {overlay['reason']}")
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(f"{cache_prefix}.json.tmp", 'w', encoding='utf-8') as f:
+        json.dump(overlay, f, indent=2)
+    os.replace(f"{cache_prefix}.json.tmp", f"{cache_prefix}.json")
+    return f"{cache_prefix}.json"
+
+
+
+def find_overlay_fields(base_pdf, markers_pdf, names, right_margin=72.0):
+    """
+    Field positions from the markers, if the two renders differ in nothing but the markers.
+    Each position is [page index, x, y, font size, room, style]: room is the width up to the next text
+    on the line or the right margin, style is 'B', 'I' or 'BI' when the field's font is bold or italic.
+    """
+    base_reader, markers_reader = PdfReader(base_pdf), PdfReader(markers_pdf)
+    if len(base_reader.pages) != len(markers_reader.pages):
+        return {'reason': "the field values change the number of pages"}
+    page_sizes = [[float(page.mediabox.width), float(page.mediabox.height)] for page in base_reader.pages]
+
+    markers = []
+    other_runs = []
+    for page_index, text, x, y, size, font_name in extract_text_runs(markers_pdf):
+        match = overlay_marker_pattern.search(text)
+        if match is None:
+            other_runs.append((page_index, text, x, y))
+        elif match.group(0) != text:
+            return {'reason': f"field {names[int(match.group(1))]} shares a line with other text ({text!r})"}
+        else:
+            style = ('B' if 'bold' in font_name.lower() else '') + ('I' if re.search('italic|oblique', font_name.lower()) else '')
+            markers.append((names[int(match.group(1))], page_index, x, y, size, style))
+
+    fields = {}
+    for name, page_index, x, y, size, style in markers:
+        # Text further along the same line, e.g. the next table cell, ends the field
+        limits = [other_x for other_page, _, other_x, other_y in other_runs
+                  if other_page == page_index and abs(other_y - y) < size / 2 and other_x > x]
+        room = round(min(limits, default=page_sizes[page_index][0] - right_margin) - x, 1)
+        if room < size * overlay_min_field_room:
+            return {'reason': f"field {name} has no room to its right"}
+        fields.setdefault(name, []).append([page_index, x, y, size, room, style])
 
+    base_runs = [(page_index, text, x, y) for page_index, text, x, y, _, _ in extract_text_runs(base_pdf)]
+    if sorted(base_runs) != sorted(other_runs):
+        return {'reason': "the field values move other text"}
+    missing = [name for name in names if name not in fields]
+    if missing:
+        return {'reason': f"fields not found in the PDF: {', '.join(missing)}"}
 
+    return {'eligible': True, 'fields': fields, 'page_sizes': page_sizes}
 
-def generate_pdf_from_docx(output_dir):
+
+
+def prepare_overlay_templates(template_dict=state_template_dict, converter=None):
+    # Prepare every .docx template in template_dict once, before rendering starts
+    for template_path in sorted({path for path in template_dict.values() if path and path.lower().endswith('.docx')}):
+        try:
+            prepare_overlay_template(template_path, converter)
+        except Exception as e:
+            logging.error(f"Could not prepare overlay template for {template_path}: {e}")
+
+
+
+def get_overlay_cache_prefix(template_path):
+    # Cached overlay files of a template version, without the extension.
+    # The v2 marks the field positions with room and style, so older caches are prepared again.
+    base_name = os.path.splitext(os.path.basename(template_path))[0]
+    return os.path.join(os.path.dirname(os.path.abspath(template_path)), ".cache",
+                        f"{base_name}-{hash_file(template_path, cache=True)[:16]}.overlay-v2")
+
+
+
+def get_overlay_font_files(font_file, styles):
+    # {style: font file} for the regular font and its bold/italic files, e.g. NotoSans-Bold.ttf, or None when one is missing
+    font_files = {'': font_file}
+    for style in styles:
+        if style:
+            name = {'B': 'Bold', 'I': 'Italic', 'BI': 'BoldItalic'}[style]
+            font_files[style] = font_file.replace('-Regular', f'-{name}')
+            if font_files[style] == font_file or not os.path.exists(font_files[style]):
+                return None
+    return font_files
+
+
+
+def get_overlay_template(template_path):
+    # The prepared overlay of a template, or None when it was not prepared or is not eligible
+    mtime = os.path.getmtime(template_path)
+    with template_cache_lock:
+        entry = overlay_template_cache.get(template_path)
+        if entry and entry[0] == mtime:
+            return entry[1]
+
+    overlay_path = f"{get_overlay_cache_prefix(template_path)}.json"
+    overlay = None
+    if os.path.exists(overlay_path):
+        with open(overlay_path, encoding='utf-8') as f:
+            overlay = json.load(f)
+        if overlay['eligible']:
+            with open(overlay['base_pdf'], 'rb') as f:
+                overlay['base_pdf_data'] = f.read()
+            language = os.path.basename(template_path).split('_template')[0].lower()
+            font_file = os.path.join(FONTS_DIR, language_font_dict.get(language, language_font_dict['default']))
+            styles = {position[5] for positions in overlay['fields'].values() for position in positions}
+            overlay['font_files'] = get_overlay_font_files(font_file, styles)
+            if overlay['font_files'] is None:
+                logging.info(f"{template_path} is rendered through DOCX: it has bold or italic fields and {FONTS_DIR} has no bold or italic {os.path.basename(font_file)}")
+                overlay = None
+        else:
+            overlay = None
+
+    with template_cache_lock:
+        overlay_template_cache[template_path] = (mtime, overlay)
+    return overlay
+
+
+
+def render_overlay_record(record, overlay, output_path):
+    """
+    Stamp the record's field values onto the base pages of the template. Raises ValueError for a value
+    that the template would lay out differently, i.e. one with several lines or wider than its field,
+    so the letter can be rendered through DOCX instead.
+    """
+    if FPDF is None:
+        raise RuntimeError("fpdf2 is required for overlay templates (pip install fpdf2 uharfbuzz)")
+
+    fields_by_page = {}
+    for name, positions in overlay['fields'].items():
+        value = str(record.get(name, ''))
+        if len(value.splitlines()) > 1:
+            raise ValueError(f"{name} has more than one line")
+        for page_index, x, y, size, room, style in positions:
+            fields_by_page.setdefault(page_index, []).append((name, value.strip(), x, y, size, room, style))
+
+    # A new document per record: fpdf2 subsets the parsed font in place when writing, so a document
+    # (or a deepcopy of one, which shares the font) can't be reused for the next record
+    stamp = FPDF(unit='pt')
+    for style, font_file in overlay['font_files'].items():
+        stamp.add_font('body', style, font_file)
+    latin_font_file = os.path.join(FONTS_DIR, language_font_dict['default'])
+    if latin_font_file != overlay['font_files'][''] and os.path.exists(latin_font_file):
+        latin_font_files = get_overlay_font_files(latin_font_file, overlay['font_files']) or {'': latin_font_file}
+        for style, font_file in latin_font_files.items():
+            stamp.add_font('latin', style, font_file)
+        stamp.set_fallback_fonts(['latin'], exact_match=False)
+    stamp.set_text_shaping(True)
+
+    stamped_pages = sorted(fields_by_page)
+    for page_index in stamped_pages:
+        width, height = overlay['page_sizes'][page_index]
+        stamp.add_page(format=(width, height))
+        for name, value, x, y, size, room, style in fields_by_page[page_index]:
+            if not value:
+                continue
+            stamp.set_font('body', style, size)
+            if stamp.get_string_width(value) > room:
+                raise ValueError(f"{name} is wider than its field ({room:.0f}pt)")
+            # fpdf2 measures from the top of the page
+            stamp.text(x, height - y, value)
+
+    stamp_reader = PdfReader(io.BytesIO(bytes(stamp.output())))
+    writer = PdfWriter()
+    for page_index, page in enumerate(PdfReader(io.BytesIO(overlay['base_pdf_data'])).pages):
+        if page_index in fields_by_page:
+            page.merge_page(stamp_reader.pages[stamped_pages.index(page_index)])
+        writer.add_page(page)
+    with open(output_path, 'wb') as f:
+        writer.write(f)
+
+
+
+def convert_docx_files(converter, docx_paths, output_dir):
+    # converter.convert() with metrics; LibreOffice converts in batches, so latency is the batch time per document
+    start_time = time.perf_counter()
+    bytes_in = sum(os.path.getsize(path) for path in docx_paths if os.path.exists(path))
+    failures = converter.convert(docx_paths, output_dir)
+
+    converted = [path for path in docx_paths if path not in failures]
+    pdf_paths = [os.path.join(output_dir, os.path.splitext(os.path.basename(path))[0] + ".pdf") for path in converted]
+    # Converters write to the top of output_dir
+    pdf_paths = [place_output_file(output_dir, path) for path in pdf_paths if os.path.exists(path)]
+    bytes_out = sum(os.path.getsize(path) for path in pdf_paths if os.path.exists(path))
+    metrics.observe('convert', time.perf_counter() - start_time, count=len(converted), bytes_in=bytes_in, bytes_out=bytes_out)
+    if failures:
+        metrics.observe('convert', 0, count=len(failures), ok=False)
+    for pdf_path in pdf_paths:
+        log_event('convert', 'converted', file=os.path.basename(pdf_path))
+    for docx_path, error in failures.items():
+        log_event('convert', 'failed', level=logging.ERROR, file=os.path.basename(docx_path), error=error)
+    return failures
+
+
+
+def convert_docx_documents(converter, documents, output_dir):
+    # converter.convert_documents() with the same metrics as convert_docx_files()
+    start_time = time.perf_counter()
+    bytes_in = sum(len(data) for data in documents.values())
+    failures = converter.convert_documents(documents, output_dir)
+
+    converted = [file_name for file_name in documents if file_name not in failures]
+    pdf_paths = [os.path.join(output_dir, f"{file_name}.pdf") for file_name in converted]
+    # Converters write to the top of output_dir
+    pdf_paths = [place_output_file(output_dir, path) for path in pdf_paths if os.path.exists(path)]
+    bytes_out = sum(os.path.getsize(path) for path in pdf_paths if os.path.exists(path))
+    metrics.observe('convert', time.perf_counter() - start_time, count=len(converted), bytes_in=bytes_in, bytes_out=bytes_out)
+    if failures:
+        metrics.observe('convert', 0, count=len(failures), ok=False)
+    for file_name in converted:
+        log_event('convert', 'converted', file=f"{file_name}.pdf")
+    for file_name, error in failures.items():
+        log_event('convert', 'failed', level=logging.ERROR, file=f"{file_name}.docx", error=error)
+    return failures
+
+
+
+def generate_pdf_from_documents(documents, output_dir, converter=None, journal=None):
+    # Like generate_pdf_from_docx(), for DOCX files rendered in memory ({file name: bytes})
+    converter = converter or get_pdf_converter()
+
+    failures = convert_docx_documents(converter, documents, output_dir)
+    for file_name, error in failures.items():
+        logging.error(f"Failed to convert {file_name}.docx: {error}")
+
+    if journal is not None:
+        journal.record('convert', [file_name for file_name in documents if file_name not in failures])
+    return failures
+
+
+
+def generate_pdf_from_docx(output_dir, file_names, converter=None, journal=None):
+    # file_names: the records rendered into output_dir. Those rendered straight to PDF have no DOCX and are skipped.
+    converter = converter or get_pdf_converter()
 
     # Generate PDF from docx files
-    convert(output_dir)
+    word_files = [f"{file_name}.docx" for file_name in file_names if os.path.exists(os.path.join(output_dir, f"{file_name}.docx"))]
+    failures = convert_docx_files(converter, [os.path.join(output_dir, f) for f in word_files], output_dir)
+    for word_file_path, error in failures.items():
+        logging.error(f"Failed to convert {word_file_path}: {error}")
+
+    if journal is not None:
+        journal.record('convert', [os.path.splitext(f)[0] for f in word_files if os.path.join(output_dir, f) not in failures])
 
     # Delete docx files
-    word_files = [f for f in os.listdir(output_dir) if f.lower().endswith('.docx')]
     for word_file in word_files:
-        word_file_path = os.path.join(output_dir, word_file)
-        os.remove(word_file_path)
-        print(f"---------------- Deleted Word file: {word_file_path} ----------------------\n")
-        
+        os.remove(os.path.join(output_dir, word_file))
+    logging.info(f"Converted and deleted {len(word_files)} Word files in {output_dir}, {len(failures)} failed")
+
+
+
+def get_template_path(state, state_template_dict):
+    template_path = state_template_dict.get(state, state_template_dict.get('DEFAULT', os.path.join(os.path.dirname(__file__), 'default_template.docx')))
+
+    if not os.path.exists(template_path):
+        log_event('render', 'default_template', state=state)
+        template_path = state_template_dict.get('DEFAULT', os.path.join(os.path.dirname(__file__), 'default_template.docx'))
+
+    return template_path
+
+
 
+def get_record_file_name(record, potential_column_names):
+    return next((record.get(key, None) for key in potential_column_names if key in record), None)
 
-def process_record(record, output_dir, state_template_dict, potential_column_names=['Filename', 'Prospect_no', 'LAN_Details', 'CUID_NO']):
+
+
+def process_record(record, output_dir, state_template_dict, potential_column_names=['Filename', 'Prospect_no', 'LAN_Details', 'CUID_NO'], documents=None):
+    # With a documents dict, a rendered DOCX is kept in it as {file name: bytes} instead of being saved to output_dir
+    start_time = time.perf_counter()
+    state = None
+    template_path = None
     try:
         file_name = None  # Move the definition outside the try block
 
         state = record.get('State', '').upper()
-        template_path = state_template_dict.get(state, state_template_dict.get('DEFAULT', os.path.join(os.path.dirname(__file__), 'default_template.docx')))
-
-        if not os.path.exists(template_path):
-            logging.info(f"No template found for state: {state}. Using default template.")
-            template_path = state_template_dict.get('DEFAULT', os.path.join(os.path.dirname(__file__), 'default_template.docx'))
-
-        doc = DocxTemplate(template_path)
-        doc.render(record)
+        template_path = get_template_path(state, state_template_dict)
 
         # Try each potential column name until a valid one is found
-        file_name = next((record.get(key, None) for key in potential_column_names if key in record), None)
+        file_name = get_record_file_name(record, potential_column_names)
 
         if file_name is None:
             logging.error("No valid column found for file name. Unable to generate file name.")
             return None
 
-        output_path = os.path.join(output_dir, f"{file_name}.docx")
-        doc.save(output_path)
+        if template_path.lower().endswith('.html'):
+            # Direct-to-PDF template: no DOCX and no conversion step
+            output_path = make_output_path(output_dir, file_name)
+            render_pdf_record(record, template_path, output_path)
+            place_output_file(output_dir, output_path)
+            metrics.observe('render', time.perf_counter() - start_time, state=state, template=os.path.basename(template_path), bytes_out=os.path.getsize(output_path))
+            log_event('render', 'rendered', file=file_name, state=state, template=os.path.basename(template_path))
+            return file_name, state
+
+        overlay = get_overlay_template(template_path) if OVERLAY_TEMPLATES else None
+        if overlay is not None:
+            # Prepared overlay template: stamp the fields onto the converted template, no DOCX and no conversion
+            output_path = make_output_path(output_dir, file_name)
+            try:
+                render_overlay_record(record, overlay, output_path)
+            except Exception as e:
+                # E.g. a value too long for its field: this letter goes through DOCX like a template that is not eligible
+                log_event('render', 'overlay_fallback', level=logging.WARNING, file=file_name, error=str(e))
+                if os.path.exists(output_path):
+                    os.remove(output_path)
+                overlay = None
+        if overlay is not None:
+            place_output_file(output_dir, output_path)
+            metrics.observe('render', time.perf_counter() - start_time, state=state, template=os.path.basename(template_path), bytes_out=os.path.getsize(output_path))
+            log_event('render', 'rendered', file=file_name, state=state, template=os.path.basename(template_path))
+            return file_name, state
+
+        doc, jinja_env = get_cached_template(template_path)
+        doc.render(record, jinja_env)
+
+        if documents is not None:
+            buffer = io.BytesIO()
+            doc.save(buffer)
+            documents[file_name] = buffer.getvalue()
+            bytes_out = len(documents[file_name])
+        else:
+            output_path = os.path.join(output_dir, f"{file_name}.docx")
+            doc.save(output_path)
+            bytes_out = os.path.getsize(output_path)
 
+        metrics.observe('render', time.perf_counter() - start_time, state=state, template=os.path.basename(template_path), bytes_out=bytes_out)
+        log_event('render', 'rendered', file=file_name, state=state, template=os.path.basename(template_path))
         return file_name, state
 
     except Exception as e:
+        metrics.observe('render', time.perf_counter() - start_time, ok=False, state=state, template=os.path.basename(template_path) if template_path else None)
         error_message = f"Error occurred for file {record.get(file_name, 'unknown')}: {e}\n"  # Use the variable directly instead of file_name
         logging.error(error_message)
+        log_event('render', 'failed', level=logging.ERROR, file=file_name, state=state, error=str(e))
         return None, None
     
 
 
-def process_lang_folder(lang_folder, output_dir, state_template_dict, num_word_instances=3):
+def render_record_group(records, output_dir, state_template_dict, potential_column_names, in_memory=False):
+    # Runs in a render worker process. The records share one state, so the worker's cached template stays warm.
+    # With in_memory the rendered DOCX files are sent back to the parent instead of being saved.
+    documents = {} if in_memory else None
+    results = [process_record(record, output_dir, state_template_dict, potential_column_names, documents) for record in records]
+    return os.getpid(), results, dict(template_cache_stats), metrics.drain(), documents
+
+
+
+def render_records_in_processes(executor, records, output_dir, state_template_dict, potential_column_names, group_size=RENDER_GROUP_SIZE, worker_cache_stats=None, documents=None):
+    # Send the records to the process pool as plain dicts, in groups of one state each
+    records_by_state = {}
+    for record in records:
+        records_by_state.setdefault(str(record.get('State', '')).upper(), []).append(record)
+
+    futures = []
+    for state_records in records_by_state.values():
+        for start in range(0, len(state_records), group_size):
+            futures.append(executor.submit(render_record_group, state_records[start:start + group_size], output_dir, state_template_dict, potential_column_names,
+                                           documents is not None))
 
-    excel_path = os.path.join(lang_folder, "lang_data.xlsx")
+    results = []
+    for future in as_completed(futures):
+        try:
+            pid, group_results, cache_stats, worker_metrics, group_documents = future.result()
+        except Exception as e:
+            logging.error(f"Render worker failed: {e}")
+            continue
+
+        metrics.merge(worker_metrics)
+        if documents is not None:
+            documents.update(group_documents)
+
+        results.extend(group_results)
+        if worker_cache_stats is not None:
+            worker_cache_stats[pid] = cache_stats
+
+    return results
+
+
+
+def process_lang_folder(lang_folder, output_dir, state_template_dict, num_word_instances=3):
 
     # Convert Excel sheet to pandas dataframe
-    df = pd.read_excel(excel_path, sheet_name="Sheet1")
+    df = load_lang_data(get_lang_data_path(lang_folder))
 
-    # Create a pool of Word instances
-    word_instances = [comtypes.client.CreateObject('Word.Application') for _ in range(num_word_instances)]
+    # Create a pool of Word instances (Windows only)
+    word_instances = [comtypes.client.CreateObject('Word.Application') for _ in range(num_word_instances)] if comtypes else []
 
     with ThreadPoolExecutor() as executor:
         # Pass state_template_dict as an additional argument to process_record function
@@ -201,79 +1790,271 @@ def process_lang_folder(lang_folder, output_dir, state_template_dict, num_word_i
 
 
 
-def merge_pdfs_by_srno(output_dir, base_dir, excel_path, potential_column_names, batch_size=5000):
+class StreamingPdfWriter:
+    # Concatenates PDFs page by page into one file. Each input's objects are written out as soon as they are read,
+    # so memory use is bounded by one input file instead of the whole merged output like PdfMerger.
+    # With dedup=True, identical streams (fonts, images, ICC profiles) are written once and shared by every page using them.
+
+    def __init__(self, output_path, dedup=False):
+        self.file = open(output_path, 'wb')
+        self.file.write(b'%PDF-1.7\n%\xe2\xe3\xcf\xd3\n')
+        self.offsets = {}
+        self.next_number = 1
+        self.pages_number = self._reserve()
+        self.page_numbers = []
+        self.dedup = dedup
+        # Content hash of every stream written -> its object number
+        self.stream_numbers = {}
+        self.shared_streams = 0
+        self.shared_bytes = 0
+
+    def _reserve(self):
+        number = self.next_number
+        self.next_number += 1
+        return number
+
+    def _write_object(self, number, obj):
+        self.offsets[number] = self.file.tell()
+        self.file.write(f"{number} 0 obj\n".encode())
+        obj.write_to_stream(self.file, None)
+        self.file.write(b"\nendobj\n")
+
+    def _copy_stream(self, source, stream, object_map, pending):
+        # Write a stream right away, or reuse an identical one already in the output. Streams it refers to are
+        # copied first, so an image and its soft mask or ICC profile get the same bytes in every input.
+        key = (source.idnum, source.generation)
+        object_map[key] = None
+        copied = self._remap(stream, object_map, pending)
+        if object_map[key] is not None:
+            # The stream refers back to itself, so it was numbered and queued like any other object
+            return object_map[key]
+        buffer = io.BytesIO()
+        copied.write_to_stream(buffer, None)
+        data = buffer.getvalue()
+
+        digest = hashlib.sha256(data).digest()
+        number = self.stream_numbers.get(digest)
+        if number is not None:
+            self.shared_streams += 1
+            self.shared_bytes += len(data)
+        else:
+            number = self._reserve()
+            self.offsets[number] = self.file.tell()
+            self.file.write(f"{number} 0 obj\n".encode() + data + b"\nendobj\n")
+            self.stream_numbers[digest] = number
+        object_map[key] = number
+        return number
+
+    def _remap(self, obj, object_map, pending):
+        # Copy obj with its references renumbered into the output; referenced objects are queued in pending
+        if isinstance(obj, IndirectObject):
+            key = (obj.idnum, obj.generation)
+            if self.dedup and key not in object_map and isinstance(obj.get_object(), StreamObject):
+                return IndirectObject(self._copy_stream(obj, obj.get_object(), object_map, pending), 0, None)
+            if key not in object_map or object_map[key] is None:
+                object_map[key] = self._reserve()
+                pending.append(obj)
+            return IndirectObject(object_map[key], 0, None)
+        if isinstance(obj, StreamObject):
+            copied = obj.__class__()
+            copied._data = obj._data
+            for key, value in obj.items():
+                # /Length is rewritten from the data
+                if key != '/Length':
+                    copied[key] = self._remap(value, object_map, pending)
+            return copied
+        if isinstance(obj, DictionaryObject):
+            return DictionaryObject({key: self._remap(value, object_map, pending) for key, value in obj.items()})
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self._remap(value, object_map, pending) for value in obj)
+        return obj
+
+    def append(self, pdf_path):
+        reader = PdfReader(pdf_path)
+        object_map = {}
+        pending = []
+
+        # Number the pages first so references between pages (links, annotations) point at the copies
+        pages = list(reader.pages)
+        page_numbers = []
+        for page in pages:
+            page_number = self._reserve()
+            if page.indirect_reference is not None:
+                object_map[(page.indirect_reference.idnum, page.indirect_reference.generation)] = page_number
+            page_numbers.append(page_number)
+
+        for page, page_number in zip(pages, page_numbers):
+            # Inherited attributes are already copied into the page by PdfReader, so the input's page tree is not needed
+            copied = DictionaryObject({key: self._remap(value, object_map, pending) for key, value in page.items() if key != '/Parent'})
+            copied[NameObject('/Parent')] = IndirectObject(self.pages_number, 0, None)
+            self._write_object(page_number, copied)
+            self.page_numbers.append(page_number)
+
+            # Write everything the page refers to before moving on
+            while pending:
+                source = pending.pop()
+                obj = source.get_object()
+                self._write_object(object_map[(source.idnum, source.generation)], NullObject() if obj is None else self._remap(obj, object_map, pending))
+
+    def close(self):
+        if self.dedup:
+            logging.info(f"Shared {self.shared_streams} repeated streams ({self.shared_bytes / (1024 * 1024):.1f} MB) instead of writing them again")
+        pages = DictionaryObject({
+            NameObject('/Type'): NameObject('/Pages'),
+            NameObject('/Kids'): ArrayObject(IndirectObject(number, 0, None) for number in self.page_numbers),
+            NameObject('/Count'): NumberObject(len(self.page_numbers)),
+        })
+        self._write_object(self.pages_number, pages)
+
+        catalog_number = self._reserve()
+        catalog = DictionaryObject({
+            NameObject('/Type'): NameObject('/Catalog'),
+            NameObject('/Pages'): IndirectObject(self.pages_number, 0, None),
+        })
+        self._write_object(catalog_number, catalog)
+
+        xref_offset = self.file.tell()
+        self.file.write(f"xref\n0 {self.next_number}\n0000000000 65535 f \n".encode())
+        for number in range(1, self.next_number):
+            offset = self.offsets.get(number)
+            self.file.write(f"{offset:010d} 00000 n \n".encode() if offset is not None else b"0000000000 00000 f \n")
+        self.file.write(f"trailer\n<< /Size {self.next_number} /Root {catalog_number} 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode())
+        self.file.close()
+
+
+
+def merge_pdf_batch(pdf_paths, merged_pdf_path, mode=MERGE_MODE):
+    # Merge one SrNo range. Runs in a merge worker process when merging in parallel.
+    # Returns the merged file's path and the time the merge took.
+    start_time = time.perf_counter()
+    if mode in ("streaming", "dedup"):
+        writer = StreamingPdfWriter(merged_pdf_path, dedup=mode == "dedup")
+        try:
+            for pdf_file_path in pdf_paths:
+                try:
+                    writer.append(pdf_file_path)
+                except FileNotFoundError:
+                    logging.warning(f"Skipping {pdf_file_path} - PDF file not found.")
+        finally:
+            writer.close()
+        return merged_pdf_path, time.perf_counter() - start_time
+
+    pdf_merger = PdfMerger()
+    try:
+        for pdf_file_path in pdf_paths:
+            try:
+                pdf_merger.append(pdf_file_path)
+            except FileNotFoundError:
+                logging.warning(f"Skipping {pdf_file_path} - PDF file not found.")
+
+        with open(merged_pdf_path, 'wb') as merged_pdf:
+            pdf_merger.write(merged_pdf)
+    finally:
+        pdf_merger.close()
+    return merged_pdf_path, time.perf_counter() - start_time
+
+
+
+def merge_pdfs_by_srno(output_dir, base_dir, excel_path, potential_column_names, batch_size=5000, mode=MERGE_MODE, num_processes=MERGE_PROCESSES):
     """
     Merge PDFs based on SrNo from an Excel sheet.
 
     Parameters:
-    - output_dir (str): Directory to store the merged PDFs.
+    - output_dir (str or list): Directory with the PDFs to merge, or the directories of all shards of a sharded run.
     - base_dir (str): Base directory for saving the merged PDFs.
     - excel_path (str): Path to the Excel sheet with 'SrNo' column.
     - batch_size (int, optional): Number of SrNo to process in each batch. Default is 5000.
+    - mode (str, optional): 'pypdf' merges each batch in memory with PdfMerger, 'streaming' writes pages to the
+      merged file as they are read, 'dedup' streams too and writes identical fonts and images once. Default is MERGE_MODE.
+    - num_processes (int, optional): Number of batches merged in parallel processes. Default is MERGE_PROCESSES.
     """
 
     # Read Excel sheet with 'SrNo' column
     try:
-        df = pd.read_excel(excel_path, sheet_name="Sheet1")
+        df = load_lang_data(excel_path)
     except pd.errors.EmptyDataError:
         logging.error("Error: Empty Excel sheet.")
         return
 
-    # Create a mapping of SrNo to PDF filenames
-    srno_to_pdf = {str(row['SrNo']): f"{row[column]}.pdf" for _, row in df.iterrows() for column in potential_column_names if column in row}
+    # Map SrNo to PDF filenames, using the same file name column as process_record
+    name_columns = [column for column in potential_column_names if column in df.columns]
+    if not name_columns:
+        logging.error("No valid column found for file names. Unable to merge PDFs.")
+        return
 
-    # Sort SrNo values
-    sorted_srnos = sorted(srno_to_pdf.keys(), key=int)
+    srno_df = pd.DataFrame({'SrNo': df['SrNo'].astype(str), 'pdf_file': df[name_columns[0]].astype(str) + ".pdf"})
+    srno_df = srno_df.drop_duplicates(subset='SrNo', keep='last')
+    srno_df = srno_df.iloc[pd.to_numeric(srno_df['SrNo']).argsort(kind='stable')]
+
+    sorted_srnos = srno_df['SrNo'].tolist()
+    if isinstance(output_dir, (list, tuple)):
+        # Each PDF is taken from the first directory that has it
+        file_paths = {}
+        for directory in reversed(output_dir):
+            file_paths.update((f"{file_name}.pdf", path) for file_name, (path, _) in list_output_files(directory).items())
+        pdf_paths = [file_paths.get(pdf_file) or get_output_path(output_dir[0], pdf_file[:-len(".pdf")]) for pdf_file in srno_df['pdf_file']]
+    else:
+        pdf_paths = [get_output_path(output_dir, pdf_file[:-len(".pdf")]) for pdf_file in srno_df['pdf_file']]
 
     total_pdfs = len(sorted_srnos)
 
-    start_idx = 0
-    end_idx = min(batch_size, total_pdfs)
+    batches = []
+    for start_idx in range(0, total_pdfs, batch_size):
+        end_idx = min(start_idx + batch_size, total_pdfs)
 
-    while start_idx < total_pdfs:
-        pdf_merger = PdfMerger()
+        # Adjust the merged PDF file name
+        merged_start_srno = sorted_srnos[start_idx]
+        merged_end_srno = sorted_srnos[end_idx - 1]
+        merged_pdf_path = os.path.join(base_dir, f'merged_output_srno_{merged_start_srno}-{merged_end_srno}.pdf')
+        batches.append((merged_start_srno, merged_end_srno, pdf_paths[start_idx:end_idx], merged_pdf_path))
 
-        # Initialize variables with default values
-        merged_start_srno = None
-        merged_end_srno = None
-
-        try:
-            for srno in sorted_srnos[start_idx:end_idx]:
-                pdf_file = srno_to_pdf.get(str(srno))
-                if pdf_file:
-                    pdf_file_path = os.path.join(output_dir, pdf_file)
-                    pdf_merger.append(pdf_file_path)
-                else:
-                    logging.warning(f"Skipping SrNo {srno} - PDF file not found.")
-
-            # Adjust the merged PDF file name
-            merged_start_srno = sorted_srnos[start_idx]
-            merged_end_srno = sorted_srnos[end_idx - 1]
-            merged_pdf_path = os.path.join(base_dir, f'merged_output_srno_{merged_start_srno}-{merged_end_srno}.pdf')
-
-            with open(merged_pdf_path, 'wb') as merged_pdf:
-                pdf_merger.write(merged_pdf)
-
-            logging.info(f"Merged PDFs {merged_start_srno} to {merged_end_srno} based on SrNo successfully. Merged PDF saved at: {merged_pdf_path}")
-
-        except FileNotFoundError as fnfe:
-            logging.warning(f"File not found while merging PDFs {merged_start_srno} to {merged_end_srno} based on SrNo: {fnfe}")
-        except Exception as e:
-            logging.error(f"Error merging PDFs {merged_start_srno} to {merged_end_srno} based on SrNo: {e}")
-
-        finally:
-            pdf_merger.close()
+    # Independent SrNo ranges can be merged in parallel processes
+    executor = ProcessPoolExecutor(max_workers=num_processes) if num_processes > 1 else None
 
-        start_idx += batch_size
-        end_idx = min(end_idx + batch_size, total_pdfs)
+    try:
+        futures = {}
+        batch_paths_by_range = {}
+        for merged_start_srno, merged_end_srno, batch_paths, merged_pdf_path in batches:
+            batch_paths_by_range[(merged_start_srno, merged_end_srno)] = batch_paths
+            if executor:
+                future = executor.submit(merge_pdf_batch, batch_paths, merged_pdf_path, mode)
+            else:
+                future = Future()
+                try:
+                    future.set_result(merge_pdf_batch(batch_paths, merged_pdf_path, mode))
+                except Exception as e:
+                    future.set_exception(e)
+            futures[future] = (merged_start_srno, merged_end_srno)
+
+        for future in as_completed(futures):
+            merged_start_srno, merged_end_srno = futures[future]
+            try:
+                merged_pdf_path, seconds = future.result()
+                batch_paths = batch_paths_by_range[(merged_start_srno, merged_end_srno)]
+                existing_paths = [path for path in batch_paths if os.path.exists(path)]
+                metrics.observe('merge', seconds, count=len(existing_paths), bytes_in=sum(os.path.getsize(path) for path in existing_paths),
+                                bytes_out=os.path.getsize(merged_pdf_path))
+                logging.info(f"Merged PDFs {merged_start_srno} to {merged_end_srno} based on SrNo successfully. Merged PDF saved at: {merged_pdf_path}")
+            except FileNotFoundError as fnfe:
+                logging.warning(f"File not found while merging PDFs {merged_start_srno} to {merged_end_srno} based on SrNo: {fnfe}")
+            except Exception as e:
+                metrics.observe('merge', 0, count=len(batch_paths_by_range[(merged_start_srno, merged_end_srno)]), ok=False)
+                logging.error(f"Error merging PDFs {merged_start_srno} to {merged_end_srno} based on SrNo: {e}")
+    finally:
+        if executor:
+            executor.shutdown()
 
     logging.info(" ------------------- All PDFs merged based on SrNo successfully. ------------------------ \n")
 
 
 
-def check_and_update_template(state, possible_files, default_template="default_template.docx", script_dir=os.path.dirname(os.path.abspath(__file__)), template_dict=state_template_dict):
+def check_and_update_template(state, possible_files, default_template="default_template.docx", script_dir=os.path.dirname(os.path.abspath(__file__)), template_dict=state_template_dict, direct_pdf=DIRECT_PDF_TEMPLATES, lang_path=None):
     # Avoid redundant path concatenation
-    lang_path = os.path.join(script_dir, 'lang')
+    lang_path = lang_path or os.path.join(script_dir, 'lang')
+
+    # With direct_pdf, an .html version of a template takes precedence over the .docx
+    if direct_pdf:
+        possible_files = [name for file_name in possible_files for name in (os.path.splitext(file_name)[0] + '.html', file_name)]
 
     # Check for the existence of each file and update the state_template_dict
     for file_name in possible_files:
@@ -287,33 +2068,712 @@ def check_and_update_template(state, possible_files, default_template="default_t
 
 
 
-def check_missing_pdfs(lang_folder, output_dir, potential_column_names):
-    excel_path = os.path.join(lang_folder, "lang_data.xlsx")
-    df = pd.read_excel(excel_path, sheet_name="Sheet1")
+def load_state_templates(template_dict=state_template_dict, lang_path=None):
+    # Map every state to its template file in lang_path (the lang folder next to the script by default)
+    def update(state, possible_files):
+        check_and_update_template(state, possible_files, template_dict=template_dict, lang_path=lang_path)
+
+    update("BIHAR", ['hindi_template.docx']) 
+    update("DELHI", ['hindi_template.docx'])
+    update("HARYANA", ['hindi_template.docx'])
+    update("JHARKHAND", ['hindi_template.docx'])
+    update("HIMACHAL PRADESH", ['hindi_template.docx'])
+    update("MADHYA PRADESH", ['hindi_template.docx'])
+    update("RAJASTHAN", ['hindi_template.docx'])
+    update("CHHATTISGARH", ['hindi_template.docx'])
+    update("UTTAR PRADESH", ['hindi_template.docx'])
+    update("UTTARAKHAND", ['hindi_template.docx'])
+
+    update("WEST BENGAL", ["bengali_template.docx"])
+    update("TRIPURA", ["bengali_template.docx"])
+
+    update("ASSAM", ["assamese_template.docx"])
+    update("GUJARAT", ['gujarati_template.docx'])
+
+    update("GOA", ['marathi_template.docx'])
+    update("MAHARASHTRA", ['marathi_template.docx'])
+
+    update("PUNJAB", ['punjabi_template.docx'])
+
+    update("TAMIL NADU", ['tamil_template.docx'])
+
+    update("KERALA", ['malayalam_template.docx'])
+
+    update('KARNATAKA', ['kanada_template.docx', 'kannada_template.docx', 'kannda_template.docx'])
+
+    update('ORISSA', ['odiya_template.docx', 'orissa_template.docx', 'orisa_template.docx', 'oriya_template.docx'])
+    
+    update('ANDHRA PRADESH', ['telugu_template.docx', 'telgue_template.docx', 'telegu_template.docx'])
+
+    update("DEFAULT", ['default_template.docx'])
+
+
+
+class Manifest:
+    # SQLite record of every output file: hashes of the inputs it was rendered from
+    # (record fields and template) and of each file produced from it.
+    stage_columns = ('pdf_hash', 'compressed_hash', 'uploaded_hash')
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS outputs (
+                                       file_name TEXT PRIMARY KEY,
+                                       record_hash TEXT,
+                                       template_hash TEXT,
+                                       pdf_hash TEXT,
+                                       compressed_hash TEXT,
+                                       uploaded_hash TEXT,
+                                       updated_at TEXT)""")
+        self.connection.commit()
+
+    def get_entries(self):
+        with self.lock:
+            rows = self.connection.execute("SELECT file_name, record_hash, template_hash, pdf_hash, compressed_hash, uploaded_hash FROM outputs").fetchall()
+        return {row[0]: dict(zip(('record_hash', 'template_hash') + self.stage_columns, row[1:])) for row in rows}
+
+    def record_rendered(self, entries):
+        # entries: (file_name, record_hash, template_hash). The PDF and compressed hashes are cleared until those
+        # stages run again; the uploaded hash is kept so an identical file is not uploaded twice.
+        now = datetime.now().isoformat()
+        with self.lock:
+            self.connection.executemany("""INSERT INTO outputs (file_name, record_hash, template_hash, updated_at) VALUES (?, ?, ?, ?)
+                                           ON CONFLICT(file_name) DO UPDATE SET record_hash = excluded.record_hash, template_hash = excluded.template_hash,
+                                           pdf_hash = NULL, compressed_hash = NULL, updated_at = excluded.updated_at""",
+                                        [(str(file_name), record_hash, template_hash, now) for file_name, record_hash, template_hash in entries])
+            self.connection.commit()
+
+    def record_stage(self, column, entries):
+        # entries: (file_name, file_hash) for the files produced by one stage
+        if column not in self.stage_columns:
+            raise ValueError(f"Unknown manifest column: {column}")
+
+        now = datetime.now().isoformat()
+        with self.lock:
+            self.connection.executemany(f"""INSERT INTO outputs (file_name, {column}, updated_at) VALUES (?, ?, ?)
+                                            ON CONFLICT(file_name) DO UPDATE SET {column} = excluded.{column}, updated_at = excluded.updated_at""",
+                                        [(str(file_name), file_hash, now) for file_name, file_hash in entries])
+            self.connection.commit()
+
+    def merge_from(self, other_path):
+        # Copy the rows of another manifest, e.g. of one shard, keeping the most recently updated row per file
+        with self.lock:
+            self.connection.execute("ATTACH DATABASE ? AS other", (other_path,))
+            try:
+                self.connection.execute("""INSERT INTO outputs SELECT file_name, record_hash, template_hash, pdf_hash, compressed_hash, uploaded_hash, updated_at
+                                           FROM other.outputs WHERE true
+                                           ON CONFLICT(file_name) DO UPDATE SET record_hash = excluded.record_hash, template_hash = excluded.template_hash,
+                                           pdf_hash = excluded.pdf_hash, compressed_hash = excluded.compressed_hash, uploaded_hash = excluded.uploaded_hash,
+                                           updated_at = excluded.updated_at
+                                           WHERE excluded.updated_at >= outputs.updated_at OR outputs.updated_at IS NULL""")
+                self.connection.commit()
+            finally:
+                self.connection.execute("DETACH DATABASE other")
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class Journal:
+    """
+    Append-only log of each record's progress through render, convert, compress and upload.
+    Every line is a JSON object written and flushed as soon as a stage finishes a set of files,
+    so after a crash `--resume` knows which work is done and which records were in flight.
+    """
+    stages = ('render', 'convert', 'compress', 'upload')
+
+    def __init__(self, path, resume=False, sync_interval=1.0):
+        self.path = path
+        self.lock = threading.Lock()
+        self.progress = {}
+        self.run_info = {}
+        # fsync at most this often; flushing every line already survives a process crash
+        self.sync_interval = sync_interval
+        self.last_sync = 0
+
+        if resume and os.path.exists(path):
+            self._load()
+        self.file = open(path, 'a' if resume else 'w', encoding='utf-8')
+        if resume and self.file.tell() > 0:
+            # A torn last line from a crash would swallow the next entry
+            with open(path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    self.file.write('\n')
+
+    def _load(self):
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Torn write from the crash
+                    continue
+                if 'run' in entry:
+                    self.run_info.update(entry['run'])
+                    continue
+                stage_index = self.stages.index(entry['stage'])
+                for file_name in entry['files']:
+                    if self.progress.get(file_name, -1) < stage_index:
+                        self.progress[file_name] = stage_index
+        logging.info(f"Journal {self.path}: {len(self.progress)} records in progress or done")
+
+    def _write(self, entry):
+        with self.lock:
+            self.file.write(json.dumps(entry, default=str) + '\n')
+            self.file.flush()
+            if time.monotonic() - self.last_sync >= self.sync_interval:
+                os.fsync(self.file.fileno())
+                self.last_sync = time.monotonic()
+
+    def start_run(self, info):
+        # Run settings a resumed run must reuse, like the S3 folder
+        self.run_info.update(info)
+        self._write({'run': info, 'time': datetime.now().isoformat()})
+
+    def record(self, stage, file_names):
+        file_names = [str(file_name) for file_name in file_names if file_name is not None]
+        if not file_names:
+            return
+        stage_index = self.stages.index(stage)
+        with self.lock:
+            for file_name in file_names:
+                if self.progress.get(file_name, -1) < stage_index:
+                    self.progress[file_name] = stage_index
+        self._write({'stage': stage, 'files': file_names, 'time': datetime.now().isoformat()})
+
+    def completed(self, file_name, stage):
+        return self.progress.get(str(file_name), -1) >= self.stages.index(stage)
+
+    def get_resume_stage(self, file_name, output_dir, compress_dir):
+        # Last stage whose output is still there. OUTPUT may have been deleted after compression.
+        file_name = str(file_name)
+        stage_index = self.progress.get(file_name, -1)
+        pdf_path = get_output_path(output_dir, file_name)
+        if stage_index >= self.stages.index('upload'):
+            return 'upload'
+        if stage_index >= self.stages.index('compress') and os.path.exists(get_output_path(compress_dir, file_name)):
+            return 'compress'
+        if stage_index >= self.stages.index('render') and os.path.exists(pdf_path) and os.path.getsize(pdf_path) > 0:
+            # Direct-to-PDF templates produce the PDF in the render stage
+            return 'convert'
+        if stage_index >= self.stages.index('render') and os.path.exists(os.path.join(output_dir, f"{file_name}.docx")):
+            return 'render'
+        return None
+
+    def get_files_to_convert(self, output_dir, compress_dir):
+        # Records whose DOCX was rendered before the crash but not converted yet
+        with self.lock:
+            file_names = list(self.progress)
+        return [file_name for file_name in file_names if self.get_resume_stage(file_name, output_dir, compress_dir) == 'render']
+
+    def get_records_to_render(self, df, potential_column_names, output_dir, compress_dir):
+        # Records with nothing usable on disk; anything further along is picked up by the later stages
+        file_names = [get_record_file_name(record, potential_column_names) for record in df.to_dict('records')]
+        to_render = [self.get_resume_stage(file_name, output_dir, compress_dir) is None for file_name in file_names]
+        return df[to_render]
+
+    def close(self):
+        with self.lock:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+
+
+
+file_hash_cache = {}
+
+
+def hash_file(file_path, cache=False):
+    # cache=True remembers the hash per path/mtime/size, for files hashed over and over like templates
+    if cache:
+        stat = os.stat(file_path)
+        key = (file_path, stat.st_mtime, stat.st_size)
+        if key in file_hash_cache:
+            return file_hash_cache[key]
+
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    file_hash = digest.hexdigest()
+
+    if cache:
+        file_hash_cache[key] = file_hash
+    return file_hash
+
+
+
+def hash_record(record):
+    return hashlib.sha256(json.dumps(dict(record), sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+
+def get_record_hashes(record, state_template_dict, potential_column_names):
+    # (file_name, record_hash, template_hash) identifying what an output file is rendered from
+    file_name = get_record_file_name(record, potential_column_names)
+    template_path = get_template_path(str(record.get('State', '')).upper(), state_template_dict)
+    return file_name, hash_record(record), hash_file(template_path, cache=True)
+
+
+
+def get_pending_records(df, manifest, state_template_dict, potential_column_names, stage='compressed_hash'):
+    """
+    Find the records whose output is out of date in the manifest.
+
+    Parameters:
+    - df (DataFrame): The records.
+    - manifest (Manifest): The manifest of earlier runs.
+    - state_template_dict (dict): A dictionary mapping state names to their corresponding template file paths.
+    - potential_column_names (list): A list of potential column names to be used for generating the file name.
+    - stage (str, optional): 'pdf_hash', 'compressed_hash' or 'uploaded_hash', the last stage that has to be done
+      for a record to count as up to date. Default is 'compressed_hash'.
+
+    Returns:
+    - DataFrame: The records that changed since they were last rendered, or did not get through that stage.
+    """
+    entries = manifest.get_entries()
+    pending = []
+
+    for record in df.to_dict('records'):
+        file_name, record_hash, template_hash = get_record_hashes(record, state_template_dict, potential_column_names)
+        entry = entries.get(str(file_name))
+
+        up_to_date = (entry is not None and entry['record_hash'] == record_hash and entry['template_hash'] == template_hash
+                      and entry['pdf_hash'] is not None)
+        if up_to_date and stage in ('compressed_hash', 'uploaded_hash'):
+            up_to_date = entry['compressed_hash'] is not None
+        if up_to_date and stage == 'uploaded_hash':
+            up_to_date = entry['uploaded_hash'] == entry['compressed_hash']
+
+        pending.append(not up_to_date)
+
+    return df[pending]
+
+
+
+def record_rendered_in_manifest(manifest, records, state_template_dict, potential_column_names):
+    manifest.record_rendered([get_record_hashes(record, state_template_dict, potential_column_names) for record in records])
+
+
+
+def record_files_in_manifest(manifest, column, directory, file_names):
+    # Hash the PDFs a stage produced in directory and store them under column
+    entries = []
+    for file_name in file_names:
+        pdf_path = get_output_path(directory, file_name)
+        if os.path.exists(pdf_path):
+            entries.append((file_name, hash_file(pdf_path)))
+    manifest.record_stage(column, entries)
+
+
+
+# Parsed input sheets by path, shared by every stage of a run
+lang_data_cache = {}
+lang_data_lock = threading.Lock()
+
+
+
+def get_lang_data_path(lang_folder):
+    # LANG_DATA_FILE wins, otherwise the first of lang_data.xlsx / .parquet / .csv found in lang_folder
+    if LANG_DATA_FILE:
+        return LANG_DATA_FILE
+    for extension in ('.xlsx', '.parquet', '.csv'):
+        data_path = os.path.join(lang_folder, f"lang_data{extension}")
+        if os.path.exists(data_path):
+            return data_path
+    return os.path.join(lang_folder, "lang_data.xlsx")
+
+
 
-    # Create a list to store missing PDF documents
-    missing_pdfs = []
+def read_lang_data(data_path, cache_dir=None):
+    """
+    Parse an input sheet, going through a columnar sidecar keyed on the file's content hash.
+    Parquet inputs are already columnar and are read directly.
+    """
+    extension = os.path.splitext(data_path)[1].lower()
+    if extension == '.parquet':
+        return pd.read_parquet(data_path)
+    if extension == '.pkl':
+        # Written by write_data_frame, e.g. the data files of shards
+        return pd.read_pickle(data_path)
+
+    cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(data_path)), ".cache")
+    base_name = os.path.splitext(os.path.basename(data_path))[0]
+    cache_prefix = os.path.join(cache_dir, f"{base_name}-{hash_file(data_path)[:16]}")
+
+    for cache_path in (f"{cache_prefix}.parquet", f"{cache_prefix}.pkl"):
+        if os.path.exists(cache_path):
+            try:
+                df = pd.read_parquet(cache_path) if cache_path.endswith('.parquet') else pd.read_pickle(cache_path)
+                logging.info(f"Loaded {data_path} from cache {cache_path}")
+                return df
+            except Exception as e:
+                logging.warning(f"Ignoring unreadable cache {cache_path}: {e}")
+
+    start_time = time.perf_counter()
+    if extension == '.csv':
+        df = pd.read_csv(data_path)
+    else:
+        # pandas opens the workbook with openpyxl in read-only mode, streaming rows instead of loading the whole tree
+        df = pd.read_excel(data_path, sheet_name="Sheet1", engine="openpyxl")
+    logging.info(f"Parsed {data_path} ({len(df)} rows) in {time.perf_counter() - start_time:.1f}s")
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Drop sidecars of earlier versions of the file
+        for file_name in os.listdir(cache_dir):
+            if file_name.startswith(f"{base_name}-") and file_name.endswith(('.parquet', '.pkl')):
+                os.remove(os.path.join(cache_dir, file_name))
+
+        write_data_frame(df, cache_prefix)
+    except OSError as e:
+        logging.warning(f"Could not write cache for {data_path}: {e}")
+
+    return df
+
+
+
+def write_data_frame(df, path_prefix):
+    # Save df as path_prefix.parquet, or .pkl when pyarrow is missing or a column has no Parquet type.
+    # Written under a temp name first so readers never see a partial file. Returns the path written.
+    data_path = None
+    if pyarrow is not None:
+        try:
+            df.to_parquet(f"{path_prefix}.parquet.tmp", index=False)
+            data_path = f"{path_prefix}.parquet"
+        except (pyarrow.ArrowException, ValueError, TypeError):
+            # Columns mixing numbers and text have no Parquet type; a pickle keeps them as they are
+            data_path = None
+    if data_path is None:
+        df.to_pickle(f"{path_prefix}.pkl.tmp")
+        data_path = f"{path_prefix}.pkl"
+    os.replace(f"{data_path}.tmp", data_path)
+    return data_path
+
+
+
+def load_lang_data(data_path, cache_dir=DATA_CACHE_DIR):
+    """
+    Return the records of an input sheet (.xlsx, .csv or .parquet). The sheet is parsed once per run, and
+    once per file version across runs; every caller gets the same DataFrame, which must not be modified in place.
+    """
+    stat = os.stat(data_path)
+    key = (stat.st_mtime, stat.st_size)
+    with lang_data_lock:
+        cached = lang_data_cache.get(os.path.abspath(data_path))
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        df = read_lang_data(data_path, cache_dir)
+        lang_data_cache[os.path.abspath(data_path)] = (key, df)
+        return df
+
+
+
+dedup_policies = ("keep-first", "keep-last", "fail", "off")
+
+
+
+def hash_record_keys(df, name_column, chunk_size=100000):
+    # 64-bit hash of every record's file name. The names are turned into strings one chunk at a time,
+    # so no string copy of the whole column is made next to the DataFrame.
+    hashes = [pd.util.hash_pandas_object(df[name_column].iloc[start:start + chunk_size].astype(str), index=False)
+              for start in range(0, len(df), chunk_size)]
+    return pd.concat(hashes, ignore_index=True) if hashes else pd.Series([], dtype='uint64')
+
+
+
+def dedup_records(df, potential_column_names, policy=DEDUP_POLICY, report_path=None):
+    """
+    Drop the records that would produce the same output file as another record, before any of them is rendered.
+
+    Parameters:
+    - df (DataFrame): Records to check.
+    - potential_column_names (list): File name columns; the first one present names the files, like in process_record.
+    - policy (str, optional): 'keep-first' or 'keep-last' record of each file name, 'fail' to raise a ValueError
+      when there are duplicates, or 'off'. Default is DEDUP_POLICY.
+    - report_path (str, optional): .xlsx or .csv file for every record sharing a file name, with a 'Kept' column.
+
+    Returns the records to process.
+    """
+    if policy not in dedup_policies:
+        raise ValueError(f"Unknown dedup policy: {policy}. Use one of {', '.join(dedup_policies)}.")
+    name_columns = [column for column in potential_column_names if column in df.columns]
+    if policy == "off" or not name_columns or df.empty:
+        return df
+
+    start_time = time.perf_counter()
+    name_column = name_columns[0]
+    valid = (df[name_column].notna() & (df[name_column] != '')).to_numpy()
+
+    # The hash index finds the candidates; their names are compared as strings, so a hash collision can't drop a record
+    hashes = hash_record_keys(df, name_column)[valid]
+    candidates = hashes.duplicated(keep=False).to_numpy()
+    positions = valid.nonzero()[0][candidates]
+    names = df[name_column].iloc[positions].astype(str).reset_index(drop=True)
+    duplicated = names.duplicated(keep=False).to_numpy()
+    positions, names = positions[duplicated], names[duplicated].reset_index(drop=True)
+
+    keep_last = policy == "keep-last"
+    is_dropped = names.duplicated(keep='last' if keep_last else 'first').to_numpy()
+    dropped = positions[is_dropped]
+    metrics.observe('dedup', time.perf_counter() - start_time, count=len(df))
+
+    if len(positions) == 0:
+        logging.info(f"No duplicate file names in {len(df)} records")
+        return df
+
+    if report_path:
+        report_df = df.iloc[positions].copy()
+        if policy != "fail":
+            report_df['Kept'] = ~is_dropped
+        write_retry_sheet(report_df, report_path)
+
+    message = f"{len(dropped)} records share their {name_column} with another record ({names.nunique()} file names)"
+    if policy == "fail":
+        logging.error(f"{message}. Stopping before rendering." + (f" Duplicates saved to {report_path}" if report_path else ""))
+        raise ValueError(message)
+
+    logging.warning(f"{message}. Skipping them, keeping the {'last' if keep_last else 'first'} record of each."
+                    + (f" Duplicates saved to {report_path}" if report_path else ""))
+    keep = pd.Series(True, index=range(len(df)))
+    keep.iloc[dropped] = False
+    return df[keep.to_numpy()]
+
+
+
+# Layouts of OUTPUT and COMPRESS: one flat folder, or a subfolder per file picked by get_shard_name()
+output_layouts = ('flat', 'hash', 'prefix')
+
+
+def get_shard_name(file_name, layout=OUTPUT_LAYOUT):
+    # 'hash': the first two hex digits of the name's MD5, 256 evenly filled subfolders.
+    # 'prefix': the first two characters of the name, easy to find by hand. 'flat': no subfolder.
+    if layout == 'hash':
+        return hashlib.md5(str(file_name).encode('utf-8')).hexdigest()[:2]
+    if layout == 'prefix':
+        # Upper case, so the folders are the same on case-insensitive file systems
+        return re.sub(r'[^0-9A-Za-z]', '_', str(file_name)[:2]).upper().ljust(2, '_')
+    if layout != 'flat':
+        raise ValueError(f"Unknown layout: {layout}. Use one of: {', '.join(output_layouts)}")
+    return ''
+
+
+def get_output_path(directory, file_name, extension='.pdf', layout=OUTPUT_LAYOUT):
+    # Where the file of a record is in directory
+    return os.path.join(directory, get_shard_name(file_name, layout), f"{file_name}{extension}")
+
+
+def make_output_path(directory, file_name, extension='.pdf', layout=OUTPUT_LAYOUT):
+    # get_output_path(), creating the subfolder when needed
+    path = get_output_path(directory, file_name, extension, layout)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if layout != 'flat':
+        # Opened before the file is written, so indexing the files already there can't index it twice
+        get_output_index(directory)
+    return path
+
+
+class OutputIndex:
+    """
+    Append-only index of the files in a sharded OUTPUT or COMPRESS folder, kept as index.jsonl in the folder.
+    Every file written adds a {"name", "path", "size", "hash"} line; the last line for a name wins.
+    Stages list the folder from the index instead of walking all of its subfolders.
+    """
+    file_name = "index.jsonl"
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, self.file_name)
+        os.makedirs(directory, exist_ok=True)
+        # Unbuffered, so each line is one append and render processes can share the file
+        self.file = open(self.path, 'ab', buffering=0)
+
+    def record(self, file_path):
+        name = os.path.basename(file_path)
+        entry = {'name': name, 'path': os.path.relpath(file_path, self.directory).replace(os.sep, '/'),
+                 'size': os.path.getsize(file_path), 'hash': hash_file(file_path)}
+        self.file.write((json.dumps(entry) + '\n').encode('utf-8'))
+
+    def load(self):
+        # {file name with extension: (path, size)}
+        files = {}
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Torn write from a crash
+                    continue
+                files[entry['name']] = (os.path.join(self.directory, entry['path']), entry['size'])
+        return files
+
+    def rebuild(self):
+        # Index the files already in the subfolders, e.g. after index.jsonl was deleted.
+        # Files at the top of the folder are not finished yet, like a converter's output before it is placed.
+        with os.scandir(self.directory) as entries:
+            shard_dirs = [entry.path for entry in entries if entry.is_dir()]
+        for shard_dir in shard_dirs:
+            for root, _, file_names in os.walk(shard_dir):
+                for file_name in file_names:
+                    self.record(os.path.join(root, file_name))
+
+    def close(self):
+        self.file.close()
+
+
+output_indexes = {}
+output_indexes_lock = threading.Lock()
+
+
+def get_output_index(directory):
+    # One OutputIndex per folder and process
+    directory = os.path.abspath(directory)
+    with output_indexes_lock:
+        index = output_indexes.get(directory)
+        if index is not None and not os.path.exists(index.path):
+            # The folder or its index was deleted since, don't keep appending to the deleted file
+            index.close()
+            index = None
+        if index is None:
+            rebuild = not os.path.exists(os.path.join(directory, OutputIndex.file_name)) and os.path.isdir(directory)
+            index = OutputIndex(directory)
+            if rebuild:
+                index.rebuild()
+            output_indexes[directory] = index
+        return index
+
+
+def close_output_indexes(directory=None):
+    # Close the open indexes of directory and the folders inside it (all of them without a directory),
+    # before the folder is deleted: Windows can't delete a folder with an open file in it
+    with output_indexes_lock:
+        for index_directory in list(output_indexes):
+            if directory is None or index_directory == os.path.abspath(directory) or index_directory.startswith(os.path.join(os.path.abspath(directory), '')):
+                output_indexes.pop(index_directory).close()
+
+
+
+def place_output_file(directory, file_path, layout=OUTPUT_LAYOUT):
+    """
+    Put a finished file in its place in directory and index it. Files written to the top of the folder,
+    like a converter's PDFs, are moved into their subfolder. Returns the file's path.
+    """
+    if layout == 'flat':
+        return file_path
+    file_name, extension = os.path.splitext(os.path.basename(file_path))
+    target_path = make_output_path(directory, file_name, extension, layout)
+    if os.path.abspath(file_path) != os.path.abspath(target_path):
+        os.replace(file_path, target_path)
+    get_output_index(directory).record(target_path)
+    return target_path
+
+
+def list_output_files(directory, extension='.pdf', layout=OUTPUT_LAYOUT):
+    # {file name without extension: (path, size in bytes)}, from the index in a sharded layout, otherwise one directory listing
+    files = {}
+    if not os.path.isdir(directory):
+        return files
+    if layout != 'flat':
+        for name, (path, size) in get_output_index(directory).load().items():
+            if name.endswith(extension):
+                files[name[:-len(extension)]] = (path, size)
+        return files
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.endswith(extension) and entry.is_file():
+                files[entry.name[:-len(extension)]] = (entry.path, entry.stat().st_size)
+    return files
+
+
+def scan_output_files(directory, extension='.pdf'):
+    # {file name without extension: size in bytes}
+    return {name: size for name, (_, size) in list_output_files(directory, extension).items()}
+
+
+def reconcile_outputs(df, directory, potential_column_names, extension='.pdf'):
+    """
+    Compare the records of df with the files in directory.
+
+    Returns a dict with:
+    - missing (list): File names with no file in directory, in sheet order.
+    - zero_byte (list): File names whose file is empty.
+    - extra (list): Files in directory that no record produces.
+    - missing_df (DataFrame): Rows of df that are missing or zero-byte.
+    """
+    existing = scan_output_files(directory, extension)
+
+    # Files are named by the first file name column present, like process_record does
+    name_columns = [column for column in potential_column_names if column in df.columns]
+    if not name_columns:
+        logging.error("No valid column found for file names. Unable to check outputs.")
+        return {'missing': [], 'zero_byte': [], 'extra': sorted(existing), 'missing_df': df.iloc[0:0]}
+
+    # Plain object strings: isin against a set of file names is several times faster than on pandas' string dtype
+    names = df[name_columns[0]].astype(str).astype(object)
+    valid = df[name_columns[0]].notna() & (names != '')
 
-    for _, row in df.iterrows():
+    empty_files = {name for name, size in existing.items() if size == 0}
+    present = valid & names.isin(existing.keys())
+    zero_byte = valid & names.isin(empty_files)
+    missing = valid & ~present
 
-        # Try each potential file name until a valid one is found
-        file_name = next((row.get(name, '') for name in potential_column_names if row.get(name, '')), None)
+    return {
+        'missing': names[missing].tolist(),
+        'zero_byte': names[zero_byte].tolist(),
+        'extra': sorted(set(existing) - set(names[valid])),
+        'missing_df': df[(missing | zero_byte).to_numpy()],
+    }
 
-        if file_name:
-            pdf_file_path = os.path.join(output_dir, f"{file_name}.pdf")
 
-            # Check if the generated PDF file exists
-            if not os.path.exists(pdf_file_path):
-                missing_pdfs.append(file_name)
+
+def write_retry_sheet(missing_df, retry_sheet_path):
+    # Same layout as the input sheet so it can be fed back in as LANG_DATA_FILE
+    if retry_sheet_path.lower().endswith('.csv'):
+        missing_df.to_csv(retry_sheet_path, index=False)
+    else:
+        missing_df.to_excel(retry_sheet_path, sheet_name="Sheet1", index=False)
+    logging.info(f"Saved {len(missing_df)} records to {retry_sheet_path}")
+
+
+
+def check_missing_pdfs(lang_folder, output_dir, potential_column_names, manifest=None, state_template_dict=state_template_dict, retry_sheet_path=None, data_path=None,
+                       journal=None, compress_dir=None):
+    df = load_lang_data(data_path or get_lang_data_path(lang_folder))
+
+    if journal is not None and compress_dir:
+        # Records compressed before a restart are no longer in output_dir
+        done = [journal.get_resume_stage(record_name, output_dir, compress_dir) in ('compress', 'upload')
+                for record_name in (get_record_file_name(record, potential_column_names) for record in df.to_dict('records'))]
+        df = df[[not record_done for record_done in done]]
+
+    if manifest is not None:
+        # A PDF is missing when the manifest has no PDF for the record's current fields and template
+        missing_df = get_pending_records(df, manifest, state_template_dict, potential_column_names, stage='pdf_hash')
+        missing_pdfs = [get_record_file_name(record, potential_column_names) for record in missing_df.to_dict('records')]
+    else:
+        result = reconcile_outputs(df, output_dir, potential_column_names)
+        missing_df = result['missing_df']
+        missing_pdfs = result['missing'] + result['zero_byte']
+
+        if result['zero_byte']:
+            logging.error(f"{len(result['zero_byte'])} empty PDFs will be generated again: " + ", ".join(result['zero_byte']))
+        if result['extra']:
+            logging.warning(f"{len(result['extra'])} PDFs in {output_dir} do not belong to any record: " + ", ".join(result['extra']))
 
     if missing_pdfs:
         # Log missing PDFs as errors
-        logging.error("Missing PDFs:")
-        for missing_pdf in missing_pdfs:
-            logging.error(f"- {missing_pdf}")
-
+        logging.error("Missing PDFs:\n" + "\n".join(f"- {missing_pdf}" for missing_pdf in missing_pdfs))
         logging.error("End of Missing PDFs")
 
+        if retry_sheet_path:
+            write_retry_sheet(missing_df, retry_sheet_path)
+
         # Return the list of missing PDFs
         return missing_pdfs
     else:
@@ -322,85 +2782,256 @@ def check_missing_pdfs(lang_folder, output_dir, potential_column_names):
 
 
 
-def process_missing_pdfs(lang_folder, output_dir, missing_pdfs, state_template_dict):
+def process_missing_pdfs(lang_folder, output_dir, missing_pdfs, state_template_dict, manifest=None, potential_column_names=['Filename', 'Prospect_no', 'LAN_Details', 'CUID_NO'], max_attempts=MISSING_RETRY_ATTEMPTS, report_path=None, data_path=None, journal=None,
+                         in_memory=RENDER_IN_MEMORY):
+
+    if not missing_pdfs:
+        print("No missing PDFs to process.")
+        return {}
+
+    df = load_lang_data(data_path or get_lang_data_path(lang_folder))
+
+    # Files are named by the first file name column present, like process_record does. The names are
+    # compared as text: check_missing_pdfs returns strings, also for numeric Prospect_no or CUID_NO columns
+    name_columns = [column for column in potential_column_names if column in df.columns]
+    missing_names = {str(file_name) for file_name in missing_pdfs}
+
+    # Filter DataFrame to include only missing PDFs
+    missing_pdfs_df = df[df[name_columns[0]].astype(str).isin(missing_names)] if name_columns else df.iloc[0:0]
+
+    if missing_pdfs_df.empty:
+        print("No columns found containing missing PDF filenames.")
+        return {}
+
+    if manifest is not None:
+        record_rendered_in_manifest(manifest, missing_pdfs_df.to_dict('records'), state_template_dict, potential_column_names)
+
+    converter = get_pdf_converter()
+    pending = {get_record_file_name(record, potential_column_names): record for record in missing_pdfs_df.to_dict('records')}
+    errors = {}
+
+    for attempt in range(1, max_attempts + 1):
+        errors = {}
+
+        # Re-render only the records that still have no PDF
+        docx_paths = {}
+        documents = {} if in_memory else None
+        with ThreadPoolExecutor() as executor:
+            futures = {executor.submit(process_record, record, output_dir, state_template_dict, potential_column_names, documents): file_name for file_name, record in pending.items()}
+            for future in as_completed(futures):
+                file_name = futures[future]
+                result = future.result()
+                if not result or result[0] is None:
+                    errors[file_name] = "Rendering failed, see error_log.txt"
+                    continue
+
+                docx_path = os.path.join(output_dir, f"{file_name}.docx")
+                if os.path.exists(docx_path):
+                    docx_paths[docx_path] = file_name
+
+        if documents:
+            errors.update(convert_docx_documents(converter, documents, output_dir))
+
+        # Convert exactly these files as one batch, leaving anything else in output_dir alone
+        if docx_paths:
+            failures = convert_docx_files(converter, list(docx_paths), output_dir)
+            for docx_path, error in failures.items():
+                errors[docx_paths[docx_path]] = error
+
+            for docx_path in docx_paths:
+                if os.path.exists(docx_path):
+                    os.remove(docx_path)
+
+        generated = []
+        for file_name in list(pending):
+            pdf_path = get_output_path(output_dir, file_name)
+            if os.path.exists(pdf_path) and os.path.getsize(pdf_path) > 0:
+                del pending[file_name]
+                errors.pop(file_name, None)
+                generated.append(file_name)
+            else:
+                errors.setdefault(file_name, "No PDF was produced")
+
+        if journal is not None:
+            journal.record('convert', generated)
+
+        if not pending:
+            break
+
+        logging.warning(f"{len(pending)} missing PDFs failed on attempt {attempt} of {max_attempts}")
+        if attempt < max_attempts:
+            # Give the converter fresh resources (Word/soffice) before retrying the failures
+            converter.reset()
+
+    if errors:
+        logging.error(f"{len(errors)} PDFs could not be generated after {max_attempts} attempts:\n" + "\n".join(f"- {file_name}: {error}" for file_name, error in errors.items()))
+        if report_path:
+            failed_df = pd.DataFrame(list(pending.values()))
+            failed_df['Error'] = [errors[file_name] for file_name in pending]
+            write_retry_sheet(failed_df, report_path)
+    else:
+        logging.info(f"Generated all {len(missing_pdfs_df)} missing PDFs")
+
+    if manifest is not None:
+        file_names = [get_record_file_name(record, potential_column_names) for record in missing_pdfs_df.to_dict('records')]
+        record_files_in_manifest(manifest, 'pdf_hash', output_dir, file_names)
+
+    return errors
+
+
+
+# One S3 client (and connection pool) per set of credentials, shared by all upload threads
+s3_clients = {}
+s3_clients_lock = threading.Lock()
+
+# Large files (e.g. merged PDFs) are uploaded in parts
+s3_transfer_config = TransferConfig(multipart_threshold=S3_MULTIPART_THRESHOLD, multipart_chunksize=S3_MULTIPART_THRESHOLD,
+                                    max_concurrency=S3_MULTIPART_CONCURRENCY)
+
+# Error codes worth retrying
+transient_s3_error_codes = {'RequestTimeout', 'RequestTimeTooSkewed', 'SlowDown', 'Throttling', 'ThrottlingException',
+                            'InternalError', 'ServiceUnavailable', '500', '502', '503', '504'}
+
 
-    if not missing_pdfs:
-        print("No missing PDFs to process.")
-        return
+def get_s3_client(aws_access_key_id=None, aws_secret_access_key=None, aws_region=None):
+    key = (aws_access_key_id, aws_secret_access_key, aws_region, S3_ENDPOINT_URL)
 
-    excel_path = os.path.join(lang_folder, "lang_data.xlsx")
-    df = pd.read_excel(excel_path, sheet_name="Sheet1")
+    with s3_clients_lock:
+        s3 = s3_clients.get(key)
+        if s3 is None:
+            config = Config(max_pool_connections=max(UPLOAD_WORKERS, 10) + S3_MULTIPART_CONCURRENCY, retries={'max_attempts': 3, 'mode': 'standard'})
+            s3 = boto3.client('s3', aws_access_key_id=aws_access_key_id, aws_secret_access_key=aws_secret_access_key, region_name=aws_region,
+                              endpoint_url=S3_ENDPOINT_URL, config=config)
+            s3_clients[key] = s3
+        return s3
 
-    # Iterate over columns to find a column that contains the missing filenames
-    matching_columns = [col for col in df.columns if df[col].isin(missing_pdfs).any()]
 
-    if not matching_columns:
-        print("No columns found containing missing PDF filenames.")
-        return
 
-    # Filter DataFrame to include only missing PDFs
-    missing_pdfs_df = df[df[matching_columns[0]].isin(missing_pdfs)]
+def is_transient_s3_error(error):
+    if isinstance(error, (BotoConnectionError, HTTPClientError)):
+        return True
+    if isinstance(error, ClientError):
+        return error.response.get('Error', {}).get('Code') in transient_s3_error_codes
+    if isinstance(error, S3UploadFailedError):
+        # upload_file raises it while handling the ClientError it wraps
+        wrapped = error.__cause__ or error.__context__
+        return wrapped is not None and is_transient_s3_error(wrapped)
+    return False
 
-    try:
-        with ThreadPoolExecutor() as executor:
-            # Pass state_template_dict as an additional argument to process_record function
-            futures = [executor.submit(process_record, row, output_dir, state_template_dict) for _, row in missing_pdfs_df.iterrows()]
 
-            # Wait for all tasks to complete
-            for future in as_completed(futures):
-                try:
-                    file_name = future.result()
-                    if file_name:
-                        generate_pdf_from_docx(output_dir)
 
-                except Exception as conversion_error:
-                    print(f"Error during conversion: {conversion_error}")
+def upload_to_s3(local_file_path, bucket, s3_file_name, aws_access_key_id=None, aws_secret_access_key=None, aws_region=None, max_attempts=S3_UPLOAD_ATTEMPTS):
+    start_time = time.perf_counter()
+    success = upload_file_to_s3(local_file_path, bucket, s3_file_name, aws_access_key_id, aws_secret_access_key, aws_region, max_attempts)
 
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        # Log the error for further investigation
-        logging.error(f"An error occurred during PDF processing: {e}")
+    file_size = os.path.getsize(local_file_path) if success else 0
+    metrics.observe('upload', time.perf_counter() - start_time, ok=success, bytes_in=file_size, bytes_out=file_size)
+    return success
 
 
 
-def upload_to_s3(local_file_path, bucket, s3_file_name, aws_access_key_id=None, aws_secret_access_key=None, aws_region=None):
-    s3 = boto3.client('s3', aws_access_key_id=aws_access_key_id, aws_secret_access_key=aws_secret_access_key, region_name=aws_region)
+def upload_file_to_s3(local_file_path, bucket, s3_file_name, aws_access_key_id=None, aws_secret_access_key=None, aws_region=None, max_attempts=S3_UPLOAD_ATTEMPTS):
+    s3 = get_s3_client(aws_access_key_id, aws_secret_access_key, aws_region)
+    extra_args = {'ContentType': 'application/pdf', 'ContentDisposition': 'inline'}
 
-    try:
-        s3.upload_file(
-            local_file_path,
-            bucket,
-            s3_file_name,
-            ExtraArgs={'ContentType': 'application/pdf', 'ContentDisposition': 'inline'}
-        )
-        logging.info(f"File uploaded successfully to {bucket}/{s3_file_name}")
-        return True
-    except FileNotFoundError:
-        logging.error("The file was not found")
-    except NoCredentialsError:
-        logging.error("Credentials not available")
-    except Exception as e:
-        logging.error(f"An error occurred: {e}")
+    for attempt in range(1, max_attempts + 1):
+        try:
+            if os.path.getsize(local_file_path) >= S3_MULTIPART_THRESHOLD:
+                s3.upload_file(local_file_path, bucket, s3_file_name, ExtraArgs=extra_args, Config=s3_transfer_config)
+            else:
+                # A single PUT avoids starting a transfer manager for every small file
+                with open(local_file_path, 'rb') as body:
+                    s3.put_object(Bucket=bucket, Key=s3_file_name, Body=body, **extra_args)
+            log_event('upload', 'uploaded', key=f"{bucket}/{s3_file_name}", attempt=attempt)
+            return True
+        except FileNotFoundError:
+            logging.error("The file was not found")
+            log_event('upload', 'failed', level=logging.ERROR, key=f"{bucket}/{s3_file_name}", error="file not found")
+            return False
+        except NoCredentialsError:
+            logging.error("Credentials not available")
+            log_event('upload', 'failed', level=logging.ERROR, key=f"{bucket}/{s3_file_name}", error="no credentials")
+            return False
+        except Exception as e:
+            if attempt < max_attempts and is_transient_s3_error(e):
+                # Exponential backoff with jitter
+                delay = S3_RETRY_BASE_DELAY * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+                log_event('upload', 'retry', level=logging.WARNING, key=f"{bucket}/{s3_file_name}", attempt=attempt, delay=round(delay, 1), error=str(e))
+                time.sleep(delay)
+                continue
+            logging.error(f"An error occurred: {e}")
+            log_event('upload', 'failed', level=logging.ERROR, key=f"{bucket}/{s3_file_name}", attempt=attempt, error=str(e))
+            return False
     return False
 
 
 
-def uploading_to_s3(output_dir, s3_uri, s3_bucket_name, aws_access_key_id, aws_secret_access_key, aws_region, failed_files_dir):
+def get_s3_key(s3_uri, file_path, layout=S3_KEY_LAYOUT):
+    # S3 keys have their own layout: flat by default, whatever the layout of the local folders
+    file_name = os.path.basename(file_path)
+    shard = get_shard_name(os.path.splitext(file_name)[0], layout)
+    return f"{s3_uri}/{shard}/{file_name}" if shard else f"{s3_uri}/{file_name}"
+
+
+
+def uploading_to_s3(output_dir, s3_uri, s3_bucket_name, aws_access_key_id, aws_secret_access_key, aws_region, failed_files_dir, num_workers=UPLOAD_WORKERS, manifest=None, executor=None, journal=None,
+                    reconcile=S3_RECONCILE):
     logging.info("Processing S3 upload...")
-    local_file_paths = [os.path.join(output_dir, pdf_file) for pdf_file in os.listdir(output_dir)]
+    local_file_paths = [path for path, _ in list_output_files(output_dir).values()]
+
+    if reconcile and local_file_paths:
+        # Only upload what is missing or different in S3
+        inventory = reconcile_s3(local_file_paths, s3_uri, s3_bucket_name, aws_access_key_id, aws_secret_access_key, aws_region, num_workers)
+        local_file_paths = inventory['new'] + inventory['changed']
+        already_uploaded = [os.path.splitext(os.path.basename(path))[0] for path in inventory['unchanged']]
+        if manifest is not None:
+            record_files_in_manifest(manifest, 'uploaded_hash', output_dir, already_uploaded)
+        if journal is not None:
+            journal.record('upload', already_uploaded)
+
+    if journal is not None:
+        # Uploaded before a crash
+        uploaded = {path for path in local_file_paths if journal.completed(os.path.splitext(os.path.basename(path))[0], 'upload')}
+        local_file_paths = [path for path in local_file_paths if path not in uploaded]
+        logging.info(f"Skipping {len(uploaded)} files uploaded before the restart")
+
+    if manifest is not None:
+        # Skip files whose current version is already uploaded
+        entries = manifest.get_entries()
+        up_to_date = set()
+        for local_pdf_path in local_file_paths:
+            entry = entries.get(os.path.splitext(os.path.basename(local_pdf_path))[0])
+            if entry and entry['compressed_hash'] and entry['uploaded_hash'] == entry['compressed_hash']:
+                up_to_date.add(local_pdf_path)
+        local_file_paths = [path for path in local_file_paths if path not in up_to_date]
+        logging.info(f"Skipping {len(up_to_date)} files already uploaded")
 
     success_count = 0
     failed_files = []
 
-    for local_pdf_path in local_file_paths:
-        s3_file_name = f"{s3_uri}/{os.path.basename(local_pdf_path)}"
-        success = upload_to_s3(local_pdf_path, s3_bucket_name, s3_file_name, aws_access_key_id, aws_secret_access_key, aws_region)
-        
+    def upload(local_pdf_path):
+        s3_file_name = get_s3_key(s3_uri, local_pdf_path)
+        return upload_to_s3(local_pdf_path, s3_bucket_name, s3_file_name, aws_access_key_id, aws_secret_access_key, aws_region)
+
+    # All workers share one client and connection pool. A caller running several jobs can pass one pool shared by all of them
+    if executor is not None:
+        results = list(executor.map(upload, local_file_paths))
+    else:
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            results = list(executor.map(upload, local_file_paths))
+
+    for local_pdf_path, success in zip(local_file_paths, results):
         if success:
             success_count += 1
         else:
             failed_files.append(local_pdf_path)
 
+    uploaded_files = [os.path.splitext(os.path.basename(path))[0] for path, success in zip(local_file_paths, results) if success]
+    if manifest is not None:
+        record_files_in_manifest(manifest, 'uploaded_hash', output_dir, uploaded_files)
+    if journal is not None:
+        journal.record('upload', uploaded_files)
+
     logging.info(f"--------------- {success_count} files uploaded successfully to S3 -----------------")
     
     if failed_files:
@@ -415,37 +3046,125 @@ def uploading_to_s3(output_dir, s3_uri, s3_bucket_name, aws_access_key_id, aws_s
 
 
 def get_count_of_files_in_bucket(aws_access_key_id=None, aws_secret_access_key=None, aws_region=None, s3_bucket_name=None, folder_name=None) :
-    s3 = boto3.client('s3', aws_access_key_id=aws_access_key_id, aws_secret_access_key=aws_secret_access_key, region_name=aws_region)
+    # The folder's keys start with "<folder_name>/", which is where the listing is cut into ranges
+    prefix = f"{folder_name.rstrip('/')}/" if folder_name else ''
+    file_count = len(list_s3_objects(s3_bucket_name, prefix, aws_access_key_id, aws_secret_access_key, aws_region))
 
+    print(f"Number of files in folder '{folder_name}': {file_count}")
+    return file_count
 
-    # Initialize variables
-    file_count = 0
-    continuation_token = None
 
-    # Paginate through the results to count the number of files
-    while True:
-        if continuation_token:
-            response = s3.list_objects_v2(
-                Bucket=s3_bucket_name,
-                Prefix=folder_name,
-                ContinuationToken=continuation_token
-            )
-        else:
-            response = s3.list_objects_v2(
-                Bucket=s3_bucket_name,
-                Prefix=folder_name
-            )
-        
-        # Count the number of files in the current response
-        file_count += len(response.get('Contents', []))
 
-        # Check if there are more results to paginate through
-        if response.get('NextContinuationToken'):
-            continuation_token = response['NextContinuationToken']
-        else:
-            break
+def list_s3_objects(s3_bucket_name, prefix, aws_access_key_id=None, aws_secret_access_key=None, aws_region=None, boundaries=None, num_workers=UPLOAD_WORKERS):
+    """
+    List the objects under prefix as {key: {'size': bytes, 'etag': ETag without quotes}}.
 
-    print(f"Number of files in folder '{folder_name}': {file_count}")
+    The key space is cut at the boundary keys into ranges that are listed in parallel. Without boundaries
+    it is cut on the first character after the prefix. Boundaries close to the real keys, like the names
+    of the local files, give ranges of even size.
+    """
+    s3 = get_s3_client(aws_access_key_id, aws_secret_access_key, aws_region)
+    if boundaries is None:
+        boundaries = [prefix + char for char in "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"]
+    boundaries = sorted(set(boundaries))
+    # Ranges (start, end]: the first starts at the beginning of the prefix, the last runs to its end
+    key_ranges = list(zip([None] + boundaries, boundaries + [None]))
+
+    def list_range(key_range):
+        start, end = key_range
+        objects = {}
+        kwargs = {'Bucket': s3_bucket_name, 'Prefix': prefix}
+        if start is not None:
+            kwargs['StartAfter'] = start
+        for page in s3.get_paginator('list_objects_v2').paginate(**kwargs):
+            for item in page.get('Contents', []):
+                # Keys come in UTF-8 byte order, which is the order Python compares strings in
+                if end is not None and item['Key'] > end:
+                    return objects
+                objects[item['Key']] = {'size': item['Size'], 'etag': item['ETag'].strip('"')}
+        return objects
+
+    start_time = time.perf_counter()
+    objects = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(num_workers, len(key_ranges)))) as executor:
+        for range_objects in executor.map(list_range, key_ranges):
+            objects.update(range_objects)
+    logging.info(f"Listed {len(objects)} objects under {s3_bucket_name}/{prefix} in {len(key_ranges)} ranges in {time.perf_counter() - start_time:.1f}s")
+    return objects
+
+
+
+def get_s3_etag(file_path, part_size=S3_MULTIPART_THRESHOLD):
+    # The ETag S3 gives the file when upload_file_to_s3 uploads it: the MD5 of a single PUT, or for
+    # a multipart upload the MD5 of the part MD5s followed by the number of parts
+    if os.path.getsize(file_path) < part_size:
+        digest = hashlib.md5()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    part_digests = []
+    with open(file_path, 'rb') as f:
+        for part in iter(lambda: f.read(part_size), b''):
+            part_digests.append(hashlib.md5(part).digest())
+    return f"{hashlib.md5(b''.join(part_digests)).hexdigest()}-{len(part_digests)}"
+
+
+
+def s3_object_matches(remote_object, file_path):
+    # True when the object listed in S3 has the same size and content as the local file
+    if remote_object['size'] != os.path.getsize(file_path):
+        return False
+    local_etag = get_s3_etag(file_path)
+    if remote_object['etag'] == local_etag:
+        return True
+    remote_parts = remote_object['etag'].partition('-')[2]
+    if remote_parts and remote_parts != local_etag.partition('-')[2]:
+        # Uploaded in parts of another size, so the ETags can't be compared; the sizes match
+        return True
+    return False
+
+
+
+def reconcile_s3(local_file_paths, s3_uri, s3_bucket_name, aws_access_key_id=None, aws_secret_access_key=None, aws_region=None, num_workers=UPLOAD_WORKERS):
+    """
+    Compare local files with the objects under s3_uri by key, size and ETag.
+
+    Returns a dict of:
+    - 'new': local files with no object in S3.
+    - 'changed': local files whose object differs in size or content.
+    - 'unchanged': local files already in S3 as they are.
+    - 'remote_only': keys of objects with no local file.
+    """
+    prefix = f"{s3_uri}/"
+    keys = sorted(get_s3_key(s3_uri, path) for path in local_file_paths)
+
+    # Cut the listing at evenly spaced local keys
+    partitions = min(len(keys), num_workers * 4)
+    boundaries = [keys[index * len(keys) // partitions] for index in range(1, partitions)]
+    remote_objects = list_s3_objects(s3_bucket_name, prefix, aws_access_key_id, aws_secret_access_key, aws_region, boundaries, num_workers)
+
+    def compare(local_path):
+        remote_object = remote_objects.get(get_s3_key(s3_uri, local_path))
+        if remote_object is None:
+            return 'new'
+        return 'unchanged' if s3_object_matches(remote_object, local_path) else 'changed'
+
+    inventory = {'new': [], 'changed': [], 'unchanged': [], 'remote_only': []}
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        for local_path, status in zip(local_file_paths, executor.map(compare, local_file_paths)):
+            inventory[status].append(local_path)
+
+    local_keys = set(keys)
+    # The folder marker written by create_s3_folder is not a file
+    inventory['remote_only'] = sorted(key for key in remote_objects if key not in local_keys and key != prefix)
+
+    logging.info(f"S3 reconciliation of {s3_bucket_name}/{prefix}: {len(inventory['new'])} new, {len(inventory['changed'])} changed, "
+                 f"{len(inventory['unchanged'])} unchanged, {len(inventory['remote_only'])} only in S3")
+    for key in inventory['remote_only']:
+        logging.warning(f"In S3 with no local file: {key}")
+    return inventory
 
 
 
@@ -455,8 +3174,8 @@ def create_s3_folder(bucket_name):
         today = datetime.today()
         folder_name = URI+"/"+today.strftime('%d%m')
         
-        # Create an S3 client
-        s3 = boto3.client('s3')
+        # Get the shared S3 client
+        s3 = get_s3_client()
         
         # Create a "folder" in S3 by creating a zero-byte object with a trailing slash
         folder_key = folder_name + '/'
@@ -480,73 +3199,359 @@ def create_s3_folder(bucket_name):
 
 
 
-def process_dataframe_in_batches(df, chunk_size, total_batches, batch, output_dir, state_template_dict, potential_column_names):
+def process_dataframe_in_batches(df, chunk_size, total_batches, batch, output_dir, state_template_dict, potential_column_names, render_processes=RENDER_PROCESSES, manifest=None, journal=None,
+                                in_memory=RENDER_IN_MEMORY):
 
-    for i in range(0, len(df), chunk_size):
-        df_chunk = df.iloc[i:i + chunk_size]
+    # With render_processes > 0 records are rendered in a pool of worker processes, otherwise one at a time
+    executor = ProcessPoolExecutor(max_workers=render_processes, initializer=reset_template_cache_stats) if render_processes > 0 else None
+    worker_cache_stats = {}
+
+    try:
+        for i in range(0, len(df), chunk_size):
+            df_chunk = df.iloc[i:i + chunk_size]
 
-        # Sort the chunk DataFrame by 'State'
-        df_chunk = df_chunk.sort_values(by='State')
+            # Sort the chunk DataFrame by 'State'
+            df_chunk = df_chunk.sort_values(by='State')
 
-        logging.info(f"------------ Processing batch {i//chunk_size + 1} / {total_batches}")
-        batch += 1
+            logging.info(f"------------ Processing batch {i//chunk_size + 1} / {total_batches}")
+            batch += 1
 
-        state_counts_chunk = df_chunk['State'].value_counts().to_dict()
-        logging.info(f"------------ States in batch {i//chunk_size + 1}:")
-        for state, count in sorted(state_counts_chunk.items(), key=lambda x: x[0]):
-            logging.info(f"{state}: {count}")
+            state_counts_chunk = df_chunk['State'].value_counts().to_dict()
+            logging.info(f"------------ States in batch {i//chunk_size + 1}:")
+            for state, count in sorted(state_counts_chunk.items(), key=lambda x: x[0]):
+                logging.info(f"{state}: {count}")
 
-        # Call process_record for each row in the chunk
-        for _, record in df_chunk.iterrows():
-            process_record(record, output_dir, state_template_dict, potential_column_names)
+            if manifest is not None:
+                record_rendered_in_manifest(manifest, df_chunk.to_dict('records'), state_template_dict, potential_column_names)
 
-        # Convert generated DOCX files to PDFs
-        terminate_word_instances()
-        generate_pdf_from_docx(output_dir)
+            # With in_memory the DOCX files of the batch are kept in memory until they are converted
+            documents = {} if in_memory else None
+            if executor:
+                results = render_records_in_processes(executor, df_chunk.to_dict('records'), output_dir, state_template_dict, potential_column_names, worker_cache_stats=worker_cache_stats,
+                                                      documents=documents)
+            else:
+                # Call process_record for each row in the chunk
+                results = [process_record(record, output_dir, state_template_dict, potential_column_names, documents) for _, record in df_chunk.iterrows()]
 
-        logging.info(f"End of batch {i//chunk_size + 1}")
-        logging.info("-------------------------------\n")
+            if journal is not None:
+                journal.record('render', [result[0] for result in results if result])
 
+            # Convert generated DOCX files to PDFs
+            converter = get_pdf_converter()
+            converter.reset()
+            if documents is not None:
+                generate_pdf_from_documents(documents, output_dir, converter, journal)
+            else:
+                generate_pdf_from_docx(output_dir, [result[0] for result in results if result], converter, journal)
 
+            if manifest is not None:
+                file_names = [get_record_file_name(record, potential_column_names) for record in df_chunk.to_dict('records')]
+                record_files_in_manifest(manifest, 'pdf_hash', output_dir, file_names)
 
-def compressing_pdf(output_dir, bat_file_path, compress_dir): 
-    logging.info(f"----------------------- Compressing pdf... -------------------------------\n")
+            log_template_cache_stats(worker_cache_stats)
+            logging.info(f"End of batch {i//chunk_size + 1}")
+            logging.info("-------------------------------\n")
+    finally:
+        if executor:
+            executor.shutdown()
 
-    # Save the current working directory
-    current_dir = os.getcwd()
+
+
+def compressing_pdf(output_dir, compress_dir, manifest=None, profile=COMPRESSION_PROFILE, num_workers=COMPRESS_WORKERS, executor=None, journal=None):
+    logging.info(f"----------------------- Compressing pdf... -------------------------------\n")
 
     try:
-        # Change directory to the output directory where the PDFs are generated
-        os.chdir(output_dir)
+        pdf_files = list_output_files(output_dir)
+
+        # Every file is compressed through its own temp files, so the pool can work on many at once
+        def compress(file_name):
+            try:
+                compressed_path = make_output_path(compress_dir, file_name)
+                result = compress_pdf_file(pdf_files[file_name][0], compressed_path, profile)
+                if not result['skipped']:
+                    place_output_file(compress_dir, compressed_path)
+                return result
+            except Exception as e:
+                logging.error(f"Error while compressing {file_name}.pdf: {e}")
+                metrics.observe('compress', 0, ok=False)
+                return None
+
+        # A caller running several jobs can pass one pool shared by all of them
+        if executor is not None:
+            results = list(executor.map(compress, pdf_files))
+        else:
+            with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                results = list(executor.map(compress, pdf_files))
 
-        subprocess.run(bat_file_path)
+        compressed = [result for result in results if result and not result['skipped']]
+        skipped = [result for result in results if result and result['skipped']]
+        bytes_in = sum(result['bytes_in'] for result in compressed)
+        bytes_out = sum(result['bytes_out'] for result in compressed)
+        seconds = sum(result['seconds'] for result in compressed)
 
         logging.info(f"--------------- All PDF compressed successfully... -----------------------\n")
-
-        pdf_files = [file for file in os.listdir(compress_dir) if file.endswith(".pdf")]
-        logging.info(f"Number of PDFs in COMPRESS directory: {len(pdf_files)}")
+        logging.info(f"Compressed {len(compressed)} PDFs with profile '{profile}', skipped {len(skipped)} up to date, {results.count(None)} failed")
+        if compressed:
+            saved_percent = 100 * (bytes_in - bytes_out) / bytes_in if bytes_in else 0
+            logging.info(f"Size {bytes_in / 1024 / 1024:.1f} MB -> {bytes_out / 1024 / 1024:.1f} MB ({saved_percent:.0f}% saved), {seconds / len(compressed):.2f}s per file")
+
+        compressed_files = [os.path.splitext(result['file'])[0] for result in results if result]
+        if manifest is not None:
+            record_files_in_manifest(manifest, 'compressed_hash', compress_dir, compressed_files)
+        if journal is not None:
+            journal.record('compress', compressed_files)
+
+        logging.info(f"Number of PDFs in COMPRESS directory: {len(scan_output_files(compress_dir))}")
     except Exception as e:
         logging.error(f"Error while compressing PDFs: {e}")
+
+
+
+def compress_pdf_file(input_pdf, output_pdf, profile=COMPRESSION_PROFILE):
+    """
+    Compress one PDF: qpdf uncompresses the streams, then Ghostscript rewrites the file with the profile's settings.
+
+    Parameters:
+    - input_pdf (str): The PDF to compress.
+    - output_pdf (str): The path of the compressed PDF. Skipped when it is already newer than input_pdf.
+    - profile (str, optional): Name of a profile in compression_profiles. Default is COMPRESSION_PROFILE.
+
+    Returns:
+    - dict: file, bytes_in, bytes_out, seconds and skipped.
+    """
+    file_name = os.path.basename(input_pdf)
+    bytes_in = os.path.getsize(input_pdf)
+
+    if os.path.exists(output_pdf) and os.path.getmtime(output_pdf) >= os.path.getmtime(input_pdf):
+        return {'file': file_name, 'bytes_in': bytes_in, 'bytes_out': os.path.getsize(output_pdf), 'seconds': 0, 'skipped': True}
+
+    start_time = time.perf_counter()
+    # The uncompressed copy goes to scratch space. The output is written next to output_pdf, so it can be renamed
+    # into place, with a suffix the output index and reconcile scans don't take for a PDF.
+    fd, uncompressed_pdf = tempfile.mkstemp(suffix=".pdf", dir=SCRATCH_DIR)
+    os.close(fd)
+    fd, temp_output_pdf = tempfile.mkstemp(suffix=".pdf.tmp", dir=os.path.dirname(output_pdf) or None)
+    os.close(fd)
+
+    try:
+        subprocess.run([QPDF_PATH, "--stream-data=uncompress", input_pdf, uncompressed_pdf], check=True, capture_output=True)
+        subprocess.run([GHOSTSCRIPT_PATH, "-dSAFER", "-dQUIET", "-dNOPAUSE", "-dBATCH", "-sDEVICE=pdfwrite", "-dCompatibilityLevel=1.4"]
+                       + compression_profiles[profile] + [f"-sOutputFile={temp_output_pdf}", uncompressed_pdf], check=True, capture_output=True)
+
+        # Only a finished file gets the final name, so a half-written one is never taken as up to date
+        os.replace(temp_output_pdf, output_pdf)
     finally:
-        # Change back to the original directory
-        os.chdir(current_dir)
+        for temp_pdf in (uncompressed_pdf, temp_output_pdf):
+            if os.path.exists(temp_pdf):
+                os.remove(temp_pdf)
+
+    bytes_out = os.path.getsize(output_pdf)
+    seconds = time.perf_counter() - start_time
+    log_event('compress', 'compressed', file=file_name, bytes_in=bytes_in, bytes_out=bytes_out, seconds=round(seconds, 3))
+    metrics.observe('compress', seconds, bytes_in=bytes_in, bytes_out=bytes_out)
+    return {'file': file_name, 'bytes_in': bytes_in, 'bytes_out': bytes_out, 'seconds': seconds, 'skipped': False}
+
 
 
+PIPELINE_STOP = object()
+
+
+def pipeline_stage_worker(stage_name, func, input_queue, output_queue, stage_stats, stats_lock):
+    while True:
+        item = input_queue.get()
+        if item is PIPELINE_STOP:
+            break
+
+        metrics.observe_queue(stage_name, input_queue.qsize())
 
-async def delete_directory(directory_path, max_retries=3, retry_delay=10):
-    for _ in range(max_retries):
         try:
-            # Attempt to remove the directory and its contents
-            shutil.rmtree(directory_path)
-            logging.info(f"Directory '{directory_path}' successfully deleted.")
-            return  # Exit the function if deletion is successful
-        except OSError as e:
-            # Handle any errors that may occur during the deletion
-            logging.error(f"Error: {e}")
-            logging.error("Failed to delete directory. Retrying...")
-            traceback.print_exc()  # Print detailed error information
-            await asyncio.sleep(retry_delay)
-    logging.error("Failed to delete directory after multiple attempts.")
+            result = func(item)
+        except Exception as e:
+            logging.error(f"Pipeline stage '{stage_name}' failed: {e}")
+            result = None
+
+        with stats_lock:
+            stage_stats['done' if result is not None else 'failed'] += 1
+
+        # Blocks while the next stage is busy, which keeps every queue bounded
+        if result is not None and output_queue is not None:
+            output_queue.put(result)
+
+
+
+def run_pipeline_stages(items, stages, queue_size=PIPELINE_QUEUE_SIZE):
+    """
+    Stream items through a chain of stages connected by bounded queues.
+
+    Parameters:
+    - items (iterable): Inputs for the first stage.
+    - stages (list): (name, func, num_workers) tuples. Each func takes the previous stage's result
+      and returns the input for the next stage, or None if the item failed.
+    - queue_size (int, optional): Maximum number of items waiting in front of each stage.
+
+    Returns:
+    - dict: Per stage counts of done and failed items.
+    """
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    stats = {name: {'done': 0, 'failed': 0} for name, _, _ in stages}
+    stats_lock = threading.Lock()
+
+    stage_threads = []
+    for index, (name, func, num_workers) in enumerate(stages):
+        output_queue = queues[index + 1] if index + 1 < len(stages) else None
+        threads = [threading.Thread(target=pipeline_stage_worker, args=(name, func, queues[index], output_queue, stats[name], stats_lock), daemon=True)
+                   for _ in range(max(1, num_workers))]
+        for thread in threads:
+            thread.start()
+        stage_threads.append(threads)
+
+    for item in items:
+        queues[0].put(item)
+
+    # Shut the stages down in order, each one after the stage feeding it has drained
+    for index, threads in enumerate(stage_threads):
+        for _ in threads:
+            queues[index].put(PIPELINE_STOP)
+        for thread in threads:
+            thread.join()
+
+    for name, stage_stats in stats.items():
+        logging.info(f"Pipeline stage '{name}': {stage_stats['done']} done, {stage_stats['failed']} failed")
+
+    return stats
+
+
+
+def run_streaming_pipeline(records, output_dir, compress_dir, state_template_dict, potential_column_names, s3_uri=None, failed_files_dir=None,
+                           render_workers=RENDER_WORKERS, convert_workers=CONVERT_WORKERS, compress_workers=COMPRESS_WORKERS, upload_workers=UPLOAD_WORKERS,
+                           queue_size=PIPELINE_QUEUE_SIZE, manifest=None, journal=None, reconcile=S3_RECONCILE, in_memory=RENDER_IN_MEMORY):
+    # Render -> convert -> compress -> upload, with every document moving on as soon as its previous stage is done.
+    # Uploading is skipped when s3_uri is None. With a resumed journal, each stage skips the work already done.
+    # With in_memory, render hands each DOCX to convert as (file name, bytes) instead of a file in output_dir.
+    converter = get_pdf_converter()
+    if isinstance(converter, WordConverter) and convert_workers > 1:
+        # Word converts one document at a time, on its own COM thread; more convert threads would only wait on it
+        convert_workers = 1
+    # With reconcile, files already in S3 as they are are not uploaded again
+    remote_objects = list_s3_objects(S3_BUCKET_NAME, f"{s3_uri}/", AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_REGION) if s3_uri and reconcile else {}
+
+    def resume_stage(file_name):
+        return journal.get_resume_stage(file_name, output_dir, compress_dir) if journal is not None else None
+
+    def record_in_journal(stage, path):
+        if journal is not None:
+            journal.record(stage, [os.path.splitext(os.path.basename(path))[0]])
+
+    def record_in_manifest(column, pdf_path):
+        if manifest is not None:
+            manifest.record_stage(column, [(os.path.splitext(os.path.basename(pdf_path))[0], hash_file(pdf_path))])
+
+    def render(record):
+        stage = resume_stage(get_record_file_name(record, potential_column_names))
+        if stage is not None:
+            # Rendered before the crash, carry on from the next stage
+            file_name = get_record_file_name(record, potential_column_names)
+            return os.path.join(output_dir, f"{file_name}.docx") if stage == 'render' else get_output_path(output_dir, file_name)
+
+        if manifest is not None:
+            manifest.record_rendered([get_record_hashes(record, state_template_dict, potential_column_names)])
+
+        documents = {} if in_memory else None
+        file_name, _ = process_record(record, output_dir, state_template_dict, potential_column_names, documents) or (None, None)
+        if file_name is None:
+            return None
+
+        if documents:
+            record_in_journal('render', file_name)
+            return file_name, documents[file_name]
+
+        # Direct-to-PDF templates produce the PDF straight away
+        docx_path = os.path.join(output_dir, f"{file_name}.docx")
+        output_path = docx_path if os.path.exists(docx_path) else get_output_path(output_dir, file_name)
+        record_in_journal('render', output_path)
+        return output_path
+
+    def convert_to_pdf(docx_path):
+        if isinstance(docx_path, tuple):
+            file_name, data = docx_path
+            failures = convert_docx_documents(converter, {file_name: data}, output_dir)
+            if failures:
+                logging.error(f"Failed to convert {file_name}.docx: {failures[file_name]}")
+                return None
+
+            pdf_path = get_output_path(output_dir, file_name)
+            record_in_manifest('pdf_hash', pdf_path)
+            record_in_journal('convert', pdf_path)
+            return pdf_path
+
+        if docx_path.endswith('.pdf'):
+            if os.path.exists(docx_path) and resume_stage(os.path.splitext(os.path.basename(docx_path))[0]) != 'convert':
+                # Rendered straight to PDF in this run
+                record_in_manifest('pdf_hash', docx_path)
+                record_in_journal('convert', docx_path)
+            return docx_path
+
+        failures = convert_docx_files(converter, [docx_path], output_dir)
+        os.remove(docx_path)
+        if failures:
+            logging.error(f"Failed to convert {docx_path}: {failures[docx_path]}")
+            return None
+
+        pdf_path = get_output_path(output_dir, os.path.splitext(os.path.basename(docx_path))[0])
+        record_in_manifest('pdf_hash', pdf_path)
+        record_in_journal('convert', pdf_path)
+        return pdf_path
+
+    def compress(pdf_path):
+        file_name = os.path.splitext(os.path.basename(pdf_path))[0]
+        if resume_stage(file_name) in ('compress', 'upload'):
+            return get_output_path(compress_dir, file_name)
+
+        compressed_path = make_output_path(compress_dir, file_name)
+        compress_pdf_file(pdf_path, compressed_path)
+        place_output_file(compress_dir, compressed_path)
+        record_in_manifest('compressed_hash', compressed_path)
+        record_in_journal('compress', compressed_path)
+        return compressed_path
+
+    def upload(pdf_path):
+        if journal is not None and journal.completed(os.path.splitext(os.path.basename(pdf_path))[0], 'upload'):
+            return pdf_path
+
+        s3_file_name = get_s3_key(s3_uri, pdf_path)
+        remote_object = remote_objects.get(s3_file_name)
+        if remote_object is not None and s3_object_matches(remote_object, pdf_path):
+            record_in_manifest('uploaded_hash', pdf_path)
+            record_in_journal('upload', pdf_path)
+            return pdf_path
+        if upload_to_s3(pdf_path, S3_BUCKET_NAME, s3_file_name, AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_REGION):
+            record_in_manifest('uploaded_hash', pdf_path)
+            record_in_journal('upload', pdf_path)
+            return pdf_path
+        if failed_files_dir:
+            shutil.copy(pdf_path, os.path.join(failed_files_dir, os.path.basename(pdf_path)))
+        return None
+
+    stages = [
+        ('render', render, render_workers),
+        ('convert', convert_to_pdf, convert_workers),
+        ('compress', compress, compress_workers),
+    ]
+    if s3_uri:
+        stages.append(('upload', upload, upload_workers))
+
+    return run_pipeline_stages(records, stages, queue_size)
+
+
+
+def delete_directory(directory_path):
+    # The converter is closed and the output indexes are closed here, so nothing of ours holds a file in the folder
+    close_output_indexes(directory_path)
+    try:
+        shutil.rmtree(directory_path)
+        logging.info(f"Directory '{directory_path}' successfully deleted.")
+    except OSError as e:
+        logging.error(f"Failed to delete directory '{directory_path}': {e}")
 
 
 
@@ -574,7 +3579,538 @@ def log_state_counts(state_counts_total):
     logging.info("\n")
 
 
-async def main():
+job_stages = ("render", "check", "compress", "merge", "upload")
+
+
+
+def load_job_spec(spec_path):
+    """
+    Read a JSON job spec and fill in the defaults. Relative paths are resolved against the spec's folder.
+
+    {
+        "max_concurrent_jobs": 2,
+        "compress_workers": 8,
+        "upload_workers": 32,
+        "jobs": [
+            {
+                "name": "client_a",
+                "input": "client_a/lang_data.xlsx",
+                "template_dir": "client_a/lang",
+                "templates": {"GOA": "client_a/lang/goa_template.docx"},
+                "stages": ["render", "check", "compress", "upload"],
+                "s3_prefix": "client_a/1810",
+                "render_processes": 4
+            }
+        ]
+    }
+    """
+    with open(spec_path, encoding='utf-8') as f:
+        spec = json.load(f)
+
+    spec_dir = os.path.dirname(os.path.abspath(spec_path))
+
+    jobs = spec.get('jobs') or []
+    if not jobs:
+        raise ValueError(f"No jobs in {spec_path}")
+
+    names = set()
+    for job in jobs:
+        prepare_job(job, spec_dir)
+        if job['name'] in names:
+            raise ValueError(f"Duplicate job name: {job['name']}")
+        names.add(job['name'])
+
+    spec['jobs'] = jobs
+    return spec
+
+
+
+def prepare_job(job, spec_dir):
+    # Check a job dict and fill in its defaults in place, resolving relative paths against spec_dir
+    def resolve(path):
+        return path if path is None or os.path.isabs(path) else os.path.join(spec_dir, path)
+
+    if not job.get('name') or not job.get('input'):
+        raise ValueError(f"Every job needs a name and an input: {job}")
+
+    unknown_stages = set(job.setdefault('stages', ["render", "check", "compress", "upload"])) - set(job_stages)
+    if unknown_stages:
+        raise ValueError(f"Unknown stages in job {job['name']}: {', '.join(sorted(unknown_stages))}")
+
+    job['input'] = resolve(job['input'])
+    job['work_dir'] = resolve(job.get('work_dir') or os.path.join('jobs', job['name']))
+    job['template_dir'] = resolve(job.get('template_dir'))
+    job['templates'] = {state.upper(): resolve(path) for state, path in (job.get('templates') or {}).items()}
+    job.setdefault('potential_column_names', ['Filename', 'Prospect_no', 'LAN_Details', 'CUID_NO'])
+    return job
+
+
+
+def run_job(job, compress_executor=None, upload_executor=None, resume=False):
+    """
+    Run one job from a job spec without prompts. Everything the job writes goes to its own work_dir:
+    OUTPUT, COMPRESS, UPLOAD_FAIL_FILES, merged PDFs, retry sheets and the manifest.
+
+    Returns a summary dict with the job's name, status, record counts and run time.
+    """
+    start_time = time.perf_counter()
+    name = job['name']
+    work_dir = job['work_dir']
+    stages = job['stages']
+    potential_column_names = job['potential_column_names']
+
+    output_dir = os.path.join(work_dir, "OUTPUT")
+    compress_dir = os.path.join(work_dir, "COMPRESS")
+    failed_files_dir = os.path.join(work_dir, "UPLOAD_FAIL_FILES")
+    for directory in (output_dir, compress_dir, failed_files_dir):
+        os.makedirs(directory, exist_ok=True)
+
+    # Each job gets its own template mapping
+    template_dict = dict.fromkeys(state_template_dict)
+    load_state_templates(template_dict, job['template_dir'])
+    template_dict.update(job['templates'])
+    if OVERLAY_TEMPLATES:
+        prepare_overlay_templates(template_dict)
+
+    manifest = Manifest(os.path.join(work_dir, "manifest.sqlite")) if job.get('incremental', INCREMENTAL) else None
+    journal = Journal(os.path.join(work_dir, "journal.jsonl"), resume=resume)
+    summary = {'name': name, 'status': 'ok', 'records': 0, 'failed_records': 0}
+
+    try:
+        df = load_lang_data(job['input'])
+        df = dedup_records(df, potential_column_names, policy=job.get('dedup_policy', DEDUP_POLICY), report_path=os.path.join(work_dir, "duplicate_records.xlsx"))
+        if manifest is not None:
+            df = get_pending_records(df, manifest, template_dict, potential_column_names)
+        if resume:
+            df = journal.get_records_to_render(df, potential_column_names, output_dir, compress_dir)
+        summary['records'] = len(df)
+        logging.info(f"[{name}] Starting job: {len(df)} records, stages {', '.join(stages)}")
+
+        if "render" in stages:
+            if resume:
+                generate_pdf_from_docx(output_dir, journal.get_files_to_convert(output_dir, compress_dir), journal=journal)
+            chunk_size = job.get('chunk_size', 500)
+            total_batches = (len(df) + chunk_size - 1) // chunk_size
+            process_dataframe_in_batches(df, chunk_size, total_batches, 0, output_dir, template_dict, potential_column_names,
+                                         render_processes=job.get('render_processes', RENDER_PROCESSES), manifest=manifest, journal=journal,
+                                         in_memory=job.get('render_in_memory', RENDER_IN_MEMORY))
+
+        if "check" in stages:
+            missing_pdfs_list = check_missing_pdfs(None, output_dir, potential_column_names, manifest, template_dict,
+                                                   retry_sheet_path=os.path.join(work_dir, "missing_files.xlsx"), data_path=job['input'], journal=journal, compress_dir=compress_dir)
+            if missing_pdfs_list:
+                failures = process_missing_pdfs(None, output_dir, missing_pdfs_list, template_dict, manifest, potential_column_names,
+                                                report_path=os.path.join(work_dir, "failed_records.xlsx"), data_path=job['input'], journal=journal,
+                                                in_memory=job.get('render_in_memory', RENDER_IN_MEMORY))
+                summary['failed_records'] = len(failures)
+
+        if "compress" in stages:
+            compressing_pdf(output_dir, compress_dir, manifest, profile=job.get('compression_profile', COMPRESSION_PROFILE), executor=compress_executor, journal=journal)
+
+        if "merge" in stages:
+            merge_pdfs_by_srno(compress_dir, work_dir, job['input'], potential_column_names, batch_size=job.get('merge_batch_size', 2000))
+
+        if "upload" in stages:
+            s3_bucket_name = job.get('s3_bucket') or S3_BUCKET_NAME
+            s3_uri = job.get('s3_prefix') or journal.run_info.get('s3_uri') or create_s3_folder(s3_bucket_name)
+            journal.start_run({'s3_uri': s3_uri})
+            uploading_to_s3(compress_dir, s3_uri, s3_bucket_name, AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_REGION, failed_files_dir,
+                            manifest=manifest, executor=upload_executor, journal=journal, reconcile=job.get('s3_reconcile', S3_RECONCILE))
+    except Exception as e:
+        summary['status'] = 'failed'
+        summary['error'] = str(e)
+        logging.error(f"[{name}] Job failed: {e}")
+        traceback.print_exc()
+    finally:
+        if manifest is not None:
+            manifest.close()
+        journal.close()
+
+    summary['seconds'] = round(time.perf_counter() - start_time, 1)
+    logging.info(f"[{name}] Job {summary['status']} in {summary['seconds']}s")
+    return summary
+
+
+
+def run_jobs(spec_path, resume=False):
+    """
+    Run all jobs of a job spec, several at a time. The jobs share the PDF converter,
+    one compression pool and one upload pool, so the machine stays busy across jobs.
+    """
+    spec = load_job_spec(spec_path)
+    max_concurrent_jobs = spec.get('max_concurrent_jobs', 2)
+
+    converter = get_pdf_converter(spec.get('converter'), spec.get('converter_workers'))
+    if isinstance(converter, WordConverter) and max_concurrent_jobs > 1:
+        # Word is reset between batches, which would kill the conversions of the other jobs
+        logging.warning("The Word converter cannot be shared between jobs. Running one job at a time.")
+        max_concurrent_jobs = 1
+
+    compress_executor = ThreadPoolExecutor(max_workers=spec.get('compress_workers', COMPRESS_WORKERS))
+    upload_executor = ThreadPoolExecutor(max_workers=spec.get('upload_workers', UPLOAD_WORKERS))
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_concurrent_jobs) as executor:
+            summaries = list(executor.map(lambda job: run_job(job, compress_executor, upload_executor, resume), spec['jobs']))
+    finally:
+        compress_executor.shutdown()
+        upload_executor.shutdown()
+        close_pdf_converter()
+
+    for summary in summaries:
+        logging.info(f"Job {summary['name']}: {summary['status']}, {summary['records']} records, {summary['failed_records']} failed, {summary['seconds']}s")
+    metrics.write_report(METRICS_DIR or os.path.dirname(os.path.abspath(spec_path)))
+    return summaries
+
+
+
+class ShardQueue(ABC):
+    # Base class for the work queue between the shard coordinator and its workers.
+    # A shard is a job dict for run_job(); claim() hands each shard to one worker at a time.
+    name = None
+
+    @abstractmethod
+    def put(self, shards):
+        # shards: (shard_id, job) pairs. Shards already in the queue are left as they are.
+        pass
+
+    @abstractmethod
+    def claim(self, worker_id):
+        # Returns (shard_id, job, attempt) for the next shard to run, or None when none is free
+        pass
+
+    def renew(self, shard_id, worker_id):
+        # Called while a shard runs, so the shard is not handed to another worker
+        pass
+
+    @abstractmethod
+    def complete(self, shard_id, worker_id, summary):
+        pass
+
+    @abstractmethod
+    def counts(self):
+        # {status: number of shards} for the statuses pending, running, done and failed
+        pass
+
+    @abstractmethod
+    def get_shards(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SQLiteShardQueue(ShardQueue):
+    # Shard table in a SQLite file on a folder shared by the coordinator and all worker nodes.
+    # A claimed shard is leased to its worker; when the worker stops renewing the lease
+    # (crash, lost node), the shard is handed to another worker, which resumes it from its journal.
+    name = "sqlite"
+
+    def __init__(self, path, lease_seconds=SHARD_LEASE_SECONDS, max_attempts=SHARD_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        connection = self._connect()
+        try:
+            connection.execute("""CREATE TABLE IF NOT EXISTS shards (
+                                      shard_id TEXT PRIMARY KEY,
+                                      job TEXT,
+                                      status TEXT,
+                                      worker TEXT,
+                                      attempts INTEGER DEFAULT 0,
+                                      lease_until REAL,
+                                      summary TEXT,
+                                      updated_at TEXT)""")
+        finally:
+            connection.close()
+
+    def _connect(self):
+        # A connection per call: the other side of every call is another process, often on another node
+        return sqlite3.connect(self.path, timeout=60, isolation_level=None)
+
+    def put(self, shards):
+        now = datetime.now().isoformat()
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.executemany("INSERT OR IGNORE INTO shards (shard_id, job, status, updated_at) VALUES (?, ?, 'pending', ?)",
+                                   [(shard_id, json.dumps(job), now) for shard_id, job in shards])
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+
+    def claim(self, worker_id):
+        now = time.time()
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            # Shards whose lease ran out too often are given up
+            connection.execute("""UPDATE shards SET status = 'failed', summary = ?, updated_at = ?
+                                  WHERE status = 'running' AND lease_until < ? AND attempts >= ?""",
+                               (json.dumps({'status': 'failed', 'error': 'lease expired'}), datetime.now().isoformat(), now, self.max_attempts))
+            row = connection.execute("""SELECT shard_id, job, attempts FROM shards
+                                        WHERE status = 'pending' OR (status = 'running' AND lease_until < ?)
+                                        ORDER BY rowid LIMIT 1""", (now,)).fetchone()
+            if row is not None:
+                connection.execute("UPDATE shards SET status = 'running', worker = ?, attempts = attempts + 1, lease_until = ?, updated_at = ? WHERE shard_id = ?",
+                                   (worker_id, now + self.lease_seconds, datetime.now().isoformat(), row[0]))
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+
+        if row is None:
+            return None
+        return row[0], json.loads(row[1]), row[2] + 1
+
+    def renew(self, shard_id, worker_id):
+        connection = self._connect()
+        try:
+            connection.execute("UPDATE shards SET lease_until = ? WHERE shard_id = ? AND worker = ? AND status = 'running'",
+                               (time.time() + self.lease_seconds, shard_id, worker_id))
+        finally:
+            connection.close()
+
+    def complete(self, shard_id, worker_id, summary):
+        # A failed shard goes back to the queue until it used up its attempts
+        connection = self._connect()
+        try:
+            connection.execute("""UPDATE shards SET status = CASE WHEN ? = 'ok' THEN 'done' WHEN attempts < ? THEN 'pending' ELSE 'failed' END,
+                                  summary = ?, lease_until = NULL, updated_at = ?
+                                  WHERE shard_id = ? AND worker = ? AND status = 'running'""",
+                               (summary['status'], self.max_attempts, json.dumps(summary), datetime.now().isoformat(), shard_id, worker_id))
+        finally:
+            connection.close()
+
+    def counts(self):
+        connection = self._connect()
+        try:
+            return dict(connection.execute("SELECT status, COUNT(*) FROM shards GROUP BY status").fetchall())
+        finally:
+            connection.close()
+
+    def get_shards(self):
+        connection = self._connect()
+        try:
+            rows = connection.execute("SELECT shard_id, job, status, worker, attempts, summary FROM shards ORDER BY rowid").fetchall()
+        finally:
+            connection.close()
+        return [{'shard_id': shard_id, 'job': json.loads(job), 'status': status, 'worker': worker, 'attempts': attempts,
+                 'summary': json.loads(summary) if summary else None} for shard_id, job, status, worker, attempts, summary in rows]
+
+
+
+def get_shard_queue(location):
+    # The queue backend is picked from its location; other backends (Redis, SQS, ...) subclass ShardQueue
+    if location.lower().endswith(('.sqlite', '.db')):
+        return SQLiteShardQueue(location)
+    raise ValueError(f"Unknown shard queue: {location}")
+
+
+
+def load_shard_spec(spec_path):
+    """
+    Read a JSON shard spec: one job as in a job spec, plus how to split its input into shards.
+    Relative paths are resolved against the spec's folder.
+
+    {
+        "name": "march",
+        "input": "lang/lang_data.xlsx",
+        "template_dir": "lang",
+        "stages": ["render", "check", "compress", "merge", "upload"],
+        "shard_by": "srno",
+        "shard_size": 20000,
+        "queue": "runs/march/shards.sqlite",
+        "local_workers": 2
+    }
+    """
+    with open(spec_path, encoding='utf-8') as f:
+        spec = json.load(f)
+
+    spec_dir = os.path.dirname(os.path.abspath(spec_path))
+    prepare_job(spec, spec_dir)
+
+    if spec.setdefault('shard_by', 'srno') not in ('srno', 'state'):
+        raise ValueError(f"Unknown shard_by: {spec['shard_by']}. Use 'srno' or 'state'.")
+    spec.setdefault('shard_size', 10000)
+    spec.setdefault('local_workers', 0)
+    queue_location = spec.get('queue') or os.path.join(spec['work_dir'], "shards.sqlite")
+    spec['queue'] = queue_location if os.path.isabs(queue_location) else os.path.join(spec_dir, queue_location)
+    return spec
+
+
+
+def split_into_shards(df, shard_by='srno', shard_size=10000):
+    """
+    Split the records into shards of at most shard_size records.
+
+    - 'srno': consecutive SrNo ranges, named after their first and last SrNo.
+    - 'state': one or more shards per state, so each shard needs the templates of one state only.
+
+    Returns a list of (shard_id, DataFrame).
+    """
+    shards = []
+    if shard_by == 'srno':
+        sorted_df = df.iloc[pd.to_numeric(df['SrNo'], errors='coerce').argsort(kind='stable')]
+        for start in range(0, len(sorted_df), shard_size):
+            shard_df = sorted_df.iloc[start:start + shard_size]
+            shards.append((f"srno-{shard_df['SrNo'].iloc[0]}-{shard_df['SrNo'].iloc[-1]}", shard_df))
+    elif shard_by == 'state':
+        for state, state_df in df.groupby(df['State'].astype(str).str.strip().str.upper(), sort=True):
+            state_name = "".join(char if char.isalnum() else "_" for char in state)
+            for index, start in enumerate(range(0, len(state_df), shard_size)):
+                shards.append((f"state-{state_name}-{index}", state_df.iloc[start:start + shard_size]))
+    else:
+        raise ValueError(f"Unknown shard_by: {shard_by}")
+    return shards
+
+
+
+def create_shards(spec):
+    # Write each shard's records next to its work folder and build the job the workers run for it
+    df = load_lang_data(spec['input'])
+    # Before splitting, so no two shards render the same file
+    df = dedup_records(df, spec['potential_column_names'], policy=spec.get('dedup_policy', DEDUP_POLICY),
+                       report_path=os.path.join(spec['work_dir'], "duplicate_records.xlsx"))
+    shards_dir = os.path.join(spec['work_dir'], "shards")
+    os.makedirs(shards_dir, exist_ok=True)
+
+    job = {key: value for key, value in spec.items() if key not in ('shard_by', 'shard_size', 'queue', 'local_workers')}
+    # Merging runs once across all shards, in the coordinator
+    job['stages'] = [stage for stage in spec['stages'] if stage != "merge"]
+    if "upload" in job['stages'] and not job.get('s3_prefix'):
+        # One S3 folder for the whole run
+        job['s3_prefix'] = create_s3_folder(job.get('s3_bucket') or S3_BUCKET_NAME)
+
+    shards = []
+    for shard_id, shard_df in split_into_shards(df, spec['shard_by'], spec['shard_size']):
+        shard_dir = os.path.join(shards_dir, shard_id)
+        os.makedirs(shard_dir, exist_ok=True)
+        shard_job = dict(job, name=shard_id, work_dir=shard_dir, input=write_data_frame(shard_df, os.path.join(shard_dir, "data")))
+        shards.append((shard_id, shard_job))
+    logging.info(f"Split {len(df)} records into {len(shards)} shards by {spec['shard_by']}")
+    return shards
+
+
+
+def run_shard_worker(queue_location, worker_id=None, poll_interval=5):
+    """
+    Take shards from the queue and run them with run_job() until no shard is pending or running.
+    Any number of workers on any number of nodes can share a queue, as long as they see the
+    shared folder under the same path. A shard taken over from a lost worker is resumed from its journal.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    shard_queue = get_shard_queue(queue_location)
+    completed = 0
+
+    try:
+        while True:
+            claimed = shard_queue.claim(worker_id)
+            if claimed is None:
+                counts = shard_queue.counts()
+                if not counts.get('pending') and not counts.get('running'):
+                    break
+                # The lease of a running shard may still run out
+                time.sleep(poll_interval)
+                continue
+
+            shard_id, job, attempt = claimed
+            logging.info(f"Worker {worker_id} took shard {shard_id} (attempt {attempt})")
+
+            stop_renewing = threading.Event()
+
+            def renew_lease():
+                while not stop_renewing.wait(shard_queue.lease_seconds / 3):
+                    shard_queue.renew(shard_id, worker_id)
+
+            renewer = threading.Thread(target=renew_lease, daemon=True)
+            renewer.start()
+            try:
+                summary = run_job(job, resume=attempt > 1)
+            finally:
+                stop_renewing.set()
+                renewer.join()
+
+            metrics.write_report(job['work_dir'])
+            metrics.reset()
+            shard_queue.complete(shard_id, worker_id, summary)
+            completed += 1
+    finally:
+        close_pdf_converter()
+        shard_queue.close()
+
+    logging.info(f"Worker {worker_id} finished after {completed} shards")
+    return completed
+
+
+
+def run_coordinator(spec_path, num_workers=None, poll_interval=5):
+    """
+    Run one job split into shards. The coordinator queues the shards, optionally starts local workers
+    (more can be started on other nodes with `--worker QUEUE`), waits until every shard is done or failed,
+    then merges the shard manifests and, with the merge stage, the PDFs of all shards by SrNo.
+
+    Running it again with the same queue continues the run instead of splitting the input again.
+    Returns the list of shards with their status and job summary.
+    """
+    spec = load_shard_spec(spec_path)
+    work_dir = spec['work_dir']
+    os.makedirs(work_dir, exist_ok=True)
+    shard_queue = get_shard_queue(spec['queue'])
+
+    if shard_queue.counts():
+        logging.info(f"Continuing the shards already in {spec['queue']}")
+    else:
+        shard_queue.put(create_shards(spec))
+
+    num_workers = spec['local_workers'] if num_workers is None else num_workers
+    workers = [subprocess.Popen([sys.executable, os.path.abspath(__file__), '--worker', spec['queue']]) for _ in range(num_workers)]
+    logging.info(f"Started {len(workers)} local workers. More nodes can join with: python final.py --worker {spec['queue']}")
+
+    last_counts = None
+    warned = False
+    while True:
+        counts = shard_queue.counts()
+        if counts != last_counts:
+            logging.info("Shards: " + ", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
+            last_counts = counts
+        if not counts.get('pending') and not counts.get('running'):
+            break
+        if workers and not warned and all(worker.poll() is not None for worker in workers):
+            logging.warning("All local workers exited with shards left. Waiting for workers on other nodes.")
+            warned = True
+        time.sleep(poll_interval)
+
+    for worker in workers:
+        worker.wait()
+
+    shards = shard_queue.get_shards()
+    shard_queue.close()
+    for shard in shards:
+        if shard['status'] != 'done':
+            logging.error(f"Shard {shard['shard_id']} failed after {shard['attempts']} attempts: {(shard['summary'] or {}).get('error')}")
+
+    if spec.get('incremental', INCREMENTAL):
+        manifest = Manifest(os.path.join(work_dir, "manifest.sqlite"))
+        try:
+            for shard in shards:
+                shard_manifest_path = os.path.join(shard['job']['work_dir'], "manifest.sqlite")
+                if os.path.exists(shard_manifest_path):
+                    manifest.merge_from(shard_manifest_path)
+        finally:
+            manifest.close()
+
+    if "merge" in spec['stages']:
+        compress_dirs = [os.path.join(shard['job']['work_dir'], "COMPRESS") for shard in shards]
+        merge_pdfs_by_srno(compress_dirs, work_dir, spec['input'], spec['potential_column_names'], batch_size=spec.get('merge_batch_size', 2000))
+
+    done = sum(shard['status'] == 'done' for shard in shards)
+    logging.info(f"Sharded run {spec['name']}: {done} of {len(shards)} shards done")
+    metrics.write_report(METRICS_DIR or work_dir)
+    return shards
+
+
+
+async def main(resume=False):
 
     base_dir = os.path.dirname(os.path.abspath(__file__))
     os.chdir(base_dir)
@@ -590,50 +4126,41 @@ async def main():
 
     potential_column_names=  ['Filename', 'Prospect_no', 'LAN_Details', 'CUID_NO']
     lang_folder = os.path.join(base_dir, "lang")
-    excel_path = os.path.join(lang_folder, "lang_data.xlsx")
-    df = pd.read_excel(excel_path, sheet_name="Sheet1")
+    retry_sheet_path = os.path.join(base_dir, "missing_files.xlsx")
+    failed_records_path = os.path.join(base_dir, "failed_records.xlsx")
+    excel_path = get_lang_data_path(lang_folder)
+    df = load_lang_data(excel_path)
+    # Records sharing a file name would be rendered, converted and uploaded once per copy
+    try:
+        df = dedup_records(df, potential_column_names, report_path=os.path.join(base_dir, "duplicate_records.xlsx"))
+    except ValueError as e:
+        logging.error(f"Stopping: {e}")
+        return
     total_records = len(df)
     chunk_size = 500
     total_batches = (total_records + chunk_size - 1) // chunk_size
     batch = 0
-    excel_path = os.path.join(lang_folder, "lang_data.xlsx")
-    df = pd.read_excel(excel_path, sheet_name="Sheet1")
-    bat_file_path = os.path.join(base_dir, "compress.bat") 
-
 
-    check_and_update_template("BIHAR", ['hindi_template.docx']) 
-    check_and_update_template("DELHI", ['hindi_template.docx'])
-    check_and_update_template("HARYANA", ['hindi_template.docx'])
-    check_and_update_template("JHARKHAND", ['hindi_template.docx'])
-    check_and_update_template("HIMACHAL PRADESH", ['hindi_template.docx'])
-    check_and_update_template("MADHYA PRADESH", ['hindi_template.docx'])
-    check_and_update_template("RAJASTHAN", ['hindi_template.docx'])
-    check_and_update_template("CHHATTISGARH", ['hindi_template.docx'])
-    check_and_update_template("UTTAR PRADESH", ['hindi_template.docx'])
-    check_and_update_template("UTTARAKHAND", ['hindi_template.docx'])
 
-    check_and_update_template("WEST BENGAL", ["bengali_template.docx"])
-    check_and_update_template("TRIPURA", ["bengali_template.docx"])
+    load_state_templates()
+    if OVERLAY_TEMPLATES:
+        prepare_overlay_templates()
 
-    check_and_update_template("ASSAM", ["assamese_template.docx"])
-    check_and_update_template("GUJARAT", ['gujarati_template.docx'])
+    # With INCREMENTAL, only records whose fields or template changed since the last run are generated
+    manifest = Manifest(MANIFEST_PATH or os.path.join(base_dir, "manifest.sqlite")) if INCREMENTAL else None
+    if manifest is not None:
+        df = get_pending_records(df, manifest, state_template_dict, potential_column_names)
+        logging.info(f"Incremental run: {len(df)} of {total_records} records changed since the last run")
+        total_records = len(df)
+        total_batches = (total_records + chunk_size - 1) // chunk_size
 
-    check_and_update_template("GOA", ['marathi_template.docx'])
-    check_and_update_template("MAHARASHTRA", ['marathi_template.docx'])
-
-    check_and_update_template("PUNJAB", ['punjabi_template.docx'])
-
-    check_and_update_template("TAMIL NADU", ['tamil_template.docx'])
-
-    check_and_update_template("KERALA", ['malayalam_template.docx'])
-
-    check_and_update_template('KARNATAKA', ['kanada_template.docx', 'kannada_template.docx', 'kannda_template.docx'])
-
-    check_and_update_template('ORISSA', ['odiya_template.docx', 'orissa_template.docx', 'orisa_template.docx', 'oriya_template.docx'])
-    
-    check_and_update_template('ANDHRA PRADESH', ['telugu_template.docx', 'telgue_template.docx', 'telegu_template.docx'])
-
-    check_and_update_template("DEFAULT", ['default_template.docx'])
+    # Every record's progress is journaled; with --resume the work done before a crash is skipped
+    journal = Journal(JOURNAL_PATH or os.path.join(base_dir, "journal.jsonl"), resume=resume)
+    if resume and PIPELINE_MODE != "streaming":
+        df = journal.get_records_to_render(df, potential_column_names, output_dir, compress_dir)
+        logging.info(f"Resuming: {len(df)} of {total_records} records still to render")
+        total_records = len(df)
+        total_batches = (total_records + chunk_size - 1) // chunk_size
 
     log_initial_info(total_records, total_batches, chunk_size)
 
@@ -661,7 +4188,10 @@ async def main():
                 user_inputs['existing_folder_name'] = None
 
     if running_main_code:
-        if user_inputs['create_new_s3_folder']:
+        if resume and journal.run_info.get('s3_uri'):
+            S3_URI = journal.run_info['s3_uri']
+            logging.info(f"Resuming upload to folder: {S3_URI}")
+        elif user_inputs['create_new_s3_folder']:
             user_inputs["make_folder"] = get_user_input("Do you want to use the default folder or create a new one? (yes/no): ")
             if not user_inputs['make_folder']:
                 user_inputs['folder_name'] = input("Enter the folder name: ").strip()
@@ -678,52 +4208,85 @@ async def main():
         else:
             S3_URI = user_inputs['existing_folder_name']
             logging.info(f"Uploading to existing folder: {S3_URI}")
+        journal.start_run({'s3_uri': S3_URI})
 
         state_counts_total = df['State'].value_counts().to_dict()
         log_state_counts(state_counts_total)
 
-        process_dataframe_in_batches(df, chunk_size, total_batches, batch, output_dir, state_template_dict, potential_column_names)
+        if PIPELINE_MODE == "streaming":
+            run_streaming_pipeline(df.to_dict('records'), output_dir, compress_dir, state_template_dict, potential_column_names, S3_URI, failed_files_dir, manifest=manifest, journal=journal)
 
-        logging.info("Checking All PDFs...")
-        missing_pdfs_list = check_missing_pdfs(lang_folder, output_dir, potential_column_names)
-        if missing_pdfs_list:
-            print("Missing PDFs List:")
-            for missing_pdf in missing_pdfs_list:
-                print(f"- {missing_pdf}")
-            process_missing_pdfs(lang_folder, output_dir, missing_pdfs_list, state_template_dict)
+            logging.info("Checking All PDFs...")
+            missing_pdfs_list = check_missing_pdfs(lang_folder, output_dir, potential_column_names, manifest, retry_sheet_path=retry_sheet_path, journal=journal, compress_dir=compress_dir)
+            if missing_pdfs_list:
+                print("Missing PDFs List:")
+                for missing_pdf in missing_pdfs_list:
+                    print(f"- {missing_pdf}")
 
-        logging.info("All PDFs files are created successfully!\n")
-        compressing_pdf(output_dir, bat_file_path, compress_dir)
-        await delete_directory(output_dir)
-        uploading_to_s3(compress_dir, S3_URI, S3_BUCKET_NAME, AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_REGION, failed_files_dir)
+                # Send only the missing records through the pipeline again
+                name_columns = [column for column in potential_column_names if column in df.columns]
+                missing_names = {str(missing_pdf) for missing_pdf in missing_pdfs_list}
+                # Files are named by the first file name column present, like process_record does
+                missing_df = df[df[name_columns[0]].astype(str).isin(missing_names)] if name_columns else df.iloc[0:0]
+                run_streaming_pipeline(missing_df.to_dict('records'), output_dir, compress_dir, state_template_dict, potential_column_names, S3_URI, failed_files_dir, manifest=manifest, journal=journal)
+
+            logging.info("All PDFs files are created successfully!\n")
+            close_pdf_converter()
+            delete_directory(output_dir)
+        else:
+            if resume:
+                # DOCX files rendered before the crash
+                generate_pdf_from_docx(output_dir, journal.get_files_to_convert(output_dir, compress_dir), journal=journal)
+            process_dataframe_in_batches(df, chunk_size, total_batches, batch, output_dir, state_template_dict, potential_column_names, manifest=manifest, journal=journal)
+
+            logging.info("Checking All PDFs...")
+            missing_pdfs_list = check_missing_pdfs(lang_folder, output_dir, potential_column_names, manifest, retry_sheet_path=retry_sheet_path, journal=journal, compress_dir=compress_dir)
+            if missing_pdfs_list:
+                print("Missing PDFs List:")
+                for missing_pdf in missing_pdfs_list:
+                    print(f"- {missing_pdf}")
+                process_missing_pdfs(lang_folder, output_dir, missing_pdfs_list, state_template_dict, manifest, potential_column_names, report_path=failed_records_path, journal=journal)
+
+            logging.info("All PDFs files are created successfully!\n")
+            close_pdf_converter()
+            compressing_pdf(output_dir, compress_dir, manifest, journal=journal)
+            delete_directory(output_dir)
+            uploading_to_s3(compress_dir, S3_URI, S3_BUCKET_NAME, AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_REGION, failed_files_dir, manifest=manifest, journal=journal)
     else:
         state_counts_total = df['State'].value_counts().to_dict()
         log_state_counts(state_counts_total)
 
         if user_inputs['process_dataframe_in_batches']:
-            process_dataframe_in_batches(df, chunk_size, total_batches, batch, output_dir, state_template_dict, potential_column_names)
+            if resume:
+                # DOCX files rendered before the crash
+                generate_pdf_from_docx(output_dir, journal.get_files_to_convert(output_dir, compress_dir), journal=journal)
+            process_dataframe_in_batches(df, chunk_size, total_batches, batch, output_dir, state_template_dict, potential_column_names, manifest=manifest, journal=journal)
 
         logging.info("Checking All PDFs...")
         if user_inputs['check_missing_pdfs']:
-            missing_pdfs_list = check_missing_pdfs(lang_folder, output_dir, potential_column_names)
+            missing_pdfs_list = check_missing_pdfs(lang_folder, output_dir, potential_column_names, manifest, retry_sheet_path=retry_sheet_path, journal=journal, compress_dir=compress_dir)
             if missing_pdfs_list:
                 print("Missing PDFs List:")
                 for missing_pdf in missing_pdfs_list:
                     print(f"- {missing_pdf}")
-                process_missing_pdfs(lang_folder, output_dir, missing_pdfs_list, state_template_dict)
+                process_missing_pdfs(lang_folder, output_dir, missing_pdfs_list, state_template_dict, manifest, potential_column_names, report_path=failed_records_path, journal=journal)
 
         logging.info("All PDFs files are created successfully!\n")
+        close_pdf_converter()
 
         if user_inputs['compressing_pdf']:
-            compressing_pdf(output_dir, bat_file_path, compress_dir)
-            await delete_directory(output_dir)
+            compressing_pdf(output_dir, compress_dir, manifest, journal=journal)
+            delete_directory(output_dir)
 
         if user_inputs['merge_pdfs_by_srno']:
             logging.info("Processing Merge PDFs")
             merge_pdfs_by_srno(compress_dir, base_dir, excel_path, potential_column_names, batch_size=2000)
             logging.info("All pdfs are merged successfully!\n")
 
-        if user_inputs['create_new_s3_folder']:
+        if resume and journal.run_info.get('s3_uri'):
+            S3_URI = journal.run_info['s3_uri']
+            logging.info(f"Resuming upload to folder: {S3_URI}")
+        elif user_inputs['create_new_s3_folder']:
             user_inputs["make_folder"] = get_user_input("Do you want to use the default folder or create a new one? (yes/no): ")
             if not user_inputs['make_folder']:
                 user_inputs['folder_name'] = input("Enter the folder name: ").strip()
@@ -746,9 +4309,39 @@ async def main():
                 S3_URI = None
 
         if S3_URI:
-            uploading_to_s3(compress_dir, S3_URI, S3_BUCKET_NAME, AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_REGION, failed_files_dir)
+            journal.start_run({'s3_uri': S3_URI})
+            uploading_to_s3(compress_dir, S3_URI, S3_BUCKET_NAME, AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_REGION, failed_files_dir, manifest=manifest, journal=journal)
+
+    if manifest is not None:
+        manifest.close()
+    journal.close()
+
+    metrics.write_report(METRICS_DIR or base_dir)
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Generate, compress and upload PDFs from lang/lang_data.xlsx.")
+    parser.add_argument('--jobs', help="Run the jobs of this JSON job spec without prompts instead of the interactive run")
+    parser.add_argument('--resume', action='store_true', help="Continue an interrupted run from its journal instead of starting over")
+    parser.add_argument('--coordinate', metavar='SPEC', help="Split the job of this JSON shard spec into shards and run them on the shard workers")
+    parser.add_argument('--workers', type=int, help="Number of local shard workers started by --coordinate, overriding local_workers")
+    parser.add_argument('--worker', metavar='QUEUE', help="Run shards from this shard queue until none are left")
+    parser.add_argument('--log-levels', metavar='SPEC', help="Log levels by stage or logger, e.g. render=DEBUG,upload=WARNING (see LOG_LEVELS)")
+    args = parser.parse_args()
+
+    # Only here, so importing final doesn't create log files in the importer's working directory
+    configure_logging(info_log_file, error_log_file)
+    if args.log_levels:
+        # Also for the shard workers started by --coordinate
+        os.environ['LOG_LEVELS'] = args.log_levels
+        set_log_levels(args.log_levels)
+
+    if args.coordinate:
+        run_coordinator(args.coordinate, num_workers=args.workers)
+    elif args.worker:
+        run_shard_worker(args.worker)
+    elif args.jobs:
+        run_jobs(args.jobs, resume=args.resume)
+    else:
+        asyncio.run(main(resume=args.resume))
 
 
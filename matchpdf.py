@@ -1,4 +1,5 @@
 import os
+import json
 import pandas as pd
 import shutil
 
@@ -9,7 +10,18 @@ def read_barcodes_from_excel(excel_path, sheet_name, barcode_column):
     return barcodes
 
 def list_pdf_files(directory):
-    """Lists all PDF files in the specified directory."""
+    """Lists all PDF files in the specified directory, read from its index.jsonl when it has a sharded layout."""
+    index_path = os.path.join(directory, 'index.jsonl')
+    if os.path.exists(index_path):
+        paths = {}
+        with open(index_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                paths[entry['name']] = entry['path']
+        return [path for name, path in paths.items() if name.endswith('.pdf')]
     return [f for f in os.listdir(directory) if f.endswith('.pdf')]
 
 def check_barcodes_in_pdfs(barcodes, pdf_files):
@@ -18,7 +30,7 @@ def check_barcodes_in_pdfs(barcodes, pdf_files):
     matched_pdf_files = []
     for barcode in barcodes:
         for pdf in pdf_files:
-            if barcode in pdf:
+            if barcode in os.path.basename(pdf):
                 matched_barcodes.append(barcode)
                 matched_pdf_files.append(pdf)
                 break
@@ -30,7 +42,7 @@ def copy_matched_pdfs(pdf_files, source_directory, target_directory):
         os.makedirs(target_directory)
     for pdf in pdf_files:
         source_path = os.path.join(source_directory, pdf)
-        target_path = os.path.join(target_directory, pdf)
+        target_path = os.path.join(target_directory, os.path.basename(pdf))
         shutil.copyfile(source_path, target_path)
 
 def main():
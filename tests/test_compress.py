@@ -0,0 +1,34 @@
+import os
+import shutil
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import final
+
+
+def test_temporary_files_stay_out_of_the_output_folder(tmp_path, monkeypatch):
+    scratch_dir, compress_dir = tmp_path / "scratch", tmp_path / "COMPRESS"
+    scratch_dir.mkdir()
+    compress_dir.mkdir()
+    input_pdf = tmp_path / "LAN001.pdf"
+    input_pdf.write_bytes(b"%PDF-1.4\n")
+    monkeypatch.setattr(final, 'SCRATCH_DIR', str(scratch_dir))
+    seen = []
+
+    def run(command, **kwargs):
+        # Stands in for qpdf and Ghostscript, and records what an output scan finds while they run
+        if command[0] == final.QPDF_PATH:
+            shutil.copyfile(command[-2], command[-1])
+        else:
+            output_pdf = next(argument for argument in command if argument.startswith("-sOutputFile=")).split("=", 1)[1]
+            shutil.copyfile(command[-1], output_pdf)
+        seen.append((os.listdir(scratch_dir), final.scan_output_files(str(compress_dir))))
+
+    monkeypatch.setattr(final.subprocess, 'run', run)
+    result = final.compress_pdf_file(str(input_pdf), str(compress_dir / "LAN001.pdf"))
+
+    assert not result['skipped']
+    assert [len(scratch_files) for scratch_files, _ in seen] == [1, 1]
+    assert [found for _, found in seen] == [{}, {}]
+    assert os.listdir(scratch_dir) == []
+    assert os.listdir(compress_dir) == ["LAN001.pdf"]
@@ -0,0 +1,77 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import final
+
+
+class StubConverter(final.SupervisedConverter):
+    # Converts by name: "hang" blocks until its worker is killed, "flaky" fails its first attempt, "bad" always fails
+    name = "stub"
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.kills = []
+        self.killed = threading.Event()
+        self.attempts = {}
+
+    def _kill_worker(self, worker_id):
+        self.kills.append(worker_id)
+        self.killed.set()
+
+    def _worker_loop(self, worker_id):
+        documents = 0
+        while True:
+            job = self._next_job()
+            if job is None:
+                break
+            source = job[0]
+            self.attempts[source] = self.attempts.get(source, 0) + 1
+
+            self._begin(worker_id)
+            error = None
+            if source.startswith("hang") and self.attempts[source] == 1:
+                self.killed.wait(10)
+                self.killed.clear()
+            elif source.startswith("bad") or (source.startswith("flaky") and self.attempts[source] == 1):
+                error = "conversion failed"
+            if self._end(worker_id):
+                error = f"timed out after {self.timeout:.0f}s"
+                documents = 0
+            else:
+                documents += 1
+            self._finish(job, error)
+
+            if self._needs_recycling(worker_id, documents):
+                self._kill_worker(worker_id)
+                documents = 0
+
+
+def test_stuck_document_is_killed_and_retried():
+    converter = StubConverter(timeout=0.5, recycle_documents=0, max_attempts=2)
+    try:
+        assert converter.convert(["hang.docx", "ok.docx"], "out") == {}
+    finally:
+        converter.close()
+    assert converter.kills == [0]
+    assert converter.attempts == {"hang.docx": 2, "ok.docx": 1}
+
+
+def test_failed_documents_go_to_the_retry_queue():
+    converter = StubConverter(num_workers=2, timeout=30, recycle_documents=0, max_attempts=3)
+    try:
+        failures = converter.convert(["flaky.docx", "bad.docx", "ok.docx"], "out")
+    finally:
+        converter.close()
+    assert failures == {"bad.docx": "conversion failed"}
+    assert converter.attempts == {"flaky.docx": 2, "bad.docx": 3, "ok.docx": 1}
+
+
+def test_worker_is_recycled_after_its_document_limit():
+    converter = StubConverter(timeout=30, recycle_documents=2, max_attempts=1)
+    try:
+        assert converter.convert([f"ok{index}.docx" for index in range(5)], "out") == {}
+    finally:
+        converter.close()
+    assert converter.kills == [0, 0]
@@ -0,0 +1,52 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import final
+
+
+def make_records():
+    return pd.DataFrame({
+        'LAN_Details': ['LAN001', 'LAN002', 'LAN001', 'LAN003', 'LAN002', None],
+        'Name': ['A first', 'B first', 'A last', 'C', 'B last', 'No name'],
+    })
+
+
+@pytest.mark.parametrize('policy, names', [
+    ('keep-first', ['A first', 'B first', 'C', 'No name']),
+    ('keep-last', ['A last', 'C', 'B last', 'No name']),
+    ('off', ['A first', 'B first', 'A last', 'C', 'B last', 'No name']),
+])
+def test_policies(policy, names):
+    assert final.dedup_records(make_records(), ['Prospect_no', 'LAN_Details'], policy=policy)['Name'].tolist() == names
+
+
+def test_fail_policy_raises_and_reports(tmp_path):
+    report_path = str(tmp_path / "duplicates.csv")
+    with pytest.raises(ValueError, match="2 records share their LAN_Details"):
+        final.dedup_records(make_records(), ['LAN_Details'], policy='fail', report_path=report_path)
+    report = pd.read_csv(report_path)
+    assert report['Name'].tolist() == ['A first', 'B first', 'A last', 'B last']
+    assert 'Kept' not in report.columns
+
+
+def test_report_marks_the_kept_records(tmp_path):
+    report_path = str(tmp_path / "duplicates.csv")
+    final.dedup_records(make_records(), ['LAN_Details'], policy='keep-last', report_path=report_path)
+    report = pd.read_csv(report_path)
+    assert dict(zip(report['Name'], report['Kept'])) == {'A first': False, 'B first': False, 'A last': True, 'B last': True}
+
+
+def test_no_duplicates_writes_no_report(tmp_path):
+    report_path = str(tmp_path / "duplicates.csv")
+    df = make_records().drop_duplicates('LAN_Details')
+    assert final.dedup_records(df, ['LAN_Details'], policy='fail', report_path=report_path) is df
+    assert not os.path.exists(report_path)
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError, match="Unknown dedup policy"):
+        final.dedup_records(make_records(), ['LAN_Details'], policy='newest')
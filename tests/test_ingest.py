@@ -0,0 +1,47 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import final
+
+
+def fail_parsing(*args, **kwargs):
+    raise AssertionError("the input sheet was parsed again")
+
+
+def test_changed_source_is_parsed_again(tmp_path, monkeypatch):
+    monkeypatch.setattr(final, 'lang_data_cache', {})
+    data_path = tmp_path / "lang_data.csv"
+    cache_dir = tmp_path / ".cache"
+    pd.DataFrame({'SrNo': [1, 2], 'LAN_Details': ['LAN001', 'LAN002']}).to_csv(data_path, index=False)
+
+    df = final.load_lang_data(str(data_path))
+    assert df['LAN_Details'].tolist() == ['LAN001', 'LAN002']
+    assert len(os.listdir(cache_dir)) == 1
+    # Same file version, same DataFrame
+    assert final.load_lang_data(str(data_path)) is df
+
+    pd.DataFrame({'SrNo': [1, 2, 3], 'LAN_Details': ['LAN001', 'LAN002', 'LAN003']}).to_csv(data_path, index=False)
+    stat = os.stat(data_path)
+    os.utime(data_path, (stat.st_atime, stat.st_mtime + 10))
+    df = final.load_lang_data(str(data_path))
+    assert df['LAN_Details'].tolist() == ['LAN001', 'LAN002', 'LAN003']
+    # The sidecar of the old version is replaced
+    assert len(os.listdir(cache_dir)) == 1
+
+
+def test_touched_source_is_read_from_the_sidecar(tmp_path, monkeypatch):
+    monkeypatch.setattr(final, 'lang_data_cache', {})
+    data_path = tmp_path / "lang_data.csv"
+    pd.DataFrame({'SrNo': [1], 'LAN_Details': ['LAN001']}).to_csv(data_path, index=False)
+    first = final.load_lang_data(str(data_path))
+
+    # A new mtime with the same content skips parsing, the sidecar is keyed on the content
+    stat = os.stat(data_path)
+    os.utime(data_path, (stat.st_atime, stat.st_mtime + 10))
+    monkeypatch.setattr(final.pd, 'read_csv', fail_parsing)
+    second = final.load_lang_data(str(data_path))
+    assert second is not first
+    assert second.equals(first)
@@ -0,0 +1,69 @@
+import json
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import final
+
+
+def test_truncated_last_line_is_skipped(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = final.Journal(path)
+    journal.start_run({'s3_uri': "letters/run-1"})
+    journal.record('render', ['LAN001', 'LAN002'])
+    journal.record('compress', ['LAN001'])
+    journal.close()
+    # A crash in the middle of a write leaves half a line
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"stage": "upload", "files": ["LAN0')
+
+    journal = final.Journal(path, resume=True)
+    assert journal.run_info == {'s3_uri': "letters/run-1"}
+    assert journal.completed('LAN001', 'compress') and not journal.completed('LAN001', 'upload')
+    assert journal.completed('LAN002', 'render') and not journal.completed('LAN002', 'convert')
+    journal.record('upload', ['LAN001'])
+    journal.close()
+
+    # The torn line is ended first, so the entry after it is read back
+    with open(path, encoding='utf-8') as f:
+        assert json.loads(f.read().splitlines()[-1])['files'] == ['LAN001']
+    journal = final.Journal(path, resume=True)
+    assert journal.completed('LAN001', 'upload')
+    journal.close()
+
+
+def test_resume_stage_follows_the_files_on_disk(tmp_path):
+    output_dir, compress_dir = tmp_path / "OUTPUT", tmp_path / "COMPRESS"
+    output_dir.mkdir()
+    compress_dir.mkdir()
+    journal = final.Journal(str(tmp_path / "journal.jsonl"))
+    try:
+        journal.record('render', ['LAN001', 'LAN002', 'LAN003'])
+        journal.record('compress', ['LAN001'])
+        (compress_dir / "LAN001.pdf").write_bytes(b"%PDF-1.4\n")
+        (output_dir / "LAN002.docx").write_bytes(b"docx")
+
+        assert journal.get_resume_stage('LAN001', str(output_dir), str(compress_dir)) == 'compress'
+        assert journal.get_resume_stage('LAN002', str(output_dir), str(compress_dir)) == 'render'
+        # Journaled, but its DOCX is gone
+        assert journal.get_resume_stage('LAN003', str(output_dir), str(compress_dir)) is None
+        assert journal.get_files_to_convert(str(output_dir), str(compress_dir)) == ['LAN002']
+
+        df = pd.DataFrame({'LAN_Details': ['LAN001', 'LAN002', 'LAN003', 'LAN004']})
+        assert journal.get_records_to_render(df, ['LAN_Details'], str(output_dir), str(compress_dir))['LAN_Details'].tolist() == ['LAN003', 'LAN004']
+    finally:
+        journal.close()
+
+
+def test_without_resume_the_journal_starts_over(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = final.Journal(path)
+    journal.record('upload', ['LAN001'])
+    journal.close()
+
+    journal = final.Journal(path)
+    assert not journal.completed('LAN001', 'render')
+    journal.close()
+    assert os.path.getsize(path) == 0
@@ -0,0 +1,80 @@
+import os
+import shutil
+import sys
+
+import docx
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import final
+
+
+class FakeConverter(final.PdfConverter):
+    name = 'fake'
+
+    def convert(self, docx_paths, output_dir):
+        for docx_path in docx_paths:
+            with open(os.path.join(output_dir, os.path.splitext(os.path.basename(docx_path))[0] + ".pdf"), 'wb') as f:
+                f.write(b"%PDF-1.4\n")
+        return {}
+
+
+def make_template(path, text):
+    document = docx.Document()
+    document.add_paragraph(text)
+    document.save(path)
+
+
+def test_rerun_only_renders_changed_records(tmp_path, monkeypatch):
+    template_path = str(tmp_path / "default_template.docx")
+    make_template(template_path, 'Dear {{ Name }}')
+    templates = {'DEFAULT': template_path}
+    output_dir, compress_dir = tmp_path / "OUTPUT", tmp_path / "COMPRESS"
+    output_dir.mkdir()
+    compress_dir.mkdir()
+    df = pd.DataFrame({'LAN_Details': ['LAN001', 'LAN002', 'LAN003'], 'Name': ['A', 'B', 'C'], 'State': 'X'})
+    monkeypatch.setattr(final, 'get_pdf_converter', lambda: FakeConverter())
+    monkeypatch.setattr(final, 'compress_pdf_file', lambda input_pdf, output_pdf: shutil.copyfile(input_pdf, output_pdf))
+    rendered = []
+    process_record = final.process_record
+    monkeypatch.setattr(final, 'process_record', lambda record, *args: rendered.append(record['LAN_Details']) or process_record(record, *args))
+
+    manifest = final.Manifest(str(tmp_path / "manifest.sqlite"))
+    try:
+        def run(records):
+            final.run_streaming_pipeline(records.to_dict('records'), str(output_dir), str(compress_dir), templates, ['LAN_Details'],
+                                         manifest=manifest, in_memory=False)
+
+        run(final.get_pending_records(df, manifest, templates, ['LAN_Details']))
+        assert sorted(rendered) == ['LAN001', 'LAN002', 'LAN003']
+
+        # Nothing changed, nothing to do
+        assert final.get_pending_records(df, manifest, templates, ['LAN_Details']).empty
+
+        # A changed field gives the record a new hash, and only that record is rendered again
+        df.loc[1, 'Name'] = 'B changed'
+        rendered.clear()
+        run(final.get_pending_records(df, manifest, templates, ['LAN_Details']))
+        assert rendered == ['LAN002']
+        assert final.get_pending_records(df, manifest, templates, ['LAN_Details']).empty
+
+        # A changed template invalidates every record rendered from it
+        make_template(template_path, 'Hello {{ Name }}')
+        assert final.get_pending_records(df, manifest, templates, ['LAN_Details'])['LAN_Details'].tolist() == ['LAN001', 'LAN002', 'LAN003']
+    finally:
+        manifest.close()
+
+
+def test_missing_compressed_file_stays_pending(tmp_path):
+    manifest = final.Manifest(str(tmp_path / "manifest.sqlite"))
+    try:
+        template_path = str(tmp_path / "default_template.docx")
+        make_template(template_path, 'Dear {{ Name }}')
+        templates = {'DEFAULT': template_path}
+        df = pd.DataFrame({'LAN_Details': ['LAN001'], 'Name': ['A'], 'State': 'X'})
+        final.record_rendered_in_manifest(manifest, df.to_dict('records'), templates, ['LAN_Details'])
+        manifest.record_stage('pdf_hash', [('LAN001', 'pdf')])
+        assert final.get_pending_records(df, manifest, templates, ['LAN_Details'], stage='pdf_hash').empty
+        assert len(final.get_pending_records(df, manifest, templates, ['LAN_Details'])) == 1
+    finally:
+        manifest.close()
@@ -0,0 +1,69 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+from PyPDF2 import PdfReader
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import final
+
+fpdf = pytest.importorskip('fpdf')
+
+
+def write_pdf(path, file_name, pages):
+    pdf = fpdf.FPDF()
+    pdf.set_font('helvetica', size=12)
+    for page in range(1, pages + 1):
+        pdf.add_page()
+        pdf.cell(text=f"{file_name} page {page}")
+    pdf.output(str(path))
+
+
+def make_run(tmp_path):
+    # SrNo 10 sorts after 9 as a number, not as text; LAN004 has no PDF
+    output_dir = tmp_path / "COMPRESS"
+    output_dir.mkdir()
+    records = pd.DataFrame({'SrNo': [10, 2, 9, 1], 'LAN_Details': ['LAN010', 'LAN002', 'LAN009', 'LAN004']})
+    records.to_csv(tmp_path / "lang_data.csv", index=False)
+    for file_name, pages in (('LAN010', 1), ('LAN002', 2), ('LAN009', 3)):
+        write_pdf(output_dir / f"{file_name}.pdf", file_name, pages)
+    return str(output_dir), str(tmp_path / "lang_data.csv")
+
+
+def page_texts(path):
+    return [page.extract_text().strip() for page in PdfReader(path).pages]
+
+
+@pytest.mark.parametrize('mode, num_processes', [('pypdf', 1), ('streaming', 1), ('streaming', 2), ('dedup', 1)])
+def test_merged_pages_follow_srno(tmp_path, mode, num_processes):
+    output_dir, data_path = make_run(tmp_path)
+    final.merge_pdfs_by_srno(output_dir, str(tmp_path), data_path, ['LAN_Details'], batch_size=3, mode=mode, num_processes=num_processes)
+
+    assert page_texts(tmp_path / "merged_output_srno_1-9.pdf") == ["LAN002 page 1", "LAN002 page 2", "LAN009 page 1", "LAN009 page 2", "LAN009 page 3"]
+    assert page_texts(tmp_path / "merged_output_srno_10-10.pdf") == ["LAN010 page 1"]
+
+
+def test_dedup_writes_a_shared_image_once(tmp_path):
+    Image = pytest.importorskip('PIL.Image')
+    logo_path = str(tmp_path / "logo.png")
+    Image.effect_noise((200, 200), 64).save(logo_path)
+    pdf_paths = []
+    for index in range(3):
+        pdf = fpdf.FPDF()
+        pdf.add_page()
+        pdf.image(logo_path, x=10, y=10, w=50)
+        pdf_paths.append(str(tmp_path / f"LAN00{index}.pdf"))
+        pdf.output(pdf_paths[-1])
+
+    sizes = {}
+    for mode in ('streaming', 'dedup'):
+        merged_pdf_path = str(tmp_path / f"{mode}.pdf")
+        final.merge_pdf_batch(pdf_paths, merged_pdf_path, mode=mode)
+        pages = PdfReader(merged_pdf_path).pages
+        # The object numbers the pages' images point to
+        image_ids = {page['/Resources']['/XObject'].raw_get(name).idnum for page in pages for name in page['/Resources']['/XObject']}
+        assert len(pages) == 3
+        assert len(image_ids) == (1 if mode == 'dedup' else 3)
+        sizes[mode] = os.path.getsize(merged_pdf_path)
+    assert sizes['dedup'] < sizes['streaming'] / 2
@@ -0,0 +1,42 @@
+import os
+import sys
+
+import docx
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import final
+
+
+class FakeConverter(final.PdfConverter):
+    # Writes a placeholder PDF for every DOCX
+    name = 'fake'
+
+    def convert(self, docx_paths, output_dir):
+        for docx_path in docx_paths:
+            with open(os.path.join(output_dir, os.path.splitext(os.path.basename(docx_path))[0] + ".pdf"), 'wb') as f:
+                f.write(b"%PDF-1.4\n")
+        return {}
+
+
+def test_regenerates_missing_pdfs_with_numeric_ids(tmp_path, monkeypatch):
+    template_path = str(tmp_path / "default_template.docx")
+    document = docx.Document()
+    document.add_paragraph('Dear {{ Name }}')
+    document.save(template_path)
+    data_path = str(tmp_path / "lang_data.csv")
+    pd.DataFrame({'Prospect_no': [1001, 1002, 1003], 'Name': ['A', 'B', 'C'], 'State': ['X'] * 3}).to_csv(data_path, index=False)
+    output_dir = tmp_path / "OUTPUT"
+    output_dir.mkdir()
+    (output_dir / "1001.pdf").write_bytes(b"%PDF-1.4\n")
+    monkeypatch.setattr(final, 'get_pdf_converter', FakeConverter)
+    template_dict = {'DEFAULT': template_path}
+
+    missing = final.check_missing_pdfs(None, str(output_dir), ['Prospect_no'], state_template_dict=template_dict, data_path=data_path)
+    assert missing == ['1002', '1003']
+
+    failed = final.process_missing_pdfs(None, str(output_dir), missing, template_dict, potential_column_names=['Prospect_no'],
+                                        data_path=data_path, in_memory=False)
+    assert failed == {}
+    assert sorted(os.listdir(output_dir)) == ['1001.pdf', '1002.pdf', '1003.pdf']
+    assert final.check_missing_pdfs(None, str(output_dir), ['Prospect_no'], state_template_dict=template_dict, data_path=data_path) is None
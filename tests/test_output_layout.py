@@ -0,0 +1,30 @@
+import os
+import shutil
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import final
+
+
+def write_pdf(directory, file_name):
+    path = final.make_output_path(directory, file_name, layout='hash')
+    with open(path, 'wb') as f:
+        f.write(b"%PDF-1.4\n")
+    return final.place_output_file(directory, path, layout='hash')
+
+
+def test_delete_directory_closes_the_index(tmp_path):
+    directory = str(tmp_path / "OUTPUT")
+    write_pdf(directory, "LAN001")
+    final.delete_directory(directory)
+    assert not os.path.exists(directory)
+    assert os.path.abspath(directory) not in final.output_indexes
+
+
+def test_index_is_reopened_when_the_folder_is_recreated(tmp_path):
+    directory = str(tmp_path / "OUTPUT")
+    write_pdf(directory, "LAN001")
+    shutil.rmtree(directory)
+    write_pdf(directory, "LAN002")
+    assert list(final.list_output_files(directory, layout='hash')) == ['LAN002']
+    final.close_output_indexes(directory)
@@ -0,0 +1,100 @@
+import os
+import sys
+
+import docx
+import pytest
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+from PyPDF2 import PdfReader
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import final
+
+
+@pytest.fixture(scope='module')
+def font_file(tmp_path_factory):
+    # A TrueType font with a box glyph for every printable ASCII character, so no system or FONTS_DIR font is needed
+    if final.FPDF is None:
+        pytest.skip("needs fpdf2")
+    from fontTools.fontBuilder import FontBuilder
+    from fontTools.pens.ttGlyphPen import TTGlyphPen
+
+    characters = [chr(code) for code in range(32, 127)]
+    glyph_names = ['.notdef'] + [f"uni{ord(char):04X}" for char in characters]
+    glyphs = {}
+    for glyph_name in glyph_names:
+        pen = TTGlyphPen(None)
+        if glyph_name != 'uni0020':
+            pen.moveTo((50, 0))
+            pen.lineTo((50, 700))
+            pen.lineTo((450, 700))
+            pen.lineTo((450, 0))
+            pen.closePath()
+        glyphs[glyph_name] = pen.glyph()
+
+    builder = FontBuilder(1000, isTTF=True)
+    builder.setupGlyphOrder(glyph_names)
+    builder.setupCharacterMap({ord(char): f"uni{ord(char):04X}" for char in characters})
+    builder.setupGlyf(glyphs)
+    builder.setupHorizontalMetrics({glyph_name: (500, 50) for glyph_name in glyph_names})
+    builder.setupHorizontalHeader(ascent=800, descent=-200)
+    builder.setupNameTable({'familyName': "Test Sans", 'styleName': "Regular"})
+    builder.setupOS2(sTypoAscender=800, sTypoDescender=-200, usWinAscent=800, usWinDescent=200)
+    builder.setupPost()
+    path = str(tmp_path_factory.mktemp("fonts") / "TestSans-Regular.ttf")
+    builder.save(path)
+    return path
+
+
+@pytest.fixture
+def make_overlay(font_file):
+    def make(room=400.0):
+        base = final.FPDF(unit='pt')
+        base.add_page(format=(595, 842))
+        return {'fields': {'Name': [[0, 72.0, 700.0, 11.0, room, '']]}, 'page_sizes': [[595.0, 842.0]],
+                'base_pdf_data': bytes(base.output()), 'font_files': {'': font_file}}
+    return make
+
+
+def test_stamps_records_with_different_characters(tmp_path, make_overlay):
+    # Each record needs glyphs the earlier ones didn't use
+    overlay = make_overlay()
+    for index, name in enumerate(['Ramesh 0', 'Ramesh 1', 'abc', 'xyz']):
+        output_path = str(tmp_path / f"{index}.pdf")
+        final.render_overlay_record({'Name': name}, overlay, output_path)
+        assert name in PdfReader(output_path).pages[0].extract_text()
+
+
+@pytest.mark.parametrize('name', ['A name far too long for the room left in its field', 'Two\nlines'])
+def test_rejects_values_the_template_would_lay_out_differently(tmp_path, make_overlay, name):
+    overlay = make_overlay(room=100.0)
+    with pytest.raises(ValueError):
+        final.render_overlay_record({'Name': name}, overlay, str(tmp_path / "out.pdf"))
+
+
+def test_falls_back_to_docx_when_stamping_fails(tmp_path, monkeypatch):
+    template_path = str(tmp_path / "default_template.docx")
+    document = docx.Document()
+    document.add_paragraph('Dear {{ Name }}')
+    document.save(template_path)
+    monkeypatch.setattr(final, 'OVERLAY_TEMPLATES', True)
+    monkeypatch.setattr(final, 'get_overlay_template', lambda path: {'fields': {}})
+    monkeypatch.setattr(final, 'render_overlay_record', lambda record, overlay, output_path: 1 / 0)
+
+    result = final.process_record({'Name': 'Ramesh', 'LAN_Details': 'LAN001', 'State': 'X'}, str(tmp_path),
+                                  {'DEFAULT': template_path}, ['LAN_Details'])
+    assert result == ('LAN001', 'X')
+    assert os.path.exists(tmp_path / "LAN001.docx")
+    assert not os.path.exists(tmp_path / "LAN001.pdf")
+
+
+def test_finds_centred_and_right_aligned_fields(tmp_path):
+    template_path = str(tmp_path / "template.docx")
+    document = docx.Document()
+    document.add_paragraph('{{ Name }}')
+    document.add_paragraph('{{ Title }}').alignment = WD_ALIGN_PARAGRAPH.CENTER
+    document.add_paragraph('{{ Date }}').alignment = WD_ALIGN_PARAGRAPH.RIGHT
+    document.save(template_path)
+
+    alignments, right_margin = final.get_overlay_field_layout(template_path)
+    assert alignments == {'Name': 'left', 'Title': 'center', 'Date': 'right'}
+    assert right_margin > 0
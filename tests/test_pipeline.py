@@ -0,0 +1,113 @@
+import os
+import shutil
+import sys
+import threading
+import time
+
+import docx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import final
+
+
+class FakeConverter(final.PdfConverter):
+    # Writes a placeholder PDF for every DOCX, except the ones named in failing
+    name = 'fake'
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+
+    def convert(self, docx_paths, output_dir):
+        failures = {}
+        for docx_path in docx_paths:
+            file_name = os.path.splitext(os.path.basename(docx_path))[0]
+            if file_name in self.failing:
+                failures[docx_path] = "conversion failed"
+                continue
+            with open(os.path.join(output_dir, f"{file_name}.pdf"), 'wb') as f:
+                f.write(b"%PDF-1.4\n")
+        return failures
+
+
+def test_queues_are_bounded():
+    produced = []
+    gate = threading.Event()
+
+    def items():
+        for index in range(20):
+            produced.append(index)
+            yield index
+
+    def blocked(item):
+        gate.wait()
+        return item
+
+    result = {}
+    runner = threading.Thread(target=lambda: result.update(final.run_pipeline_stages(items(), [('first', blocked, 1), ('second', lambda item: item, 1)], queue_size=2)))
+    runner.start()
+    time.sleep(0.3)
+    # One item in the worker, two in its queue and one waiting to be put
+    assert len(produced) <= 4
+    gate.set()
+    runner.join()
+    assert result == {'first': {'done': 20, 'failed': 0}, 'second': {'done': 20, 'failed': 0}}
+
+
+def test_failed_items_stop_at_their_stage():
+    seen = []
+
+    def fail_odd(item):
+        if item % 2:
+            raise ValueError("odd")
+        return item
+
+    stats = final.run_pipeline_stages(range(10), [('check', fail_odd, 2), ('collect', seen.append, 1)], queue_size=3)
+    assert stats['check'] == {'done': 5, 'failed': 5}
+    assert sorted(seen) == [0, 2, 4, 6, 8]
+
+
+def test_resumed_run_only_redoes_unfinished_records(tmp_path, monkeypatch):
+    template_path = str(tmp_path / "default_template.docx")
+    document = docx.Document()
+    document.add_paragraph('Dear {{ Name }}')
+    document.save(template_path)
+    output_dir, compress_dir = tmp_path / "OUTPUT", tmp_path / "COMPRESS"
+    output_dir.mkdir()
+    compress_dir.mkdir()
+    records = [{'LAN_Details': f"LAN00{index}", 'Name': f"Customer {index}", 'State': 'X'} for index in range(1, 4)]
+    monkeypatch.setattr(final, 'compress_pdf_file', lambda input_pdf, output_pdf: shutil.copyfile(input_pdf, output_pdf))
+    rendered = []
+    process_record = final.process_record
+    monkeypatch.setattr(final, 'process_record', lambda record, *args: rendered.append(record['LAN_Details']) or process_record(record, *args))
+
+    def run(converter, journal):
+        monkeypatch.setattr(final, 'get_pdf_converter', lambda: converter)
+        try:
+            return final.run_streaming_pipeline(records, str(output_dir), str(compress_dir), {'DEFAULT': template_path}, ['LAN_Details'],
+                                                queue_size=1, journal=journal, in_memory=False)
+        finally:
+            journal.close()
+
+    journal_path = str(tmp_path / "journal.jsonl")
+    stats = run(FakeConverter(failing={'LAN002'}), final.Journal(journal_path))
+    assert stats['convert'] == {'done': 2, 'failed': 1}
+    assert sorted(os.listdir(compress_dir)) == ['LAN001.pdf', 'LAN003.pdf']
+
+    rendered.clear()
+    stats = run(FakeConverter(), final.Journal(journal_path, resume=True))
+    assert rendered == ['LAN002']
+    assert stats['compress'] == {'done': 3, 'failed': 0}
+    assert sorted(os.listdir(compress_dir)) == ['LAN001.pdf', 'LAN002.pdf', 'LAN003.pdf']
+
+
+def test_converts_only_the_rendered_documents(tmp_path):
+    journal = final.Journal(str(tmp_path / "journal.jsonl"))
+    try:
+        for file_name in ('LAN001', 'LAN002', 'other'):
+            (tmp_path / f"{file_name}.docx").write_bytes(b"docx")
+        # LAN003 was rendered straight to PDF, so it has no DOCX
+        final.generate_pdf_from_docx(str(tmp_path), ['LAN001', 'LAN002', 'LAN003'], FakeConverter(failing={'LAN002'}), journal)
+        assert sorted(os.listdir(tmp_path)) == ['LAN001.pdf', 'journal.jsonl', 'other.docx']
+        assert journal.completed('LAN001', 'convert') and not journal.completed('LAN002', 'convert')
+    finally:
+        journal.close()
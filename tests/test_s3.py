@@ -0,0 +1,152 @@
+import os
+import sys
+
+import pytest
+from boto3.exceptions import S3UploadFailedError
+from botocore.exceptions import ClientError
+
+moto = pytest.importorskip('moto')
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import final
+
+BUCKET = 'letters'
+CREDENTIALS = ('testing', 'testing', 'us-east-1')
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setattr(final, 'S3_ENDPOINT_URL', None)
+    monkeypatch.setattr(final, 'S3_RETRY_BASE_DELAY', 0)
+    with moto.mock_aws():
+        # Clients made outside the mock would talk to AWS
+        final.s3_clients.clear()
+        client = final.get_s3_client(*CREDENTIALS)
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+    final.s3_clients.clear()
+
+
+def client_error(code):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, 'PutObject')
+
+
+def wrapped_error(error):
+    # The way upload_file raises S3UploadFailedError
+    try:
+        raise error
+    except ClientError as e:
+        try:
+            raise S3UploadFailedError(f"Failed to upload to {BUCKET}/key.pdf: {e}")
+        except S3UploadFailedError as upload_error:
+            return upload_error
+
+
+def write_pdfs(directory, names, size=100):
+    os.makedirs(directory, exist_ok=True)
+    for name in names:
+        with open(os.path.join(directory, f"{name}.pdf"), 'wb') as f:
+            f.write(f"%PDF-1.4 {name}".encode().ljust(size, b' '))
+
+
+def test_transient_errors():
+    assert final.is_transient_s3_error(client_error('SlowDown'))
+    assert not final.is_transient_s3_error(client_error('AccessDenied'))
+    assert final.is_transient_s3_error(wrapped_error(client_error('503')))
+    # A code in the message text is not enough, the wrapped error decides
+    assert not final.is_transient_s3_error(wrapped_error(ClientError({'Error': {'Code': 'AccessDenied', 'Message': 'request 503 denied'}}, 'PutObject')))
+
+
+def test_upload_retries_transient_errors(s3, tmp_path, monkeypatch):
+    write_pdfs(tmp_path, ['LAN001'])
+    put_object = s3.put_object
+    calls = []
+
+    def flaky_put_object(**kwargs):
+        calls.append(kwargs['Key'])
+        if len(calls) == 1:
+            raise client_error('SlowDown')
+        return put_object(**kwargs)
+    monkeypatch.setattr(s3, 'put_object', flaky_put_object)
+
+    assert final.upload_file_to_s3(str(tmp_path / "LAN001.pdf"), BUCKET, 'run/LAN001.pdf', *CREDENTIALS)
+    assert calls == ['run/LAN001.pdf', 'run/LAN001.pdf']
+    assert s3.head_object(Bucket=BUCKET, Key='run/LAN001.pdf')['ContentType'] == 'application/pdf'
+
+
+def test_upload_does_not_retry_permanent_errors(s3, tmp_path, monkeypatch):
+    write_pdfs(tmp_path, ['LAN001'])
+    calls = []
+
+    def denied_put_object(**kwargs):
+        calls.append(kwargs['Key'])
+        raise client_error('AccessDenied')
+    monkeypatch.setattr(s3, 'put_object', denied_put_object)
+
+    assert not final.upload_file_to_s3(str(tmp_path / "LAN001.pdf"), BUCKET, 'run/LAN001.pdf', *CREDENTIALS)
+    assert len(calls) == 1
+
+
+def test_large_files_are_uploaded_in_parts(s3, tmp_path):
+    path = tmp_path / "merged.pdf"
+    path.write_bytes(os.urandom(final.S3_MULTIPART_THRESHOLD + 1024))
+
+    assert final.upload_file_to_s3(str(path), BUCKET, 'run/merged.pdf', *CREDENTIALS)
+    assert s3.head_object(Bucket=BUCKET, Key='run/merged.pdf')['ETag'].strip('"').endswith('-2')
+
+
+def test_uploading_to_s3_uploads_the_folder_once(s3, tmp_path, monkeypatch):
+    output_dir, failed_dir = str(tmp_path / "COMPRESS"), str(tmp_path / "FAILED")
+    write_pdfs(output_dir, ['LAN001', 'LAN002', 'LAN003'])
+    os.makedirs(failed_dir)
+
+    final.uploading_to_s3(output_dir, 'run', BUCKET, *CREDENTIALS, failed_dir, num_workers=2, reconcile=True)
+    keys = [item['Key'] for item in s3.list_objects_v2(Bucket=BUCKET)['Contents']]
+    assert keys == ['run/LAN001.pdf', 'run/LAN002.pdf', 'run/LAN003.pdf']
+
+    # A rerun finds everything in S3 already
+    uploads = []
+    monkeypatch.setattr(final, 'upload_to_s3', lambda path, *args: uploads.append(path) or True)
+    final.uploading_to_s3(output_dir, 'run', BUCKET, *CREDENTIALS, failed_dir, num_workers=2, reconcile=True)
+    assert uploads == []
+    assert os.listdir(failed_dir) == []
+
+
+def test_multipart_etag_matches_s3(s3, tmp_path):
+    path = tmp_path / "merged.pdf"
+    path.write_bytes(os.urandom(final.S3_MULTIPART_THRESHOLD + 1024))
+    final.upload_file_to_s3(str(path), BUCKET, 'run/merged.pdf', *CREDENTIALS)
+
+    remote_object = final.list_s3_objects(BUCKET, 'run/', *CREDENTIALS)['run/merged.pdf']
+    assert remote_object['etag'] == final.get_s3_etag(str(path))
+    assert final.s3_object_matches(remote_object, str(path))
+    # Parts of another size give another ETag; with the same size the object counts as unchanged
+    assert final.s3_object_matches(dict(remote_object, etag='0' * 32 + '-3'), str(path))
+    assert not final.s3_object_matches(dict(remote_object, etag='0' * 32 + '-2'), str(path))
+
+
+def test_reconcile_finds_new_changed_and_remote_only_objects(s3, tmp_path, monkeypatch):
+    output_dir, failed_dir = str(tmp_path / "COMPRESS"), str(tmp_path / "FAILED")
+    write_pdfs(output_dir, ['LAN001', 'LAN002', 'LAN003'])
+    os.makedirs(failed_dir)
+    final.uploading_to_s3(output_dir, 'run', BUCKET, *CREDENTIALS, failed_dir, reconcile=True)
+    s3.put_object(Bucket=BUCKET, Key='run/', Body=b'')
+    s3.put_object(Bucket=BUCKET, Key='run/OLD001.pdf', Body=b'%PDF-1.4')
+
+    # Same size, other content
+    write_pdfs(output_dir, ['LAN002'])
+    with open(os.path.join(output_dir, "LAN002.pdf"), 'r+b') as f:
+        f.write(b'%PDF-1.5')
+    write_pdfs(output_dir, ['LAN004'])
+    paths = [os.path.join(output_dir, f"{name}.pdf") for name in ['LAN001', 'LAN002', 'LAN003', 'LAN004']]
+
+    inventory = final.reconcile_s3(paths, 'run', BUCKET, *CREDENTIALS, num_workers=2)
+    assert inventory == {'new': [paths[3]], 'changed': [paths[1]], 'unchanged': [paths[0], paths[2]], 'remote_only': ['run/OLD001.pdf']}
+
+    # Only the new and changed files are uploaded again
+    uploads = []
+    upload_to_s3 = final.upload_to_s3
+    monkeypatch.setattr(final, 'upload_to_s3', lambda path, *args: uploads.append(os.path.basename(path)) or upload_to_s3(path, *args))
+    final.uploading_to_s3(output_dir, 'run', BUCKET, *CREDENTIALS, failed_dir, reconcile=True)
+    assert sorted(uploads) == ['LAN002.pdf', 'LAN004.pdf']
+    assert final.reconcile_s3(paths, 'run', BUCKET, *CREDENTIALS)['unchanged'] == paths
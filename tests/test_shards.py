@@ -0,0 +1,103 @@
+import json
+import os
+import sys
+import threading
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import final
+
+
+def test_workers_claim_different_shards(tmp_path):
+    shard_queue = final.SQLiteShardQueue(str(tmp_path / "shards.sqlite"))
+    shard_queue.put([("one", {'name': "one"}), ("two", {'name': "two"})])
+    # Putting a shard again leaves it as it is
+    shard_queue.put([("one", {'name': "changed"})])
+
+    first, second = shard_queue.claim("worker-a"), shard_queue.claim("worker-b")
+    assert (first, second) == (("one", {'name': "one"}, 1), ("two", {'name': "two"}, 1))
+    assert shard_queue.claim("worker-c") is None
+    assert shard_queue.counts() == {'running': 2}
+
+    shard_queue.complete("one", "worker-a", {'status': 'ok'})
+    assert shard_queue.counts() == {'done': 1, 'running': 1}
+
+
+def test_expired_lease_is_claimed_again(tmp_path):
+    shard_queue = final.SQLiteShardQueue(str(tmp_path / "shards.sqlite"), lease_seconds=0.3, max_attempts=2)
+    shard_queue.put([("one", {'name': "one"})])
+    assert shard_queue.claim("worker-a")[2] == 1
+
+    # Renewing keeps the shard with its worker past the first lease
+    for _ in range(3):
+        time.sleep(0.15)
+        shard_queue.renew("one", "worker-a")
+    assert shard_queue.claim("worker-b") is None
+
+    time.sleep(0.4)
+    assert shard_queue.claim("worker-b") == ("one", {'name': "one"}, 2)
+    # The lost worker can't complete a shard that was handed on
+    shard_queue.renew("one", "worker-a")
+    shard_queue.complete("one", "worker-a", {'status': 'ok'})
+    assert shard_queue.get_shards()[0]['status'] == 'running'
+    assert shard_queue.get_shards()[0]['worker'] == "worker-b"
+
+    # After max_attempts expired leases the shard is given up
+    time.sleep(0.4)
+    assert shard_queue.claim("worker-c") is None
+    shard = shard_queue.get_shards()[0]
+    assert shard['status'] == 'failed'
+    assert shard['summary'] == {'status': 'failed', 'error': 'lease expired'}
+
+
+def test_failed_shard_is_retried_until_its_attempts_run_out(tmp_path):
+    shard_queue = final.SQLiteShardQueue(str(tmp_path / "shards.sqlite"), max_attempts=2)
+    shard_queue.put([("one", {'name': "one"})])
+    for attempt, status in ((1, 'pending'), (2, 'failed')):
+        assert shard_queue.claim("worker-a")[2] == attempt
+        shard_queue.complete("one", "worker-a", {'status': 'failed', 'error': "render failed"})
+        assert shard_queue.counts() == {status: 1}
+
+
+def test_coordinator_merges_the_shard_manifests(tmp_path, monkeypatch):
+    pd.DataFrame({'SrNo': range(1, 7), 'LAN_Details': [f"LAN00{index}" for index in range(1, 7)], 'State': 'X'}).to_csv(tmp_path / "lang_data.csv", index=False)
+    spec_path = tmp_path / "spec.json"
+    spec_path.write_text(json.dumps({'name': "march", 'input': "lang_data.csv", 'stages': ["render"], 'shard_size': 2, 'incremental': True}))
+    spec = final.load_shard_spec(str(spec_path))
+    os.makedirs(spec['work_dir'])
+    shard_queue = final.get_shard_queue(spec['queue'])
+    shard_queue.put(final.create_shards(spec))
+
+    ran = []
+
+    def run_job(job, resume=False):
+        # Stands in for a shard's run: its manifest gets one row per record
+        ran.append((threading.current_thread().name, job['name']))
+        df = final.load_lang_data(job['input'])
+        manifest = final.Manifest(os.path.join(job['work_dir'], "manifest.sqlite"))
+        try:
+            manifest.record_rendered([(name, f"hash-{name}", "template") for name in df['LAN_Details']])
+        finally:
+            manifest.close()
+        return {'name': job['name'], 'status': 'ok'}
+
+    monkeypatch.setattr(final, 'run_job', run_job)
+    workers = [threading.Thread(target=final.run_shard_worker, args=(spec['queue'], f"worker-{index}", 0.05), name=f"worker-{index}") for index in range(2)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert sorted(name for _, name in ran) == ["srno-1-2", "srno-3-4", "srno-5-6"]
+    shards = final.run_coordinator(str(spec_path), num_workers=0, poll_interval=0.05)
+    assert [shard['status'] for shard in shards] == ['done'] * 3
+
+    manifest = final.Manifest(os.path.join(spec['work_dir'], "manifest.sqlite"))
+    try:
+        entries = manifest.get_entries()
+    finally:
+        manifest.close()
+    assert sorted(entries) == [f"LAN00{index}" for index in range(1, 7)]
+    assert entries["LAN004"]['record_hash'] == "hash-LAN004"